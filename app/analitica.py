@@ -0,0 +1,246 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Greatest
+
+from .calendario import MINUTOS_BLOQUE, Calendario
+from .models import Asignacion, Reserva, ResumenDiario
+
+# Horas disponibles por día para el personal sin turnos registrados; con
+# turnos, la ocupación se mide contra los bloques de sus turnos (ver
+# app.calendario).
+JORNADA = timedelta(hours=8)
+# Días que se recalculan juntos al reconstruir todo.
+DIAS_POR_LOTE = 31
+
+
+def _minutos(hora_inicio, hora_fin):
+    if hora_fin is None:
+        return 0
+    return int((hora_fin - hora_inicio).total_seconds() // 60)
+
+
+def contribuciones(reservas):
+    # Lo que aportan esas reservas a los resúmenes:
+    # {(fecha, personal asignado, tipo de ubicación, estado): [reservas, minutos]}.
+    # Los minutos se truncan por tarea, no por grupo, para que sumar y restar
+    # una tarea suelta dé lo mismo que reconstruir().
+    filas = reservas.values_list(
+        'id', 'fecha_reserva', 'asignacion__usuario_id', 'tipo_ubicacion', 'estado',
+        'asignacion__historialtarea__hora_inicio', 'asignacion__historialtarea__hora_fin',
+    ).order_by()
+    totales = defaultdict(lambda: [0, 0])
+    vistas = set()
+    for reserva_id, fecha, usuario_id, tipo, estado, hora_inicio, hora_fin in filas.iterator(chunk_size=2000):
+        clave = (fecha, usuario_id, tipo, estado)
+        if (reserva_id, clave) not in vistas:
+            vistas.add((reserva_id, clave))
+            totales[clave][0] += 1
+        totales[clave][1] += _minutos(hora_inicio, hora_fin)
+    return totales
+
+
+def de_reservas(reserva_ids):
+    reserva_ids = set(reserva_ids)
+    if not reserva_ids:
+        return {}
+    return contribuciones(Reserva.objects.filter(id__in=reserva_ids))
+
+
+def _sumar(clave, reservas, minutos):
+    fecha, usuario_id, tipo, estado = clave
+    filas = ResumenDiario.objects.filter(fecha=fecha, usuario_id=usuario_id, tipo_ubicacion=tipo, estado=estado)
+    actualizadas = filas.update(
+        # Greatest: un resumen desviado (editado a mano, por ejemplo) no
+        # rompe la escritura que lo actualiza; reconstruir() lo corrige.
+        reservas=Greatest(F('reservas') + reservas, Value(0)),
+        minutos_trabajados=Greatest(F('minutos_trabajados') + minutos, Value(0)),
+    )
+    if not actualizadas:
+        ResumenDiario.objects.create(
+            fecha=fecha, usuario_id=usuario_id, tipo_ubicacion=tipo, estado=estado,
+            reservas=max(reservas, 0), minutos_trabajados=max(minutos, 0),
+        )
+    elif reservas < 0:
+        filas.filter(reservas=0).delete()
+
+
+def aplicar(antes, despues):
+    # Suma a los resúmenes la diferencia entre dos contribuciones. Corre
+    # dentro de la transacción que hizo el cambio: se confirma o se deshace
+    # con ella y no agrega otra escritura después del commit.
+    for clave in set(antes) | set(despues):
+        reservas_antes, minutos_antes = antes.get(clave, (0, 0))
+        reservas_despues, minutos_despues = despues.get(clave, (0, 0))
+        if reservas_antes != reservas_despues or minutos_antes != minutos_despues:
+            _sumar(clave, reservas_despues - reservas_antes, minutos_despues - minutos_antes)
+
+
+# Reservas que está midiendo un cambios_de_reservas() en curso; las señales
+# de sus filas no aplican nada para no contarlas dos veces.
+_medidas = ContextVar('reservas_medidas', default=frozenset())
+
+
+def medida(reserva_id):
+    return reserva_id in _medidas.get()
+
+
+@contextmanager
+def cambios_de_reservas(reserva_ids):
+    # Para escrituras en lote, que no disparan señales (bulk_create,
+    # bulk_update, update()): se mide la contribución de esas reservas antes
+    # y después y se aplica la diferencia.
+    reserva_ids = set(reserva_ids)
+    antes = de_reservas(reserva_ids)
+    token = _medidas.set(_medidas.get() | reserva_ids)
+    try:
+        yield
+    finally:
+        _medidas.reset(token)
+    aplicar(antes, de_reservas(reserva_ids))
+
+
+def antes_de_guardar(reserva_id):
+    # pre_save de Reserva, Asignacion o HistorialTarea.
+    if reserva_id is None or medida(reserva_id):
+        return {}
+    return de_reservas([reserva_id])
+
+
+def despues_de_guardar(reserva_id, antes):
+    # post_save: la fila ya cambió y nada más lo hizo entre medio.
+    if not medida(reserva_id):
+        aplicar(antes, de_reservas([reserva_id]))
+
+
+# Al borrar una reserva, Django borra primero sus tareas y asignaciones y
+# manda todos los pre_delete antes de empezar, así que una foto tomada en
+# pre_delete ya no sirve para la segunda fila. Cada borrado resta solo lo que
+# aportaba su propia fila, leyendo el resto del estado en post_delete.
+
+def tarea_borrada(tarea):
+    fila = Asignacion.objects.filter(id=tarea.asignacion_id).values_list(
+        'reserva_id', 'usuario_id', 'reserva__fecha_reserva', 'reserva__tipo_ubicacion', 'reserva__estado',
+    ).first()
+    if fila is None or medida(fila[0]):
+        return
+    _, usuario_id, fecha, tipo, estado = fila
+    minutos = _minutos(tarea.hora_inicio, tarea.hora_fin)
+    if minutos:
+        aplicar({(fecha, usuario_id, tipo, estado): (0, minutos)}, {})
+
+
+def asignacion_borrada(asignacion):
+    reserva = Reserva.objects.filter(id=asignacion.reserva_id).values_list(
+        'fecha_reserva', 'tipo_ubicacion', 'estado',
+    ).first()
+    if reserva is None or medida(asignacion.reserva_id):
+        return
+    fecha, tipo, estado = reserva
+    # Sus tareas ya se restaron al borrarse en cascada.
+    quedan = set(Asignacion.objects.filter(reserva_id=asignacion.reserva_id).values_list('usuario_id', flat=True))
+    antes, despues = {}, {}
+    if asignacion.usuario_id not in quedan:
+        antes[(fecha, asignacion.usuario_id, tipo, estado)] = (1, 0)
+    if not quedan:
+        despues[(fecha, None, tipo, estado)] = (1, 0)
+    aplicar(antes, despues)
+
+
+def reserva_borrada(reserva):
+    # Sus asignaciones ya se borraron: la reserva contaba como sin asignar.
+    if not medida(reserva.pk):
+        aplicar({(reserva.fecha_reserva, None, reserva.tipo_ubicacion, reserva.estado): (1, 0)}, {})
+
+
+def _agregar(reservas):
+    return [
+        ResumenDiario(
+            fecha=fecha, usuario_id=usuario_id, tipo_ubicacion=tipo, estado=estado,
+            reservas=cantidad, minutos_trabajados=minutos,
+        )
+        for (fecha, usuario_id, tipo, estado), (cantidad, minutos) in contribuciones(reservas).items()
+    ]
+
+
+def reconstruir(desde=None, hasta=None):
+    reservas = Reserva.objects.all()
+    if desde:
+        reservas = reservas.filter(fecha_reserva__gte=desde)
+    if hasta:
+        reservas = reservas.filter(fecha_reserva__lte=hasta)
+    rango = reservas.order_by().values_list('fecha_reserva', flat=True)
+    primera = rango.order_by('fecha_reserva').first()
+    ultima = rango.order_by('-fecha_reserva').first()
+
+    resumenes = ResumenDiario.objects.all()
+    if desde:
+        resumenes = resumenes.filter(fecha__gte=desde)
+    if hasta:
+        resumenes = resumenes.filter(fecha__lte=hasta)
+
+    total = 0
+    with transaction.atomic():
+        resumenes.delete()
+        inicio = primera
+        while inicio is not None and inicio <= ultima:
+            fin = min(inicio + timedelta(days=DIAS_POR_LOTE - 1), ultima)
+            nuevos = _agregar(reservas.filter(fecha_reserva__range=(inicio, fin)))
+            ResumenDiario.objects.bulk_create(nuevos)
+            total += len(nuevos)
+            inicio = fin + timedelta(days=1)
+    return total
+
+
+def _capacidad(calendario, usuario_id, desde, dias):
+    # Minutos laborables del personal en el rango, descontando feriados.
+    total = 0
+    for i in range(dias):
+        laborable = calendario.laborable(usuario_id, desde + timedelta(days=i))
+        if laborable and usuario_id not in calendario.turnos:
+            total += JORNADA.total_seconds() // 60
+        else:
+            total += laborable.bit_count() * MINUTOS_BLOQUE
+    return total
+
+
+def panel(desde, hasta):
+    # Todo lo que muestra el panel de administración, leído solo de los resúmenes.
+    resumenes = ResumenDiario.objects.filter(fecha__range=(desde, hasta))
+
+    por_dia = defaultdict(lambda: defaultdict(int))
+    for fecha, estado, cantidad in resumenes.values_list('fecha', 'estado').annotate(total=Sum('reservas')).order_by():
+        por_dia[fecha][estado] += cantidad
+
+    por_tipo = dict(resumenes.values_list('tipo_ubicacion').annotate(total=Sum('reservas')).order_by())
+
+    dias = (hasta - desde).days + 1
+    calendario = Calendario.cargar()
+    ocupacion = []
+    filas = (
+        resumenes.filter(usuario__isnull=False)
+        .values('usuario_id', 'usuario__nombre')
+        .annotate(reservas=Sum('reservas'), minutos=Sum('minutos_trabajados'))
+        .order_by('usuario__nombre')
+    )
+    for f in filas:
+        capacidad = _capacidad(calendario, f['usuario_id'], desde, dias)
+        ocupacion.append({
+            'nombre': f['usuario__nombre'],
+            'reservas': f['reservas'],
+            'horas_trabajadas': round(f['minutos'] / 60, 1),
+            'porcentaje': round(100 * f['minutos'] / capacidad) if capacidad else 0,
+        })
+
+    return {
+        'dias': [
+            {'fecha': fecha.isoformat(), **estados}
+            for fecha, estados in sorted(por_dia.items())
+        ],
+        'por_tipo': por_tipo,
+        'ocupacion': ocupacion,
+    }
@@ -0,0 +1,43 @@
+import random
+import time
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+
+def configurar_sqlite(conexion):
+    # Se llama en cada conexión nueva (ver app.signals). Con
+    # CONN_MAX_AGE las conexiones se reutilizan, así que esto corre una vez por
+    # conexión y no por petición.
+    if conexion.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with conexion.cursor() as cursor:
+        for nombre, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {nombre} = {valor}')
+
+
+def _bloqueada(error):
+    mensaje = str(error).lower()
+    return 'locked' in mensaje or 'busy' in mensaje
+
+
+def atomico_con_reintentos(funcion, *args, **kwargs):
+    # Ejecuta funcion() dentro de transaction.atomic() y repite solo esa
+    # transacción cuando SQLite sigue bloqueada después de busy_timeout. El
+    # error llega antes del commit (BEGIN IMMEDIATE o el propio COMMIT), así
+    # que lo hecho se deshizo y repetirlo no duplica nada. Los on_commit se
+    # registran con robust=True: un fallo posterior al commit nunca sale de
+    # aquí. Dentro de un atomic() ajeno no se reintenta, porque habría que
+    # repetir también el trabajo del llamador.
+    if connection.in_atomic_block:
+        with transaction.atomic():
+            return funcion(*args, **kwargs)
+    intentos = getattr(settings, 'SQLITE_REINTENTOS', 3)
+    for intento in range(intentos + 1):
+        try:
+            with transaction.atomic():
+                return funcion(*args, **kwargs)
+        except OperationalError as error:
+            if intento == intentos or not _bloqueada(error):
+                raise
+            time.sleep(0.05 * 2 ** intento * random.uniform(0.5, 1.5))
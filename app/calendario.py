@@ -0,0 +1,105 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+from .models import Feriado, Turno
+
+# Se invalida desde el proceso que guarda un Turno o Feriado y los demás
+# workers tienen que enterarse.
+cache = ConnectionProxy(caches, 'compartida')
+
+# Cada día se divide en bloques de 15 minutos; un int de 96 bits representa
+# un día completo, con el bit i encendido para el bloque que empieza en i*15 min.
+MINUTOS_BLOQUE = 15
+BLOQUES_DIA = 24 * 60 // MINUTOS_BLOQUE
+DIA_COMPLETO = (1 << BLOQUES_DIA) - 1
+
+CLAVE_CALENDARIO = 'calendario:turnos'
+# Los cambios de Turno y Feriado lo invalidan; el límite cubre los que no pasan
+# por el ORM (una edición directa en la base, por ejemplo).
+CACHE_TIMEOUT = 60 * 10
+
+
+def bloque(momento, hacia_arriba=False):
+    # Índice del bloque que contiene `momento` (datetime o time); con
+    # `hacia_arriba`, el primer bloque que empieza en o después de él.
+    minutos = momento.hour * 60 + momento.minute
+    if hacia_arriba and (minutos % MINUTOS_BLOQUE or momento.second or momento.microsecond):
+        return minutos // MINUTOS_BLOQUE + 1
+    return minutos // MINUTOS_BLOQUE
+
+
+def mascara(desde, hasta):
+    # Bits [desde, hasta) encendidos.
+    if hasta <= desde:
+        return 0
+    return ((1 << (hasta - desde)) - 1) << desde
+
+
+def tramos(inicio, fin):
+    # Parte el intervalo [inicio, fin) en (fecha, máscara) por día, redondeando
+    # hacia afuera a bloques completos.
+    fecha = inicio.date()
+    primero = bloque(inicio)
+    while True:
+        if fin.date() == fecha:
+            yield fecha, mascara(primero, bloque(fin, hacia_arriba=True))
+            return
+        yield fecha, mascara(primero, BLOQUES_DIA)
+        fecha += timedelta(days=1)
+        primero = 0
+        if datetime.combine(fecha, time.min) >= fin:
+            return
+
+
+def mascara_turno(hora_inicio, hora_fin):
+    # Un turno que termina a las 00:00 llega hasta el final del día.
+    fin = BLOQUES_DIA if hora_fin == time.min else bloque(hora_fin, hacia_arriba=True)
+    return mascara(bloque(hora_inicio), fin)
+
+
+def _cargar_datos():
+    turnos = defaultdict(lambda: [0] * 7)
+    for usuario_id, dia, hora_inicio, hora_fin in Turno.objects.values_list(
+        'usuario_id', 'dia_semana', 'hora_inicio', 'hora_fin'
+    ):
+        turnos[usuario_id][dia] |= mascara_turno(hora_inicio, hora_fin)
+
+    feriados = defaultdict(set)
+    for fecha, usuario_id in Feriado.objects.values_list('fecha', 'usuario_id'):
+        feriados[fecha].add(usuario_id)
+
+    return dict(turnos), dict(feriados)
+
+
+def invalidar_calendario():
+    cache.delete(CLAVE_CALENDARIO)
+
+
+class Calendario:
+    # Bloques laborables de cada personal según sus turnos semanales y los
+    # feriados. Los turnos se guardan ya convertidos a una máscara por día de
+    # la semana, así que consultar un día es un acceso a lista.
+
+    def __init__(self, turnos, feriados):
+        self.turnos = turnos
+        self.feriados = feriados
+
+    @classmethod
+    def cargar(cls):
+        datos = cache.get(CLAVE_CALENDARIO)
+        if datos is None:
+            datos = _cargar_datos()
+            cache.set(CLAVE_CALENDARIO, datos, CACHE_TIMEOUT)
+        return cls(*datos)
+
+    def laborable(self, usuario_id, fecha):
+        libres = self.feriados.get(fecha)
+        if libres and (None in libres or usuario_id in libres):
+            return 0
+        semana = self.turnos.get(usuario_id)
+        if semana is None:
+            return DIA_COMPLETO
+        return semana[fecha.weekday()]
@@ -0,0 +1,33 @@
+from django.db import transaction
+from django.db.models import F
+
+from .analitica import cambios_de_reservas
+from .eventos import programar_eventos, tipo_por_estado
+from .horario import invalidar_semana
+from .models import Reserva
+
+
+def actualizar_reserva(reserva, version, excluir_estados=(), **cambios):
+    # UPDATE condicionado a que la reserva siga en `version`: si otra petición
+    # la modificó después de leerla, no se escribe nada y devuelve False.
+    # update() no dispara señales, así que aquí se invalida lo mismo que en
+    # app.signals.
+    with cambios_de_reservas([reserva.pk]):
+        filas = (
+            Reserva.objects.filter(pk=reserva.pk, version=version)
+            .exclude(estado__in=excluir_estados)
+            .update(version=F('version') + 1, **cambios)
+        )
+    if not filas:
+        return False
+
+    fechas = {reserva.fecha_reserva, cambios.get('fecha_reserva', reserva.fecha_reserva)}
+    tipo = tipo_por_estado(reserva.estado, cambios.get('estado', reserva.estado))
+    for campo, valor in cambios.items():
+        setattr(reserva, campo, valor)
+    reserva.version = version + 1
+
+    for fecha in fechas:
+        transaction.on_commit(lambda fecha=fecha: invalidar_semana(fecha), robust=True)
+    programar_eventos(tipo, [reserva.pk])
+    return True
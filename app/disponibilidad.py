@@ -0,0 +1,274 @@
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+
+from .calendario import BLOQUES_DIA, DIA_COMPLETO, MINUTOS_BLOQUE, Calendario, bloque, mascara, tramos
+from .duraciones import duracion_aprendida
+from .geografia import RejillaEspacial
+from .models import Usuario, Asignacion
+
+DURACION_RESERVA = timedelta(hours=2)
+
+# Horas de inicio que se ofrecen como sugerencia, cada 30 minutos.
+HORA_APERTURA = time(8)
+HORA_CIERRE = time(20)
+PASO_SUGERENCIAS = 2
+
+
+def duracion_reserva(tipo_ubicacion=None):
+    # Por orden: la duración fija del tipo en settings.DURACION_POR_TIPO, la
+    # aprendida de las tareas reales (DURACION_APRENDIDA) o las 2 horas fijas.
+    por_tipo = getattr(settings, 'DURACION_POR_TIPO', {})
+    if tipo_ubicacion in por_tipo:
+        return por_tipo[tipo_ubicacion]
+    return duracion_aprendida() or DURACION_RESERVA
+
+
+def margen_traslado():
+    # Tiempo que el personal sigue ocupado después de terminar un trabajo.
+    return getattr(settings, 'MARGEN_TRASLADO', DURACION_RESERVA)
+
+
+def _duracion_maxima():
+    return max([duracion_reserva(), *getattr(settings, 'DURACION_POR_TIPO', {}).values()])
+
+
+class IndiceDisponibilidad:
+    # Ocupación del personal como bits por bloque de 15 minutos de cada día
+    # (ver app.calendario): saber si alguien está libre es un AND entre su
+    # máscara del día y la del intervalo pedido. Cada trabajo ocupa su duración
+    # más el margen de traslado. Se guardan también los inicios ordenados para
+    # saber qué trabajo queda antes o después de un momento dado.
+
+    def __init__(self, personal, calendario=None, margen=None):
+        self.personal = list(personal)
+        self.calendario = calendario or Calendario.cargar()
+        self.margen = margen if margen is not None else margen_traslado()
+        self.ocupacion = defaultdict(list)
+        self.bloques = defaultdict(int)
+        # Por personal: inicio -> fin ocupado, para poder liberar trabajos.
+        self._fines = defaultdict(dict)
+        # Por fecha: (latitud, longitud, usuario_id, inicio) de cada trabajo ubicado.
+        self.trabajos = defaultdict(list)
+        self._rejillas = {}
+
+    @classmethod
+    def cargar(cls, desde, hasta, personal=None):
+        # Una asignación choca con [desde, hasta) si empieza antes de `hasta`
+        # y termina, con su margen, después de `desde`.
+        margen = margen_traslado()
+        asignaciones = Asignacion.objects.filter(
+            reserva__fecha_reserva__range=((desde - _duracion_maxima() - margen).date(), hasta.date())
+        ).exclude(reserva__estado='completada')
+
+        if personal is None:
+            personal = Usuario.objects.filter(rol='personal', estado='activo')
+        else:
+            personal = list(personal)
+            asignaciones = asignaciones.filter(usuario_id__in=[p.id for p in personal])
+
+        asignaciones = asignaciones.values_list(
+            'usuario_id', 'reserva__fecha_reserva', 'reserva__hora_reserva', 'reserva__tipo_ubicacion',
+            'reserva__latitud', 'reserva__longitud'
+        )
+
+        indice = cls(personal, margen=margen)
+        duraciones = {}
+        for usuario_id, fecha, hora, tipo_ubicacion, latitud, longitud in asignaciones:
+            if tipo_ubicacion not in duraciones:
+                duraciones[tipo_ubicacion] = duracion_reserva(tipo_ubicacion)
+            indice.ocupar(
+                usuario_id, datetime.combine(fecha, hora), latitud, longitud,
+                duracion=duraciones[tipo_ubicacion]
+            )
+        return indice
+
+    def _libre(self, usuario_id, partes):
+        # Libre si ningún bloque pedido está ocupado y todos caen dentro de su turno.
+        for fecha, bits in partes:
+            if self.bloques.get((usuario_id, fecha), 0) & bits:
+                return False
+            if bits & ~self.calendario.laborable(usuario_id, fecha):
+                return False
+        return True
+
+    def esta_libre(self, usuario_id, inicio, fin):
+        return self._libre(usuario_id, tramos(inicio, fin))
+
+    def libres(self, inicio, fin):
+        partes = list(tramos(inicio, fin))
+        return [p for p in self.personal if self._libre(p.id, partes)]
+
+    def _libres_dia(self, usuario_id, fecha):
+        return self.calendario.laborable(usuario_id, fecha) & ~self.bloques.get((usuario_id, fecha), 0)
+
+    def inicios_libres(self, fecha, bloques_necesarios):
+        # Máscara de los bloques de `fecha` donde alguien del personal puede
+        # empezar un trabajo de `bloques_necesarios` bloques. Se junta el día
+        # siguiente para los trabajos que cruzan la medianoche.
+        manana = fecha + timedelta(days=1)
+        resultado = 0
+        for p in self.personal:
+            libres = self._libres_dia(p.id, fecha) | (self._libres_dia(p.id, manana) << BLOQUES_DIA)
+            # Tras k pasos, el bit b sigue encendido solo si b..b+k están libres.
+            inicios = libres
+            for _ in range(bloques_necesarios - 1):
+                inicios &= inicios >> 1
+                if not inicios:
+                    break
+            resultado |= inicios & DIA_COMPLETO
+        return resultado
+
+    def _marcar(self, usuario_id, inicio, fin):
+        for fecha, bits in tramos(inicio, fin):
+            self.bloques[(usuario_id, fecha)] |= bits
+
+    def ocupar(self, usuario_id, inicio, latitud=None, longitud=None, tipo_ubicacion=None, duracion=None):
+        fin = inicio + (duracion or duracion_reserva(tipo_ubicacion)) + self.margen
+        fines = self._fines[usuario_id]
+        if inicio not in fines:
+            insort(self.ocupacion[usuario_id], inicio)
+        fines[inicio] = max(fin, fines.get(inicio, fin))
+        self._marcar(usuario_id, inicio, fin)
+        if latitud is not None and longitud is not None:
+            self.trabajos[inicio.date()].append((latitud, longitud, usuario_id, inicio))
+            rejilla = self._rejillas.get(inicio.date())
+            if rejilla is not None:
+                rejilla.agregar(latitud, longitud, (usuario_id, inicio))
+
+    def liberar(self, usuario_id, inicio):
+        # Quita un trabajo y vuelve a marcar los días que tocaba, por si otro
+        # trabajo compartía alguno de sus bloques.
+        fin = self._fines[usuario_id].pop(inicio, None)
+        if fin is None:
+            return
+        self.ocupacion[usuario_id].remove(inicio)
+        fechas = [fecha for fecha, _ in tramos(inicio, fin)]
+        for fecha in fechas:
+            self.bloques.pop((usuario_id, fecha), None)
+        for otro_inicio, otro_fin in self._fines[usuario_id].items():
+            if otro_inicio.date() <= fechas[-1] and otro_fin.date() >= fechas[0]:
+                self._marcar(usuario_id, otro_inicio, otro_fin)
+
+    def _rejilla(self, fecha):
+        rejilla = self._rejillas.get(fecha)
+        if rejilla is None:
+            rejilla = self._rejillas[fecha] = RejillaEspacial()
+            for latitud, longitud, usuario_id, inicio in self.trabajos.get(fecha, ()):
+                rejilla.agregar(latitud, longitud, (usuario_id, inicio))
+        return rejilla
+
+    def _es_adyacente(self, usuario_id, inicio, momento):
+        # `inicio` es el trabajo inmediatamente anterior o siguiente a `momento`.
+        inicios = self.ocupacion.get(usuario_id, [])
+        i = bisect_left(inicios, momento)
+        return inicio in inicios[max(i - 1, 0):i + 1]
+
+    def por_cercania(self, candidatos, momento, latitud, longitud):
+        # Primero el personal cuyo trabajo anterior o siguiente de ese día queda
+        # más cerca de la nueva reserva; luego el resto, en el orden original.
+        # Es un generador: quien solo necesita el primero no paga por ordenar a todos.
+        por_id = {p.id: p for p in candidatos}
+        entregados = set()
+        for _, (usuario_id, inicio) in self._rejilla(momento.date()).cercanos(latitud, longitud):
+            if usuario_id in por_id and usuario_id not in entregados and self._es_adyacente(usuario_id, inicio, momento):
+                entregados.add(usuario_id)
+                yield por_id[usuario_id]
+                if len(entregados) == len(por_id):
+                    return
+        for p in candidatos:
+            if p.id not in entregados:
+                yield p
+
+
+def ventana_reserva(fecha, hora, tipo_ubicacion=None):
+    # Intervalo que ocupa una reserva nueva, sin contar el margen de traslado.
+    fecha_hora_reserva = datetime.combine(fecha, hora)
+    return fecha_hora_reserva, fecha_hora_reserva + duracion_reserva(tipo_ubicacion)
+
+
+def choca(inicio_existente, tipo_existente, inicio_nuevo, tipo_nuevo):
+    # La misma regla que IndiceDisponibilidad: el trabajo existente, con su
+    # margen de traslado, no puede pisar el intervalo del nuevo.
+    fin_existente = inicio_existente + duracion_reserva(tipo_existente) + margen_traslado()
+    return inicio_existente < inicio_nuevo + duracion_reserva(tipo_nuevo) and inicio_nuevo < fin_existente
+
+
+def reclamar_personal(candidatos, fecha, hora, tipo_ubicacion=None):
+    # Debe llamarse dentro de transaction.atomic(). Bloquea la fila del personal
+    # y vuelve a revisar su agenda antes de entregarlo. En SQLite, donde
+    # select_for_update no existe, la exclusión la da la transacción IMMEDIATE
+    # configurada en settings, que serializa a los escritores.
+    inicio, fin = ventana_reserva(fecha, hora, tipo_ubicacion)
+    for candidato in candidatos:
+        bloqueado = Usuario.objects.select_for_update().filter(pk=candidato.pk, estado='activo').first()
+        if bloqueado is None:
+            continue
+        indice = IndiceDisponibilidad.cargar(inicio, fin, personal=[bloqueado])
+        if indice.esta_libre(bloqueado.id, inicio, fin):
+            return bloqueado
+    return None
+
+
+def asignar_en_lote(reservas, fecha_asignacion):
+    # Asigna en orden cronológico el personal libre más cercano a cada reserva,
+    # marcando su ocupación en el índice para las siguientes.
+    reservas = sorted(reservas, key=lambda r: (r.fecha_reserva, r.hora_reserva, r.id))
+    if not reservas:
+        return [], []
+
+    desde = datetime.combine(reservas[0].fecha_reserva, reservas[0].hora_reserva)
+    hasta = datetime.combine(reservas[-1].fecha_reserva, reservas[-1].hora_reserva) + _duracion_maxima()
+    indice = IndiceDisponibilidad.cargar(desde, hasta)
+
+    nuevas = []
+    sin_asignar = []
+    for reserva in reservas:
+        inicio, fin = ventana_reserva(reserva.fecha_reserva, reserva.hora_reserva, reserva.tipo_ubicacion)
+        candidatos = indice.libres(inicio, fin)
+        if reserva.latitud is not None and reserva.longitud is not None:
+            candidatos = indice.por_cercania(candidatos, inicio, reserva.latitud, reserva.longitud)
+
+        personal = next(iter(candidatos), None)
+        if personal is None:
+            sin_asignar.append(reserva)
+            continue
+
+        indice.ocupar(personal.id, inicio, reserva.latitud, reserva.longitud, reserva.tipo_ubicacion)
+        reserva.estado = 'asignada'
+        nuevas.append(Asignacion(
+            fecha_asignacion=fecha_asignacion,
+            reserva=reserva,
+            usuario=personal
+        ))
+
+    return nuevas, sin_asignar
+
+
+def sugerir_horarios(desde, cantidad=5, tipo_ubicacion=None, dias=14):
+    # Los primeros `cantidad` inicios, desde `desde` y dentro de los próximos
+    # `dias`, en que al menos una persona del personal queda libre.
+    duracion = duracion_reserva(tipo_ubicacion)
+    bloques_necesarios = -(-duracion // timedelta(minutes=MINUTOS_BLOQUE))
+    primer_dia = desde.date()
+    indice = IndiceDisponibilidad.cargar(desde, datetime.combine(primer_dia + timedelta(days=dias), time.min) + duracion)
+
+    apertura = mascara(bloque(HORA_APERTURA), bloque(HORA_CIERRE) + 1)
+    paso = sum(1 << b for b in range(0, BLOQUES_DIA, PASO_SUGERENCIAS))
+
+    horarios = []
+    for i in range(dias):
+        fecha = primer_dia + timedelta(days=i)
+        candidatos = apertura & paso
+        if fecha == primer_dia:
+            candidatos &= mascara(bloque(desde, hacia_arriba=True), BLOQUES_DIA)
+        candidatos &= indice.inicios_libres(fecha, bloques_necesarios)
+        while candidatos and len(horarios) < cantidad:
+            b = (candidatos & -candidatos).bit_length() - 1
+            horarios.append(datetime.combine(fecha, time.min) + timedelta(minutes=b * MINUTOS_BLOQUE))
+            candidatos &= candidatos - 1
+        if len(horarios) >= cantidad:
+            break
+    return horarios
@@ -0,0 +1,114 @@
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import HistorialTarea
+
+CLAVE_DURACION = 'duraciones:aprendida'
+# Los límites evitan que unos pocos registros raros dejen a todos siempre libres u ocupados.
+DURACION_MINIMA = timedelta(minutes=30)
+DURACION_MAXIMA = timedelta(hours=4)
+REDONDEO = timedelta(minutes=15)
+
+
+def percentil(valores, p):
+    # Percentil con interpolación lineal sobre una lista ya ordenada.
+    if not valores:
+        return None
+    posicion = (len(valores) - 1) * p / 100
+    abajo = math.floor(posicion)
+    arriba = math.ceil(posicion)
+    return valores[abajo] + (valores[arriba] - valores[abajo]) * (posicion - abajo)
+
+
+def tareas_medidas(desde=None, hasta=None):
+    # Solo las tareas iniciadas y finalizadas por separado: las que se cerraron
+    # sin "Iniciar tarea" quedan con duración cero y no dicen nada.
+    tareas = HistorialTarea.objects.filter(hora_fin__gt=F('hora_inicio'))
+    if desde:
+        tareas = tareas.filter(hora_inicio__gte=desde)
+    if hasta:
+        tareas = tareas.filter(hora_inicio__lt=hasta)
+    return tareas
+
+
+def _resumir(grupos, percentiles):
+    filas = []
+    for nombre, minutos in sorted(grupos.items()):
+        minutos.sort()
+        fila = {
+            'nombre': nombre,
+            'muestras': len(minutos),
+            'media': round(sum(minutos) / len(minutos), 1),
+        }
+        for p in percentiles:
+            fila[f'p{p}'] = round(percentil(minutos, p), 1)
+        filas.append(fila)
+    return filas
+
+
+def _consulta_estadisticas(tareas):
+    tareas = tareas_medidas() if tareas is None else tareas.filter(hora_fin__gt=F('hora_inicio'))
+    return tareas.values_list(
+        'hora_inicio', 'hora_fin', 'asignacion__usuario__nombre', 'asignacion__reserva__tipo_ubicacion'
+    )
+
+
+def _agrupar(filas, percentiles):
+    por_personal = defaultdict(list)
+    por_tipo = defaultdict(list)
+    for inicio, fin, personal, tipo_ubicacion in filas:
+        minutos = (fin - inicio).total_seconds() / 60
+        por_personal[personal].append(minutos)
+        por_tipo[tipo_ubicacion].append(minutos)
+    return {
+        'personal': _resumir(por_personal, percentiles),
+        'tipo_ubicacion': _resumir(por_tipo, percentiles),
+    }
+
+
+def estadisticas(tareas=None, percentiles=(50, 90)):
+    # Duración en minutos por personal y por tipo de ubicación.
+    return _agrupar(_consulta_estadisticas(tareas).iterator(), percentiles)
+
+
+async def aestadisticas(tareas=None, percentiles=(50, 90)):
+    # values_list().aiterator() ejecuta la consulta en el hilo del event loop
+    # (Django 5.1); iterar el queryset la delega a un hilo.
+    filas = [fila async for fila in _consulta_estadisticas(tareas)]
+    return _agrupar(filas, percentiles)
+
+
+def calcular_duracion_aprendida(percentil_objetivo, dias, minimo_muestras):
+    desde = timezone.now() - timedelta(days=dias)
+    minutos = sorted(
+        (fin - inicio).total_seconds() / 60
+        for inicio, fin in tareas_medidas(desde=desde).values_list('hora_inicio', 'hora_fin').iterator()
+    )
+    if len(minutos) < minimo_muestras:
+        return None
+    duracion = timedelta(minutes=percentil(minutos, percentil_objetivo))
+    # Se redondea hacia arriba a bloques de 15 minutos.
+    duracion = REDONDEO * math.ceil(duracion / REDONDEO)
+    return min(max(duracion, DURACION_MINIMA), DURACION_MAXIMA)
+
+
+def duracion_aprendida():
+    # Devuelve None si está desactivada en settings o si aún no hay suficientes tareas medidas.
+    config = getattr(settings, 'DURACION_APRENDIDA', {})
+    if not config.get('activa'):
+        return None
+    segundos = cache.get(CLAVE_DURACION)
+    if segundos is None:
+        duracion = calcular_duracion_aprendida(
+            config.get('percentil', 80), config.get('dias', 90), config.get('minimo_muestras', 30)
+        )
+        # 0 guarda en caché que no hay datos suficientes.
+        segundos = duracion.total_seconds() if duracion else 0
+        cache.set(CLAVE_DURACION, segundos, config.get('cache', 3600))
+    return timedelta(seconds=segundos) if segundos else None
@@ -0,0 +1,308 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import timedelta
+from importlib import import_module
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.http.cookie import parse_cookie
+from django.utils import timezone
+
+from .models import EventoHorario, Reserva
+from .sesion import aobtener_usuario
+
+logger = logging.getLogger(__name__)
+
+INTERVALO_SONDEO = 1
+# Comentario periódico para que proxies y navegadores no den la conexión por muerta.
+INTERVALO_PING = 15
+# Eventos que se reenvían a una conexión que vuelve; si faltan más, recarga la página.
+MAX_REPETICION = 500
+# Eventos pendientes por conexión; una conexión que no da abasto recarga la página.
+MAX_COLA = 100
+RETENCION = timedelta(days=1)
+# Cada proceso que publica borra los eventos vencidos a lo más una vez por
+# este intervalo (segundos).
+INTERVALO_PURGA = 60 * 60
+LOTE_PUBLICACION = 500
+
+TIPO_POR_ESTADO = {
+    'asignada': 'asignada',
+    'completada': 'completada',
+    'pendiente': 'liberada',
+    'espera': 'liberada',
+}
+
+
+def tipo_por_estado(anterior, nuevo):
+    if anterior == nuevo:
+        return 'modificada'
+    return TIPO_POR_ESTADO.get(nuevo, 'modificada')
+
+
+def _datos(reserva):
+    asignacion = next(iter(reserva.asignacion_set.all()), None)
+    return {
+        'id': reserva.id,
+        'fecha': reserva.fecha_reserva.isoformat(),
+        'hora': reserva.hora_reserva.strftime('%H:%M'),
+        'estado': reserva.estado,
+        'direccion': reserva.direccion,
+        'tipo_ubicacion': reserva.tipo_ubicacion,
+        'cliente': reserva.usuario.nombre,
+        'personal_id': asignacion.usuario_id if asignacion else None,
+        'personal': asignacion.usuario.nombre if asignacion else None,
+    }
+
+
+def publicar(tipo, reserva_ids, usuarios=None):
+    # Un evento por reserva con su estado actual. `usuarios` agrega, por
+    # reserva, quién más debe enterarse (el personal que la perdió, el cliente
+    # de una reserva borrada).
+    usuarios = usuarios or {}
+    reserva_ids = sorted(reserva_ids)
+    for i in range(0, len(reserva_ids), LOTE_PUBLICACION):
+        lote = reserva_ids[i:i + LOTE_PUBLICACION]
+        reservas = {
+            r.id: r
+            for r in Reserva.objects.filter(id__in=lote).select_related('usuario').prefetch_related('asignacion_set__usuario')
+        }
+        eventos = []
+        for reserva_id in lote:
+            reserva = reservas.get(reserva_id)
+            destinatarios = set(usuarios.get(reserva_id, ()))
+            datos = None
+            if reserva is not None:
+                datos = _datos(reserva)
+                destinatarios.add(reserva.usuario_id)
+                if datos['personal_id']:
+                    destinatarios.add(datos['personal_id'])
+            eventos.append(EventoHorario(
+                tipo=tipo, reserva_id=reserva_id, datos=datos, usuarios=sorted(destinatarios)
+            ))
+        EventoHorario.objects.bulk_create(eventos)
+    _purgar_si_toca()
+
+
+_proxima_purga = 0
+
+
+def purgar():
+    return EventoHorario.objects.filter(creado__lt=timezone.now() - RETENCION).delete()[0]
+
+
+def _purgar_si_toca():
+    # La purga va con la escritura y no con el sondeo: así la tabla no crece
+    # aunque nadie tenga una página abierta.
+    global _proxima_purga
+    ahora = time.monotonic()
+    if ahora >= _proxima_purga:
+        _proxima_purga = ahora + INTERVALO_PURGA
+        purgar()
+
+
+def programar_eventos(tipo, reserva_ids, usuarios=None):
+    # Se publica al confirmar, después de invalidar el horario en caché: así
+    # un evento nunca es más nuevo que la página que lo va a recibir. Si el
+    # sitio no sirve el flujo (WSGI), nadie los leería y no se escriben.
+    reserva_ids = set(reserva_ids)
+    if reserva_ids and getattr(settings, 'EVENTOS_EN_VIVO', True):
+        transaction.on_commit(lambda: publicar(tipo, reserva_ids, usuarios), robust=True)
+
+
+async def ultimo_evento():
+    return (await EventoHorario.objects.aaggregate(ultimo=Max('id')))['ultimo'] or 0
+
+
+class Suscriptor:
+    def __init__(self, usuario):
+        self.usuario_id = usuario.id
+        self.administrador = usuario.rol == 'administrador'
+        self.cola = asyncio.Queue(MAX_COLA)
+        self.desbordada = False
+
+    def puede_ver(self, evento):
+        return self.administrador or self.usuario_id in evento.usuarios
+
+    def entregar(self, evento):
+        if not self.puede_ver(evento):
+            return
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.desbordada = True
+
+
+class Difusor:
+    # Una sola consulta periódica a la tabla de eventos por proceso, repartida
+    # a todas las conexiones abiertas. Cada conexión solo guarda su cola, y los
+    # eventos se comparten entre colas.
+
+    def __init__(self):
+        self.suscriptores = set()
+        self.ultimo_id = None
+        self._tarea = None
+        self._listo = None
+
+    async def suscribir(self, usuario):
+        suscriptor = Suscriptor(usuario)
+        self.suscriptores.add(suscriptor)
+        # La tarea se crea sin ceder el control: si se esperara algo antes,
+        # las conexiones que llegan a la vez arrancarían una tarea cada una.
+        if self._tarea is None or self._tarea.done() or self._tarea.get_loop() is not asyncio.get_running_loop():
+            self.ultimo_id = None
+            self._listo = asyncio.Event()
+            self._tarea = asyncio.create_task(self._sondear(self._listo))
+        # Hasta saber desde qué evento sondea, la repetición de perdidos
+        # podría dejar un hueco.
+        try:
+            await self._listo.wait()
+        except BaseException:
+            self.desuscribir(suscriptor)
+            raise
+        return suscriptor
+
+    def desuscribir(self, suscriptor):
+        self.suscriptores.discard(suscriptor)
+
+    async def _sondear(self, listo):
+        # Un error de la base no termina la tarea: las conexiones abiertas
+        # seguirían recibiendo solo pings. Se registra y se reintenta.
+        try:
+            while self.suscriptores:
+                try:
+                    if self.ultimo_id is None:
+                        self.ultimo_id = await ultimo_evento()
+                        listo.set()
+                    eventos = [
+                        e async for e in EventoHorario.objects.filter(id__gt=self.ultimo_id).order_by('id')[:MAX_REPETICION]
+                    ]
+                except Exception:
+                    logger.exception('Falló el sondeo de eventos del horario; se reintenta.')
+                    await asyncio.sleep(INTERVALO_SONDEO)
+                    continue
+                for evento in eventos:
+                    for suscriptor in list(self.suscriptores):
+                        suscriptor.entregar(evento)
+                if eventos:
+                    self.ultimo_id = eventos[-1].id
+
+                if len(eventos) < MAX_REPETICION:
+                    await asyncio.sleep(INTERVALO_SONDEO)
+        finally:
+            listo.set()
+
+
+difusor = Difusor()
+
+
+def _mensaje(evento):
+    datos = json.dumps({'tipo': evento.tipo, 'reserva': evento.reserva_id, 'datos': evento.datos})
+    return f'id: {evento.id}\ndata: {datos}\n\n'
+
+
+RECARGAR = 'event: recargar\ndata: {}\n\n'
+
+
+async def flujo_eventos(usuario, desde=None):
+    # Generador SSE. Se suscribe antes de reenviar lo perdido para no dejar
+    # huecos; los eventos que lleguen por ambos lados se descartan por id.
+    suscriptor = await difusor.suscribir(usuario)
+    try:
+        yield f'retry: {INTERVALO_SONDEO * 3000}\n\n'
+        enviado = desde or 0
+        if desde is not None:
+            perdidos = [
+                e async for e in EventoHorario.objects.filter(id__gt=desde).order_by('id')[:MAX_REPETICION + 1]
+            ]
+            if len(perdidos) > MAX_REPETICION:
+                yield RECARGAR
+                return
+            for evento in perdidos:
+                enviado = evento.id
+                if suscriptor.puede_ver(evento):
+                    yield _mensaje(evento)
+
+        while True:
+            if suscriptor.desbordada:
+                yield RECARGAR
+                return
+            try:
+                evento = await asyncio.wait_for(suscriptor.cola.get(), INTERVALO_PING)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            if evento.id <= enviado:
+                continue
+            enviado = evento.id
+            yield _mensaje(evento)
+    finally:
+        difusor.desuscribir(suscriptor)
+
+
+async def _usuario(scope):
+    encabezados = dict(scope['headers'])
+    cookies = parse_cookie(encabezados.get(b'cookie', b'').decode('latin-1'))
+    clave = cookies.get(settings.SESSION_COOKIE_NAME)
+    if not clave:
+        return None
+    sesion = import_module(settings.SESSION_ENGINE).SessionStore(clave)
+    return await aobtener_usuario(await sesion.aget('usuario_id'))
+
+
+def _desde(scope):
+    valor = dict(scope['headers']).get(b'last-event-id', b'').decode('latin-1')
+    if not valor:
+        valor = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('desde', [''])[0]
+    try:
+        return int(valor) if valor else None
+    except ValueError:
+        return None
+
+
+async def _esperar_desconexion(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def aplicacion_eventos(scope, receive, send):
+    # Aplicación ASGI para el flujo SSE, montada delante de Django en
+    # horarios/asgi.py. Una petición de Django reserva un hilo (y una conexión
+    # a la base) mientras dura; aquí las consultas van al hilo compartido, así
+    # que una conexión abierta cuesta solo su cola y su corrutina.
+    usuario = await _usuario(scope)
+    if usuario is None:
+        await send({'type': 'http.response.start', 'status': 403, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+
+    flujo = flujo_eventos(usuario, _desde(scope))
+
+    async def enviar():
+        async for trozo in flujo:
+            await send({'type': 'http.response.body', 'body': trozo.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    envio = asyncio.create_task(enviar())
+    desconexion = asyncio.create_task(_esperar_desconexion(receive))
+    try:
+        await asyncio.wait({envio, desconexion}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        envio.cancel()
+        desconexion.cancel()
+        await asyncio.gather(envio, desconexion, return_exceptions=True)
+        await flujo.aclose()
@@ -0,0 +1,73 @@
+import csv
+import json
+
+CHUNK_SIZE = 2000
+
+COLUMNAS = ['id', 'fecha', 'hora_inicio', 'hora_fin', 'horas', 'ubicacion', 'personal', 'cliente']
+
+
+class _Eco:
+    # Buffer mínimo para csv.writer: devuelve la línea en vez de guardarla.
+    def write(self, valor):
+        return valor
+
+
+def _consulta(historial):
+    # values(), no values_list(): en Django 5.1 values_list().aiterator()
+    # ejecuta la consulta en el hilo del event loop. Ninguno de los dos crea
+    # instancias de modelo ni llena la caché del queryset.
+    return historial.order_by('hora_inicio', 'id').values(
+        'id', 'hora_inicio', 'hora_fin', 'ubicacion',
+        'asignacion__usuario__nombre', 'asignacion__reserva__usuario__nombre',
+    )
+
+
+def _fila(valores):
+    inicio, fin = valores['hora_inicio'], valores['hora_fin']
+    return {
+        'id': valores['id'],
+        'fecha': inicio.date().isoformat(),
+        'hora_inicio': inicio.isoformat(),
+        'hora_fin': fin.isoformat(),
+        'horas': round((fin - inicio).total_seconds() / 3600, 2),
+        'ubicacion': valores['ubicacion'],
+        'personal': valores['asignacion__usuario__nombre'],
+        'cliente': valores['asignacion__reserva__usuario__nombre'],
+    }
+
+
+def filas_historial(historial):
+    # Se recorre la consulta por bloques de CHUNK_SIZE filas.
+    for valores in _consulta(historial).iterator(chunk_size=CHUNK_SIZE):
+        yield _fila(valores)
+
+
+async def afilas_historial(historial):
+    # Para ASGI: con un iterador síncrono StreamingHttpResponse lo consume
+    # entero con sync_to_async(list) antes de enviar nada.
+    async for valores in _consulta(historial).aiterator(chunk_size=CHUNK_SIZE):
+        yield _fila(valores)
+
+
+def generar_csv(filas):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUMNAS)
+    for fila in filas:
+        yield escritor.writerow([fila[c] for c in COLUMNAS])
+
+
+async def agenerar_csv(filas):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUMNAS)
+    async for fila in filas:
+        yield escritor.writerow([fila[c] for c in COLUMNAS])
+
+
+def generar_ndjson(filas):
+    for fila in filas:
+        yield json.dumps(fila, ensure_ascii=False) + '\n'
+
+
+async def agenerar_ndjson(filas):
+    async for fila in filas:
+        yield json.dumps(fila, ensure_ascii=False) + '\n'
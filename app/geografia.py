@@ -0,0 +1,76 @@
+from collections import defaultdict
+from heapq import heappop, heappush
+from itertools import count
+from math import asin, cos, floor, radians, sin, sqrt
+
+RADIO_TIERRA_KM = 6371.0
+KM_POR_GRADO = 111.32
+CELDA_GRADOS = 0.01
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * asin(sqrt(a))
+
+
+class RejillaEspacial:
+    # Rejilla de celdas de CELDA_GRADOS (~1 km) al estilo geohash. Las
+    # búsquedas recorren anillos de celdas alrededor del punto, así que solo
+    # miden distancias contra los puntos cercanos.
+
+    def __init__(self, tamano=CELDA_GRADOS):
+        self.tamano = tamano
+        self.celdas = defaultdict(list)
+
+    def _celda(self, latitud, longitud):
+        return floor(latitud / self.tamano), floor(longitud / self.tamano)
+
+    def agregar(self, latitud, longitud, dato):
+        self.celdas[self._celda(latitud, longitud)].append((latitud, longitud, dato))
+
+    def _anillo(self, fila, columna, radio):
+        if radio == 0:
+            yield fila, columna
+            return
+        for d in range(-radio, radio + 1):
+            yield fila - radio, columna + d
+            yield fila + radio, columna + d
+        for d in range(-radio + 1, radio):
+            yield fila + d, columna - radio
+            yield fila + d, columna + radio
+
+    def cercanos(self, latitud, longitud):
+        # Genera (distancia_km, dato) en orden creciente de distancia.
+        if not self.celdas:
+            return
+        fila, columna = self._celda(latitud, longitud)
+        km_por_celda = self.tamano * KM_POR_GRADO * max(cos(radians(latitud)), 0.01)
+        monticulo = []
+        desempate = count()
+
+        def cargar(celda):
+            for lat, lon, dato in self.celdas.get(celda, ()):
+                heappush(monticulo, (haversine_km(latitud, longitud, lat, lon), next(desempate), dato))
+
+        radio = 0
+        while True:
+            if (2 * radio + 1) ** 2 > len(self.celdas):
+                # Quedan menos celdas ocupadas que celdas por recorrer en el
+                # anillo: se cargan todas las que faltan de una vez.
+                for f, c in self.celdas:
+                    if max(abs(f - fila), abs(c - columna)) >= radio:
+                        cargar((f, c))
+                break
+            for celda in self._anillo(fila, columna, radio):
+                cargar(celda)
+            # Todo punto fuera de los anillos ya vistos está al menos a esta distancia.
+            limite = radio * km_por_celda
+            while monticulo and monticulo[0][0] <= limite:
+                distancia, _, dato = heappop(monticulo)
+                yield distancia, dato
+            radio += 1
+
+        while monticulo:
+            distancia, _, dato = heappop(monticulo)
+            yield distancia, dato
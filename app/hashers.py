@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.contrib.auth.hashers import ScryptPasswordHasher
+
+
+class ScryptConfigurablePasswordHasher(ScryptPasswordHasher):
+    # Mismo formato que el hasher scrypt de Django, con los parámetros tomados
+    # de settings.HASH_SCRYPT. Al cambiarlos, las contraseñas se vuelven a
+    # calcular en el siguiente login correcto (must_update).
+
+    def _parametro(self, nombre, por_defecto):
+        return getattr(settings, 'HASH_SCRYPT', {}).get(nombre, por_defecto)
+
+    @property
+    def work_factor(self):
+        return self._parametro('work_factor', ScryptPasswordHasher.work_factor)
+
+    @property
+    def block_size(self):
+        return self._parametro('block_size', ScryptPasswordHasher.block_size)
+
+    @property
+    def parallelism(self):
+        return self._parametro('parallelism', ScryptPasswordHasher.parallelism)
+
+    @property
+    def maxmem(self):
+        return self._parametro('maxmem', ScryptPasswordHasher.maxmem)
@@ -0,0 +1,52 @@
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+# Las versiones por semana se comparten entre workers; las páginas no.
+cache = ConnectionProxy(caches, 'compartida')
+
+CACHE_TIMEOUT = 60 * 10
+
+
+def lunes_de(fecha):
+    return fecha - timedelta(days=fecha.weekday())
+
+
+def _clave_version(lunes):
+    return f"horario:version:{lunes.isoformat()}"
+
+
+def _nueva_version():
+    return uuid.uuid4().hex
+
+
+async def aclave_horario(lunes, rol, usuario_id, semana, estado, personal):
+    # Cada semana tiene una versión; invalidarla solo requiere cambiarla y las
+    # entradas antiguas expiran solas. Es un valor al azar y no un contador:
+    # en la caché compartida incr() no es atómico, y si la versión se pierde
+    # (expira o se descarta) la nueva nunca coincide con una anterior.
+    version = await cache.aget_or_set(_clave_version(lunes), _nueva_version, CACHE_TIMEOUT)
+    return f"horario:{lunes.isoformat()}:{version}:{rol}:{usuario_id}:{semana}:{estado}:{personal}"
+
+
+def invalidar_semana(fecha):
+    if isinstance(fecha, str):
+        fecha = date.fromisoformat(fecha)
+    cache.set(_clave_version(lunes_de(fecha)), _nueva_version(), CACHE_TIMEOUT)
+
+
+def construir_grilla(reservas, dias_semana, filtro_estado=''):
+    columnas = {dia['fecha']: i for i, dia in enumerate(dias_semana)}
+    celdas = defaultdict(lambda: [[] for _ in dias_semana])
+
+    for r in reservas:
+        fila = celdas[r.hora_reserva.strftime("%H:%M")]
+        columna = columnas.get(r.fecha_reserva)
+        if columna is None or (filtro_estado and r.estado != filtro_estado):
+            continue
+        fila[columna].append(r)
+
+    return [{'hora': h, 'reservas_por_dia': celdas[h]} for h in sorted(celdas)]
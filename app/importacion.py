@@ -0,0 +1,152 @@
+import csv
+from collections import defaultdict
+from datetime import date, datetime
+
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .analitica import aplicar, de_reservas
+from .eventos import programar_eventos
+from .disponibilidad import asignar_en_lote
+from .horario import invalidar_semana, lunes_de
+from .models import Asignacion, Reserva, Usuario
+from .notificaciones import encolar_correos
+
+COLUMNAS = ('correo', 'fecha', 'hora', 'direccion', 'tipo_ubicacion', 'latitud', 'longitud')
+TIPOS_UBICACION = {valor for valor, _ in Reserva.TIPO_UBICACION_CHOICES}
+
+
+class ResultadoImportacion:
+    def __init__(self):
+        self.asignadas = 0
+        self.pendientes = 0
+        self.duplicadas = 0
+        self.errores = []
+
+    @property
+    def creadas(self):
+        return self.asignadas + self.pendientes
+
+
+def _coordenada(valor):
+    valor = (valor or '').strip()
+    return float(valor) if valor else None
+
+
+def _leer_filas(archivo, resultado):
+    lector = csv.DictReader(archivo)
+    faltantes = [c for c in COLUMNAS if c not in (lector.fieldnames or [])]
+    if faltantes:
+        resultado.errores.append((1, f"Faltan columnas: {', '.join(faltantes)}."))
+        return []
+
+    filas = []
+    for fila in lector:
+        try:
+            tipo_ubicacion = fila['tipo_ubicacion'].strip() or 'residencia'
+            if tipo_ubicacion not in TIPOS_UBICACION:
+                raise ValueError(f"tipo_ubicacion inválido: {tipo_ubicacion}")
+            direccion = fila['direccion'].strip()
+            if not direccion:
+                raise ValueError("falta la dirección")
+            filas.append((
+                lector.line_num,
+                fila['correo'].strip().lower(),
+                datetime.strptime(fila['fecha'].strip(), '%Y-%m-%d').date(),
+                datetime.strptime(fila['hora'].strip(), '%H:%M').time(),
+                direccion,
+                tipo_ubicacion,
+                _coordenada(fila['latitud']),
+                _coordenada(fila['longitud']),
+            ))
+        except (ValueError, AttributeError) as error:
+            resultado.errores.append((lector.line_num, str(error)))
+    return filas
+
+
+def importar_reservas(archivo, fecha_asignacion=None):
+    # Crea las reservas de un CSV (ver COLUMNAS) y les asigna personal en lote.
+    # Las filas con errores se informan y se omiten; el resto se importa en una
+    # sola transacción, con un correo de resumen por cliente.
+    resultado = ResultadoImportacion()
+    fecha_asignacion = fecha_asignacion or date.today()
+
+    filas = _leer_filas(archivo, resultado)
+    if not filas:
+        return resultado
+
+    # Los correos del CSV ya vienen en minúsculas; los guardados pueden no estarlo.
+    clientes = {
+        u.correo.lower(): u
+        for u in Usuario.objects.annotate(correo_minusculas=Lower('correo')).filter(
+            rol='cliente', estado='activo', correo_minusculas__in={f[1] for f in filas}
+        )
+    }
+
+    with transaction.atomic():
+        fechas = [f[2] for f in filas]
+        existentes = set(
+            Reserva.objects.filter(
+                usuario__in=clientes.values(),
+                fecha_reserva__range=(min(fechas), max(fechas)),
+            ).exclude(estado='completada').values_list('usuario_id', 'fecha_reserva', 'hora_reserva')
+        )
+
+        reservas = []
+        for linea, correo, fecha, hora, direccion, tipo_ubicacion, latitud, longitud in filas:
+            cliente = clientes.get(correo)
+            if cliente is None:
+                resultado.errores.append((linea, f"No existe un cliente activo con el correo {correo}."))
+                continue
+            if (cliente.id, fecha, hora) in existentes:
+                resultado.duplicadas += 1
+                continue
+            existentes.add((cliente.id, fecha, hora))
+            reservas.append(Reserva(
+                fecha_reserva=fecha,
+                hora_reserva=hora,
+                direccion=direccion,
+                tipo_ubicacion=tipo_ubicacion,
+                estado='pendiente',
+                usuario=cliente,
+                latitud=latitud,
+                longitud=longitud,
+            ))
+
+        resultado.errores.sort()
+        if not reservas:
+            return resultado
+
+        # Se decide la asignación antes de insertar para guardar cada reserva
+        # ya con su estado final.
+        nuevas, _ = asignar_en_lote(reservas, fecha_asignacion)
+        Reserva.objects.bulk_create(reservas)
+        Asignacion.objects.bulk_create(nuevas)
+
+        por_cliente = defaultdict(lambda: [0, 0])
+        for reserva in reservas:
+            conteo = por_cliente[reserva.usuario]
+            if reserva.estado == 'asignada':
+                conteo[0] += 1
+            else:
+                conteo[1] += 1
+        resultado.asignadas = len(nuevas)
+        resultado.pendientes = len(reservas) - len(nuevas)
+
+        encolar_correos([
+            (
+                'Reservas importadas',
+                f'Hola {cliente.nombre}, se registraron {asignadas + pendientes} reserva(s) a tu nombre: '
+                f'{asignadas} asignada(s) y {pendientes} pendiente(s) de personal disponible.',
+                cliente.correo,
+            )
+            for cliente, (asignadas, pendientes) in por_cliente.items()
+        ])
+
+        for lunes in {lunes_de(r.fecha_reserva) for r in reservas}:
+            transaction.on_commit(lambda lunes=lunes: invalidar_semana(lunes), robust=True)
+        # bulk_create no dispara señales: se suma lo que aportan las nuevas.
+        aplicar({}, de_reservas(r.id for r in reservas))
+        programar_eventos('creada', (r.id for r in reservas))
+
+    return resultado
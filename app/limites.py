@@ -0,0 +1,69 @@
+import threading
+import time
+
+from django.conf import settings
+
+
+class LimitadorTokens:
+    # Un cubo de tokens por clave (IP o correo), en memoria del proceso.
+    # Cada intento gasta un token y los tokens se recargan a `por_segundo`
+    # hasta `capacidad`.
+
+    def __init__(self, capacidad, por_segundo, maximo_claves=10000):
+        self.capacidad = capacidad
+        self.por_segundo = por_segundo
+        self.maximo_claves = maximo_claves
+        self._cubos = {}
+        self._lock = threading.Lock()
+
+    def _tokens(self, clave, ahora):
+        tokens, ultimo = self._cubos.get(clave, (self.capacidad, ahora))
+        return min(self.capacidad, tokens + (ahora - ultimo) * self.por_segundo)
+
+    def disponible(self, clave):
+        # Si quedan tokens, sin gastar ninguno.
+        with self._lock:
+            return self._tokens(clave, time.monotonic()) >= 1
+
+    def permitir(self, clave):
+        ahora = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(clave, ahora)
+            permitido = tokens >= 1
+            if permitido:
+                tokens -= 1
+            self._cubos[clave] = (tokens, ahora)
+            if len(self._cubos) > self.maximo_claves:
+                self._purgar(ahora)
+            return permitido
+
+    def _purgar(self, ahora):
+        # Un cubo que ya se habría rellenado por completo equivale a no tenerlo.
+        llenos = [
+            clave for clave, (tokens, ultimo) in self._cubos.items()
+            if tokens + (ahora - ultimo) * self.por_segundo >= self.capacidad
+        ]
+        for clave in llenos:
+            del self._cubos[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._cubos.clear()
+
+
+def ip_cliente(request):
+    # Detrás de un proxy inverso REMOTE_ADDR es siempre el proxy. La cabecera
+    # configurada (normalmente X-Forwarded-For) solo se lee si la petición
+    # viene de un proxy de confianza; cada proxy agrega la dirección de quien
+    # le habló, así que se toma la última que no sea de un proxy confiable.
+    ip = request.META.get('REMOTE_ADDR', '')
+    cabecera = getattr(settings, 'IP_CLIENTE_CABECERA', '')
+    confiables = set(getattr(settings, 'PROXIES_CONFIABLES', ()))
+    if not cabecera or ip not in confiables:
+        return ip
+    saltos = [salto.strip() for salto in request.META.get(cabecera, '').split(',') if salto.strip()]
+    for salto in reversed(saltos):
+        if salto not in confiables:
+            return salto
+        ip = salto
+    return ip
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.notificaciones import enviar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Envía los correos pendientes de la cola de notificaciones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=100, help='Correos por conexión SMTP.')
+        parser.add_argument('--continuo', action='store_true', help='Seguir esperando nuevos correos.')
+        parser.add_argument('--intervalo', type=float, default=5.0, help='Segundos entre revisiones en modo continuo.')
+
+    def handle(self, *args, **options):
+        total_enviadas = total_fallidas = 0
+        while True:
+            enviadas, fallidas = enviar_pendientes(options['lote'])
+            total_enviadas += enviadas
+            total_fallidas += fallidas
+
+            if enviadas + fallidas == 0 or fallidas:
+                if not options['continuo']:
+                    break
+                time.sleep(options['intervalo'])
+
+        self.stdout.write(f"{total_enviadas} correo(s) enviados, {total_fallidas} con error.")
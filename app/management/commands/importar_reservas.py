@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.importacion import importar_reservas
+
+
+class Command(BaseCommand):
+    help = 'Importa reservas desde un CSV (correo, fecha, hora, direccion, tipo_ubicacion, latitud, longitud).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta del archivo CSV.')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Codificación del archivo.')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        with open(options['archivo'], newline='', encoding=options['encoding']) as archivo:
+            resultado = importar_reservas(archivo)
+
+        for linea, error in resultado.errores:
+            self.stderr.write(f"Línea {linea}: {error}")
+        self.stdout.write(
+            f"{resultado.creadas} reserva(s) importadas: {resultado.asignadas} asignadas y "
+            f"{resultado.pendientes} pendientes. {resultado.duplicadas} duplicadas omitidas, "
+            f"{len(resultado.errores)} con error ({time.perf_counter() - inicio:.2f} s)."
+        )
@@ -0,0 +1,62 @@
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.analitica import reconstruir
+from app.models import Usuario
+from app.semilla import generar
+
+
+def _fecha(valor):
+    return datetime.strptime(valor, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Genera datos de prueba a escala: clientes, personal, reservas, asignaciones e historial.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=10000, help='Clientes a crear.')
+        parser.add_argument('--personal', type=int, default=200, help='Personal a crear.')
+        parser.add_argument('--reservas', type=int, default=100000, help='Reservas a crear.')
+        parser.add_argument('--dias', type=int, default=365, help='Días que cubren las reservas.')
+        parser.add_argument('--desde', type=_fecha, help='Primera fecha (AAAA-MM-DD); por defecto, 3/4 de los días antes de hoy.')
+        parser.add_argument('--hoy', type=_fecha, help='Fecha (AAAA-MM-DD) que separa reservas completadas de futuras.')
+        parser.add_argument('--semilla', type=int, default=0, help='Semilla del generador aleatorio.')
+        parser.add_argument('--lote', type=int, default=20000, help='Reservas por transacción.')
+        parser.add_argument('--contraseña', default='semilla', help='Contraseña de todos los usuarios creados.')
+        parser.add_argument('--dominio', default='semilla.local', help='Dominio de los correos creados.')
+        parser.add_argument('--sin-resumenes', action='store_true', help='No recalcular los resúmenes diarios.')
+
+    def handle(self, *args, **options):
+        if min(options['clientes'], options['reservas'], options['personal'], options['dias'] - 1, options['lote'] - 1) < 0:
+            raise CommandError('Las cantidades no pueden ser negativas, y --dias y --lote deben ser al menos 1.')
+        dominio = options['dominio']
+        if Usuario.objects.filter(correo__endswith=f'@{dominio}').exists():
+            raise CommandError(f'Ya hay usuarios con correo @{dominio}; usa otro --dominio o una base vacía.')
+
+        hoy = options['hoy'] or date.today()
+        desde = options['desde'] or hoy - timedelta(days=options['dias'] * 3 // 4)
+
+        inicio = time.perf_counter()
+
+        def progreso(resultado):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{resultado.reservas} reservas ({time.perf_counter() - inicio:.1f} s)")
+
+        resultado = generar(
+            options['clientes'], options['personal'], options['reservas'], desde, options['dias'],
+            hoy=hoy, semilla=options['semilla'], lote=options['lote'], contraseña=options['contraseña'],
+            dominio=dominio, progreso=progreso,
+        )
+        self.stdout.write(
+            f"{resultado.clientes} cliente(s), {resultado.personal} personal, {resultado.reservas} reserva(s), "
+            f"{resultado.asignaciones} asignación(es) y {resultado.tareas} tarea(s) creados "
+            f"({time.perf_counter() - inicio:.2f} s)."
+        )
+
+        # Los resúmenes del panel no se actualizan con inserciones masivas.
+        if not options['sin_resumenes']:
+            inicio = time.perf_counter()
+            total = reconstruir(desde, desde + timedelta(days=options['dias'] - 1))
+            self.stdout.write(f"{total} resumen(es) recalculados ({time.perf_counter() - inicio:.2f} s).")
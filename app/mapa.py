@@ -0,0 +1,100 @@
+import math
+
+from django.db.models import Avg, Count, F, Min
+from django.db.models.functions import Floor
+
+ZOOM_DETALLE = 15
+# Niveles que usan las teselas del mapa; fuera de ellos el tamaño de celda no
+# tiene sentido (con zoom muy negativo, 2 ** zoom llega a 0).
+ZOOM_MINIMO = 0
+ZOOM_MAXIMO = 22
+CELDAS_POR_TESELA = 4
+LIMITE_PUNTOS = 1000
+
+
+def parsear_bbox(valor):
+    oeste, sur, este, norte = (float(v) for v in valor.split(','))
+    if not all(map(math.isfinite, (oeste, sur, este, norte))) or oeste > este or sur > norte:
+        raise ValueError('bbox inválido')
+    return oeste, sur, este, norte
+
+
+def filtrar_bbox(asignaciones, bbox):
+    oeste, sur, este, norte = bbox
+    return asignaciones.filter(
+        reserva__latitud__range=(sur, norte),
+        reserva__longitud__range=(oeste, este),
+    )
+
+
+def _punto(longitud, latitud, propiedades):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [longitud, latitud]},
+        'properties': propiedades,
+    }
+
+
+def grupos_geojson(asignaciones, zoom):
+    # Agrupa en SQL por celdas de una grilla cuyo tamaño depende del zoom
+    # (CELDAS_POR_TESELA celdas por cada tesela de 256 px del mapa).
+    tamano = 360 / (2 ** zoom) / CELDAS_POR_TESELA
+    celdas = asignaciones.annotate(
+        celda_x=Floor(F('reserva__longitud') / tamano),
+        celda_y=Floor(F('reserva__latitud') / tamano),
+    ).values('celda_x', 'celda_y').annotate(
+        total=Count('id'),
+        latitud=Avg('reserva__latitud'),
+        longitud=Avg('reserva__longitud'),
+        primera_fecha=Min('reserva__fecha_reserva'),
+    ).order_by()
+
+    return [
+        _punto(c['longitud'], c['latitud'], {
+            'cluster': True,
+            'total': c['total'],
+            'primera_fecha': c['primera_fecha'].isoformat(),
+        })
+        for c in celdas
+    ]
+
+
+def puntos_geojson(asignaciones, incluir_nombres):
+    # Devuelve los puntos y si se cortaron en LIMITE_PUNTOS (se envían los más
+    # próximos en fecha).
+    campos = [
+        'id', 'reserva__latitud', 'reserva__longitud', 'reserva__direccion',
+        'reserva__fecha_reserva', 'reserva__hora_reserva', 'reserva__tipo_ubicacion',
+    ]
+    if incluir_nombres:
+        campos += ['usuario__nombre', 'reserva__usuario__nombre']
+
+    filas = asignaciones.order_by('reserva__fecha_reserva', 'reserva__hora_reserva', 'id').values(*campos)
+
+    # Una fila de más basta para saber si hubo corte, sin contar todas.
+    filas = list(filas[:LIMITE_PUNTOS + 1])
+    features = []
+    for fila in filas[:LIMITE_PUNTOS]:
+        propiedades = {
+            'cluster': False,
+            'id': fila['id'],
+            'direccion': fila['reserva__direccion'],
+            'fecha': fila['reserva__fecha_reserva'].isoformat(),
+            'hora': fila['reserva__hora_reserva'].strftime('%H:%M'),
+            'tipo': fila['reserva__tipo_ubicacion'].title(),
+        }
+        if incluir_nombres:
+            propiedades['personal'] = fila['usuario__nombre']
+            propiedades['cliente'] = fila['reserva__usuario__nombre']
+        features.append(_punto(fila['reserva__longitud'], fila['reserva__latitud'], propiedades))
+    return features, len(filas) > LIMITE_PUNTOS
+
+
+def coleccion(asignaciones, zoom, incluir_nombres):
+    zoom = min(max(zoom, ZOOM_MINIMO), ZOOM_MAXIMO)
+    truncado = False
+    if zoom >= ZOOM_DETALLE or asignaciones.count() <= LIMITE_PUNTOS:
+        features, truncado = puntos_geojson(asignaciones, incluir_nombres)
+    else:
+        features = grupos_geojson(asignaciones, zoom)
+    return {'type': 'FeatureCollection', 'features': features, 'truncado': truncado}
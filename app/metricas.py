@@ -0,0 +1,244 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+# Límites (en segundos) del histograma de latencia, como los de Prometheus.
+LIMITES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Posiciones dentro de la fila de cada vista; después van los contadores
+# del histograma, uno por límite más el de +Inf.
+PETICIONES, LATENCIA, CONSULTAS, SQL, PLANTILLAS, LENTAS, HISTOGRAMA = range(7)
+LARGO_FILA = HISTOGRAMA + len(LIMITES) + 1
+
+SIN_RUTA = '<sin_ruta>'
+
+# Medición de la petición en curso. Es una ContextVar y no un atributo del
+# hilo porque en ASGI las consultas corren en otro hilo (sync_to_async copia
+# el contexto, y con él esta medición).
+_medicion = ContextVar('medicion', default=None)
+
+
+class Medicion:
+    __slots__ = ('request', 'consultas', 'sql', 'plantillas', 'lentas')
+
+    def __init__(self, request):
+        self.request = request
+        self.consultas = 0
+        self.sql = 0.0
+        self.plantillas = 0.0
+        self.lentas = 0
+
+    def vista(self):
+        resolver_match = getattr(self.request, 'resolver_match', None)
+        return resolver_match.view_name if resolver_match else SIN_RUTA
+
+
+class Colector:
+    # Acumula las peticiones que atiende un solo hilo, sin lock: ese hilo es
+    # el único que escribe. Las filas no se modifican una vez publicadas;
+    # registrar() arma una nueva y la reemplaza con una sola asignación, así
+    # quien exporta ve la fila anterior o la nueva, nunca una a medio sumar.
+    # vaciar() cambia el dict entero: lo que el hilo esté registrando en ese
+    # momento cae en el dict viejo y cuenta como anterior a la limpieza.
+
+    def __init__(self):
+        self.hilo = threading.current_thread()
+        self.vistas = {}
+
+    def registrar(self, vista, duracion, medicion):
+        vistas = self.vistas
+        fila = vistas.get(vista)
+        fila = [0] * LARGO_FILA if fila is None else list(fila)
+        fila[PETICIONES] += 1
+        fila[LATENCIA] += duracion
+        fila[CONSULTAS] += medicion.consultas
+        fila[SQL] += medicion.sql
+        fila[PLANTILLAS] += medicion.plantillas
+        fila[LENTAS] += medicion.lentas
+        fila[HISTOGRAMA + bisect_left(LIMITES, duracion)] += 1
+        vistas[vista] = fila
+
+    def copia(self):
+        # Copiar el dict es atómico; las filas se comparten porque nadie las
+        # vuelve a modificar.
+        return dict(self.vistas)
+
+    def vaciar(self):
+        self.vistas = {}
+
+
+def _sumar(destino, origen):
+    for vista, fila in origen.items():
+        acumulada = destino.setdefault(vista, [0] * LARGO_FILA)
+        for i, valor in enumerate(fila):
+            acumulada[i] += valor
+
+
+class Registro:
+    # Un colector por hilo y por proceso. El lock del registro solo se toma
+    # al crear el colector de un hilo nuevo, al exportar y al limpiar, nunca
+    # por petición.
+
+    def __init__(self):
+        self._local = threading.local()
+        self._colectores = []
+        self._retirados = {}
+        self._lock = threading.Lock()
+
+    def colector(self):
+        colector = getattr(self._local, 'colector', None)
+        if colector is None:
+            colector = self._local.colector = Colector()
+            with self._lock:
+                self._retirar_muertos()
+                self._colectores.append(colector)
+        return colector
+
+    def _retirar_muertos(self):
+        # Los hilos que terminaron ya no escriben: sus totales pasan a una
+        # tabla común y su colector se descarta.
+        vivos = []
+        for colector in self._colectores:
+            if colector.hilo.is_alive():
+                vivos.append(colector)
+            else:
+                _sumar(self._retirados, colector.copia())
+        self._colectores = vivos
+
+    def totales(self):
+        with self._lock:
+            self._retirar_muertos()
+            totales = {vista: list(fila) for vista, fila in self._retirados.items()}
+            for colector in self._colectores:
+                _sumar(totales, colector.copia())
+        return totales
+
+    def limpiar(self):
+        with self._lock:
+            self._retirados.clear()
+            for colector in self._colectores:
+                colector.vaciar()
+
+
+registro = Registro()
+
+
+def medir_consulta(execute, sql, params, many, context):
+    # execute_wrapper instalado en cada conexión (ver app.signals).
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracion = time.perf_counter() - inicio
+        medicion.consultas += 1
+        medicion.sql += duracion
+        if duracion >= getattr(settings, 'METRICAS_CONSULTA_LENTA', 0.1):
+            medicion.lentas += 1
+            logger.warning('Consulta lenta en %s (%.3f s): %s', medicion.vista(), duracion, sql)
+
+
+class PlantillaMedida(Template):
+    def render(self, context=None, request=None):
+        medicion = _medicion.get()
+        if medicion is None:
+            return super().render(context, request)
+        inicio = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            medicion.plantillas += time.perf_counter() - inicio
+
+
+class PlantillasMedidas(DjangoTemplates):
+    # Motor de plantillas de Django que suma el tiempo de render a la
+    # petición en curso. Los {% include %} se cuentan dentro de su plantilla.
+
+    def from_string(self, template_code):
+        return PlantillaMedida(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return PlantillaMedida(super().get_template(template_name).template, self)
+
+
+class MetricasMiddleware:
+    # Va primero en MIDDLEWARE para que la latencia incluya a los demás.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        medicion = Medicion(request)
+        token = _medicion.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            registro.colector().registrar(medicion.vista(), time.perf_counter() - inicio, medicion)
+            _medicion.reset(token)
+
+    async def __acall__(self, request):
+        medicion = Medicion(request)
+        token = _medicion.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            registro.colector().registrar(medicion.vista(), time.perf_counter() - inicio, medicion)
+            _medicion.reset(token)
+
+
+def _etiqueta(vista):
+    return vista.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+METRICAS = (
+    ('horarios_consultas_total', 'counter', 'Consultas SQL ejecutadas.', CONSULTAS),
+    ('horarios_sql_segundos_total', 'counter', 'Tiempo total en consultas SQL.', SQL),
+    ('horarios_plantillas_segundos_total', 'counter', 'Tiempo total renderizando plantillas.', PLANTILLAS),
+    ('horarios_consultas_lentas_total', 'counter', 'Consultas sobre METRICAS_CONSULTA_LENTA.', LENTAS),
+)
+
+
+def exportar():
+    # Formato de texto de Prometheus. Los contadores son de este proceso;
+    # con varios workers cada uno expone los suyos.
+    totales = sorted(registro.totales().items())
+    lineas = [
+        '# HELP horarios_peticion_segundos Latencia de las peticiones por vista.',
+        '# TYPE horarios_peticion_segundos histogram',
+    ]
+    for vista, fila in totales:
+        etiqueta = _etiqueta(vista)
+        acumulado = 0
+        for limite, cantidad in zip(LIMITES + ('+Inf',), fila[HISTOGRAMA:]):
+            acumulado += cantidad
+            lineas.append(f'horarios_peticion_segundos_bucket{{vista="{etiqueta}",le="{limite}"}} {acumulado}')
+        lineas.append(f'horarios_peticion_segundos_sum{{vista="{etiqueta}"}} {_numero(fila[LATENCIA])}')
+        lineas.append(f'horarios_peticion_segundos_count{{vista="{etiqueta}"}} {fila[PETICIONES]}')
+    for nombre, tipo, ayuda, posicion in METRICAS:
+        lineas.append(f'# HELP {nombre} {ayuda}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        for vista, fila in totales:
+            lineas.append(f'{nombre}{{vista="{_etiqueta(vista)}"}} {_numero(fila[posicion])}')
+    return '\n'.join(lineas) + '\n'
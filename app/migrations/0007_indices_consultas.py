@@ -0,0 +1,41 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_notificacion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asignacion',
+            index=models.Index(fields=['usuario', 'reserva'], name='asignacion_usuario_reserva_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asignacion',
+            index=models.Index(fields=['reserva', 'usuario'], name='asignacion_reserva_usuario_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historialtarea',
+            index=models.Index(fields=['hora_inicio'], name='historial_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['fecha_reserva', 'estado'], name='reserva_fecha_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['usuario', 'fecha_reserva'], name='reserva_usuario_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(condition=models.Q(('estado', 'pendiente')), fields=['fecha_reserva', 'hora_reserva'], name='reserva_pendiente_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(condition=models.Q(('estado__in', ['pendiente', 'asignada'])), fields=['fecha_reserva', 'hora_reserva'], name='reserva_activa_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('tipo_ubicacion', models.CharField(choices=[('oficina', 'Oficina'), ('residencia', 'Residencia')], max_length=20)),
+                ('estado', models.CharField(max_length=10)),
+                ('reservas', models.PositiveIntegerField(default=0)),
+                ('minutos_trabajados', models.PositiveIntegerField(default=0)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='app.usuario')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'usuario', 'tipo_ubicacion', 'estado'), name='resumen_diario_unico')],
+            },
+        ),
+    ]
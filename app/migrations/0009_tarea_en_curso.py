@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_resumen_diario'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historialtarea',
+            name='hora_fin',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
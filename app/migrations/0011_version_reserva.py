@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_calendario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reserva',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
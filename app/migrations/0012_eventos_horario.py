@@ -0,0 +1,24 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_version_reserva'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('creada', 'Creada'), ('asignada', 'Asignada'), ('liberada', 'Liberada'), ('completada', 'Completada'), ('modificada', 'Modificada'), ('eliminada', 'Eliminada')], max_length=10)),
+                ('reserva_id', models.IntegerField()),
+                ('datos', models.JSONField(null=True)),
+                ('usuarios', models.JSONField(default=list)),
+                ('creado', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_eventos_horario'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='asignacion',
+            name='asignacion_usuario_reserva_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='asignacion',
+            name='asignacion_reserva_usuario_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='reserva',
+            name='reserva_pendiente_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='reserva',
+            name='reserva_activa_idx',
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['estado', 'fecha_reserva', 'hora_reserva'], name='reserva_estado_fecha_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 class Usuario(models.Model):
@@ -28,6 +29,26 @@ class Reserva(models.Model):
     longitud = models.FloatField(null=True, blank=True)
     estado = models.CharField(max_length=10)
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE)
+    # Aumenta con cada escritura; ver app.concurrencia.
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # Sin índices parciales: Django envía los valores como parámetros y
+        # SQLite solo usa un índice parcial si su condición aparece literal en
+        # la consulta. Cada índice lo justifica app.tests.IndicesTests.
+        indexes = [
+            models.Index(fields=['fecha_reserva', 'estado'], name='reserva_fecha_estado_idx'),
+            models.Index(fields=['usuario', 'fecha_reserva'], name='reserva_usuario_fecha_idx'),
+            models.Index(fields=['estado', 'fecha_reserva', 'hora_reserva'], name='reserva_estado_fecha_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Incluso un save() común cambia la versión, así una edición que leyó
+        # la fila antes se entera de que ya no está al día.
+        self.version += 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Reserva {self.id} - {self.usuario.nombre}"
@@ -35,6 +56,8 @@ class Reserva(models.Model):
 class Asignacion(models.Model):
     fecha_asignacion = models.DateField()
     reserva = models.ForeignKey(Reserva, on_delete=models.CASCADE)
+    # Los índices de las dos claves foráneas bastan: las consultas llegan por
+    # una de ellas y el resto lo filtra la reserva.
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE)
 
     def __str__(self):
@@ -43,9 +66,120 @@ class Asignacion(models.Model):
 
 class HistorialTarea(models.Model):
     hora_inicio = models.DateTimeField()
-    hora_fin = models.DateTimeField()
+    # Vacía mientras la tarea está en curso.
+    hora_fin = models.DateTimeField(null=True, blank=True)
     ubicacion = models.CharField(max_length=200)
     asignacion = models.ForeignKey(Asignacion, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['hora_inicio'], name='historial_inicio_idx'),
+        ]
+
+    def __str__(self):
+        return f"Tarea en {self.ubicacion} - {self.hora_inicio.strftime('%Y-%m-%d %H:%M')}"
+
+
+class Notificacion(models.Model):
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('enviada', 'Enviada'),
+        ('fallida', 'Fallida'),
+    ]
+    asunto = models.CharField(max_length=200)
+    mensaje = models.TextField()
+    remitente = models.CharField(max_length=250)
+    destinatario = models.EmailField()
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='pendiente')
+    intentos = models.PositiveIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True)
+    creada = models.DateTimeField(auto_now_add=True)
+    enviada = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Notificación {self.id} a {self.destinatario} ({self.estado})"
+
+
+class ResumenDiario(models.Model):
+    # Conteos pre-agregados para el panel de administración. Cada cambio les
+    # suma su diferencia desde app.analitica; reconstruir_resumenes los
+    # vuelve a calcular desde cero. No se editan a mano.
+    fecha = models.DateField()
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, null=True, blank=True)
+    tipo_ubicacion = models.CharField(max_length=20, choices=Reserva.TIPO_UBICACION_CHOICES)
+    estado = models.CharField(max_length=10)
+    reservas = models.PositiveIntegerField(default=0)
+    minutos_trabajados = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['fecha', 'usuario', 'tipo_ubicacion', 'estado'],
+                name='resumen_diario_unico',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Resumen {self.fecha} - {self.usuario_id or 'sin asignar'} ({self.tipo_ubicacion}, {self.estado})"
+
+
+class Turno(models.Model):
+    DIA_CHOICES = [
+        (0, 'Lunes'),
+        (1, 'Martes'),
+        (2, 'Miércoles'),
+        (3, 'Jueves'),
+        (4, 'Viernes'),
+        (5, 'Sábado'),
+        (6, 'Domingo'),
+    ]
+    # Personal sin turnos registrados se considera disponible a cualquier hora.
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE)
+    dia_semana = models.PositiveSmallIntegerField(choices=DIA_CHOICES)
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
+
+    class Meta:
+        ordering = ['usuario', 'dia_semana', 'hora_inicio']
+
+    def __str__(self):
+        return f"{self.usuario.nombre} - {self.get_dia_semana_display()} {self.hora_inicio:%H:%M}-{self.hora_fin:%H:%M}"
+
+
+class Feriado(models.Model):
+    fecha = models.DateField()
+    # Sin usuario, el día libre es para todo el personal.
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, null=True, blank=True)
+    descripcion = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ['fecha']
+
+    def __str__(self):
+        quien = self.usuario.nombre if self.usuario_id else 'todos'
+        return f"Feriado {self.fecha} ({quien})"
+
+
+class EventoHorario(models.Model):
+    # Cambios de reservas que se envían a las páginas de horario y mapa
+    # abiertas (ver app.eventos). Se escriben al confirmar la transacción y se
+    # borran pasada app.eventos.RETENCION.
+    TIPO_CHOICES = [
+        ('creada', 'Creada'),
+        ('asignada', 'Asignada'),
+        ('liberada', 'Liberada'),
+        ('completada', 'Completada'),
+        ('modificada', 'Modificada'),
+        ('eliminada', 'Eliminada'),
+    ]
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    reserva_id = models.IntegerField()
+    # Estado de la reserva al publicar el evento; None si ya no existe.
+    datos = models.JSONField(null=True)
+    # Usuarios no administradores que pueden ver el evento.
+    usuarios = models.JSONField(default=list)
+    creado = models.DateTimeField(auto_now_add=True, db_index=True)
+
     def __str__(self):
-        return f"Tarea en {self.ubicacion} - {self.hora_inicio.strftime('%Y-%m-%d %H:%M')}"
\ No newline at end of file
+        return f"Evento {self.id}: reserva {self.reserva_id} {self.tipo}"
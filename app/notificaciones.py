@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .basedatos import atomico_con_reintentos
+from .models import Notificacion
+
+REMITENTE = 'no-reply@tusitio.com'
+MAX_INTENTOS = 5
+ESPERA_BASE = timedelta(seconds=30)
+# Tiempo que un lote reclamado queda fuera del alcance de otras ejecuciones.
+# Si el proceso muere enviando, sus correos vuelven a estar pendientes al
+# vencer el plazo.
+PLAZO_ENVIO = timedelta(minutes=10)
+
+
+def encolar_correo(asunto, mensaje, destinatarios, remitente=REMITENTE):
+    return encolar_correos([(asunto, mensaje, d) for d in destinatarios], remitente)
+
+
+def encolar_correos(correos, remitente=REMITENTE):
+    # `correos` son tuplas (asunto, mensaje, destinatario); se guardan en un solo INSERT.
+    return Notificacion.objects.bulk_create([
+        Notificacion(asunto=asunto, mensaje=mensaje, remitente=remitente, destinatario=destinatario)
+        for asunto, mensaje, destinatario in correos
+    ])
+
+
+def _registrar_fallo(notificacion, error, ahora):
+    notificacion.intentos += 1
+    notificacion.ultimo_error = str(error)
+    if notificacion.intentos >= MAX_INTENTOS:
+        notificacion.estado = 'fallida'
+    else:
+        # Espera exponencial: 30 s, 1 min, 2 min, 4 min...
+        notificacion.proximo_intento = ahora + ESPERA_BASE * (2 ** (notificacion.intentos - 1))
+
+
+def _reclamar(tamano_lote, ahora):
+    # Cada fila se reclama con un UPDATE condicionado al estado que se leyó:
+    # si otra ejecución la tomó primero, su proximo_intento ya está en el
+    # futuro, el UPDATE no afecta filas y el correo no se envía dos veces.
+    pendientes = Notificacion.objects.filter(estado='pendiente', proximo_intento__lte=ahora)
+    candidatas = list(pendientes.order_by('id').values_list('id', flat=True)[:tamano_lote])
+    plazo = ahora + PLAZO_ENVIO
+    reclamadas = [
+        notificacion_id for notificacion_id in candidatas
+        if pendientes.filter(id=notificacion_id).update(proximo_intento=plazo)
+    ]
+    return list(Notificacion.objects.filter(id__in=reclamadas).order_by('id'))
+
+
+def enviar_pendientes(tamano_lote=100, conexion=None):
+    ahora = timezone.now()
+    lote = atomico_con_reintentos(_reclamar, tamano_lote, ahora)
+    if not lote:
+        return 0, 0
+
+    conexion = conexion or get_connection()
+    enviadas = 0
+    try:
+        conexion.open()
+        for notificacion in lote:
+            correo = EmailMessage(
+                notificacion.asunto,
+                notificacion.mensaje,
+                notificacion.remitente,
+                [notificacion.destinatario],
+                connection=conexion,
+            )
+            try:
+                correo.send(fail_silently=False)
+            except Exception as error:
+                _registrar_fallo(notificacion, error, ahora)
+            else:
+                notificacion.estado = 'enviada'
+                notificacion.enviada = timezone.now()
+                enviadas += 1
+    except Exception as error:
+        # No se pudo abrir la conexión: todo el lote se reintenta más tarde.
+        for notificacion in lote:
+            if notificacion.estado == 'pendiente':
+                _registrar_fallo(notificacion, error, ahora)
+    finally:
+        conexion.close()
+
+    Notificacion.objects.bulk_update(
+        lote, ['estado', 'intentos', 'proximo_intento', 'ultimo_error', 'enviada']
+    )
+    return enviadas, len(lote) - enviadas
@@ -0,0 +1,115 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+TAMANO_PAGINA = 20
+TAMANO_MAXIMO = 100
+
+
+class Pagina:
+    def __init__(self, elementos, siguiente, es_primera):
+        self.elementos = elementos
+        self.siguiente = siguiente
+        self.es_primera = es_primera
+
+    def __iter__(self):
+        return iter(self.elementos)
+
+    def __len__(self):
+        return len(self.elementos)
+
+
+def tamano_pagina(request):
+    try:
+        tamano = int(request.GET.get('tamano', TAMANO_PAGINA))
+    except ValueError:
+        tamano = TAMANO_PAGINA
+    return max(1, min(tamano, TAMANO_MAXIMO))
+
+
+def _valor(objeto, campo):
+    for parte in campo.split('__'):
+        objeto = getattr(objeto, parte)
+    return objeto.isoformat() if hasattr(objeto, 'isoformat') else objeto
+
+
+def _codificar(valores):
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+
+def _decodificar(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        return None
+
+
+def _campo(modelo, nombre):
+    partes = nombre.split('__')
+    for parte in partes[:-1]:
+        modelo = modelo._meta.get_field(parte).related_model
+    return modelo._meta.get_field(partes[-1])
+
+
+def _validar(modelo, orden, valores):
+    # El cursor llega del cliente: cualquier forma o tipo inesperado se trata
+    # como si no hubiera cursor en vez de fallar al armar la consulta.
+    if not isinstance(valores, list) or len(valores) != len(orden):
+        return None
+    convertidos = []
+    for campo, valor in zip(orden, valores):
+        if isinstance(valor, bool) or not isinstance(valor, (str, int, float)):
+            return None
+        try:
+            convertidos.append(_campo(modelo, campo.lstrip('-')).to_python(valor))
+        except (ValidationError, TypeError, ValueError):
+            return None
+    return convertidos
+
+
+def _despues_de(orden, valores):
+    # (a, b, c) > (va, vb, vc) en el sentido de cada columna:
+    # a > va  OR  (a = va AND b > vb)  OR  (a = va AND b = vb AND c > vc)
+    condicion = Q()
+    iguales = {}
+    for campo, valor in zip(orden, valores):
+        nombre = campo.lstrip('-')
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        condicion |= Q(**iguales, **{f'{nombre}__{operador}': valor})
+        iguales[nombre] = valor
+    return condicion
+
+
+def _consulta_pagina(queryset, orden, cursor, tamano):
+    queryset = queryset.order_by(*orden)
+
+    valores = _validar(queryset.model, orden, _decodificar(cursor)) if cursor else None
+    if valores is not None:
+        queryset = queryset.filter(_despues_de(orden, valores))
+    else:
+        cursor = None
+    return queryset[:tamano + 1], cursor
+
+
+def _pagina(elementos, orden, cursor, tamano):
+    siguiente = None
+    if len(elementos) > tamano:
+        elementos = elementos[:tamano]
+        siguiente = _codificar([_valor(elementos[-1], campo.lstrip('-')) for campo in orden])
+    return Pagina(elementos, siguiente, cursor is None)
+
+
+def paginar_por_cursor(queryset, orden, cursor=None, tamano=TAMANO_PAGINA):
+    # Paginación por clave: la página siguiente empieza después de la última
+    # fila vista, así que su costo no depende de cuántas páginas se saltaron.
+    # `orden` debe terminar en un campo único (normalmente 'id' o '-id').
+    consulta, cursor = _consulta_pagina(queryset, orden, cursor, tamano)
+    return _pagina(list(consulta), orden, cursor, tamano)
+
+
+async def apaginar_por_cursor(queryset, orden, cursor=None, tamano=TAMANO_PAGINA):
+    consulta, cursor = _consulta_pagina(queryset, orden, cursor, tamano)
+    return _pagina([e async for e in consulta], orden, cursor, tamano)
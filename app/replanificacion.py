@@ -0,0 +1,150 @@
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import F
+
+from .analitica import cambios_de_reservas
+from .eventos import programar_eventos
+from .disponibilidad import IndiceDisponibilidad, ventana_reserva
+from .geografia import haversine_km
+from .horario import invalidar_semana
+from .models import Asignacion, Reserva
+
+# Costo, en km, de poner un trabajo a alguien que aún no tiene trabajos ubicados ese día.
+COSTO_DIA_VACIO_KM = 10.0
+# Preferencia por mantener al personal ya asignado, para que el plan cambie lo mínimo.
+BONO_ESTABILIDAD_KM = 5.0
+
+
+class ResultadoReplanificacion:
+    def __init__(self):
+        self.mantenidas = 0
+        self.reasignadas = 0
+        self.nuevas = 0
+        self.liberadas = 0
+        self.sin_personal = 0
+        self.distancia_km = 0.0
+
+
+def _costo_insercion(dia, inicio, latitud, longitud):
+    # Km extra que agrega visitar este punto entre el trabajo anterior y el
+    # siguiente del mismo personal ese día.
+    if latitud is None or longitud is None:
+        return 0.0
+    if not dia:
+        return COSTO_DIA_VACIO_KM
+    i = bisect_left(dia, (inicio,))
+    anterior = dia[i - 1] if i > 0 else None
+    siguiente = dia[i] if i < len(dia) else None
+    costo = 0.0
+    if anterior is not None:
+        costo += haversine_km(anterior[1], anterior[2], latitud, longitud)
+    if siguiente is not None:
+        costo += haversine_km(latitud, longitud, siguiente[1], siguiente[2])
+    if anterior is not None and siguiente is not None:
+        costo -= haversine_km(anterior[1], anterior[2], siguiente[1], siguiente[2])
+    return costo
+
+
+def planificar_dia(fecha):
+    # Devuelve {reserva: usuario_id o None} para todas las reservas no
+    # completadas de `fecha`, junto con sus asignaciones actuales.
+    reservas = list(Reserva.objects.filter(fecha_reserva=fecha).exclude(estado='completada'))
+    por_id = {r.id: r for r in reservas}
+    actuales = {
+        a.reserva_id: a
+        for a in Asignacion.objects.filter(reserva__in=reservas).order_by('id')
+    }
+
+    # La ocupación de los días vecinos se mantiene fija; la de este día se
+    # vuelve a construir desde cero.
+    inicio_dia = datetime.combine(fecha, time.min)
+    indice = IndiceDisponibilidad.cargar(inicio_dia, inicio_dia + timedelta(days=1))
+    for reserva_id, asignacion in actuales.items():
+        reserva = por_id[reserva_id]
+        indice.liberar(asignacion.usuario_id, datetime.combine(reserva.fecha_reserva, reserva.hora_reserva))
+
+    # Las de oficina eligen primero: si falta personal, queda sin asignar una residencia.
+    orden = sorted(reservas, key=lambda r: (r.tipo_ubicacion != 'oficina', r.hora_reserva, r.id))
+    dias = defaultdict(list)
+    plan = {}
+    for reserva in orden:
+        inicio, fin = ventana_reserva(reserva.fecha_reserva, reserva.hora_reserva, reserva.tipo_ubicacion)
+        momento = inicio
+        actual = actuales.get(reserva.id)
+
+        mejor, mejor_costo = None, None
+        for personal in indice.libres(inicio, fin):
+            costo = _costo_insercion(dias[personal.id], momento, reserva.latitud, reserva.longitud)
+            if actual is not None and actual.usuario_id == personal.id:
+                costo -= BONO_ESTABILIDAD_KM
+            if mejor_costo is None or costo < mejor_costo:
+                mejor, mejor_costo = personal, costo
+
+        plan[reserva] = mejor.id if mejor else None
+        if mejor is not None:
+            indice.ocupar(mejor.id, momento, tipo_ubicacion=reserva.tipo_ubicacion)
+            if reserva.latitud is not None and reserva.longitud is not None:
+                insort(dias[mejor.id], (momento, reserva.latitud, reserva.longitud))
+
+    return plan, actuales, dias
+
+
+def replanificar_dia(fecha):
+    resultado = ResultadoReplanificacion()
+
+    with transaction.atomic():
+        plan, actuales, dias = planificar_dia(fecha)
+
+        crear, mover, borrar, reservas_cambiadas = [], [], [], []
+        asignadas, personal_anterior = [], {}
+        for reserva, usuario_id in plan.items():
+            actual = actuales.get(reserva.id)
+            cambio = True
+            if usuario_id is None:
+                cambio = actual is not None
+                resultado.sin_personal += 1
+                if actual is not None:
+                    borrar.append(actual.id)
+                    resultado.liberadas += 1
+            elif actual is None:
+                crear.append(Asignacion(fecha_asignacion=date.today(), reserva=reserva, usuario_id=usuario_id))
+                asignadas.append(reserva.id)
+                resultado.nuevas += 1
+            elif actual.usuario_id != usuario_id:
+                asignadas.append(reserva.id)
+                personal_anterior[reserva.id] = [actual.usuario_id]
+                actual.usuario_id = usuario_id
+                actual.fecha_asignacion = date.today()
+                mover.append(actual)
+                resultado.reasignadas += 1
+            else:
+                resultado.mantenidas += 1
+                cambio = False
+
+            estado = 'pendiente' if usuario_id is None else 'asignada'
+            if reserva.estado != estado or cambio:
+                reserva.estado = estado
+                reserva.version = F('version') + 1
+                reservas_cambiadas.append(reserva)
+
+        # Solo se escriben las diferencias con el plan anterior. Cada reserva
+        # tocada sube su versión para que las ediciones abiertas lo detecten.
+        with cambios_de_reservas(r.id for r in plan):
+            Asignacion.objects.filter(id__in=borrar).delete()
+            Asignacion.objects.bulk_update(mover, ['usuario', 'fecha_asignacion'])
+            Asignacion.objects.bulk_create(crear)
+            Reserva.objects.bulk_update(reservas_cambiadas, ['estado', 'version'])
+
+        if borrar or mover or crear or reservas_cambiadas:
+            transaction.on_commit(lambda: invalidar_semana(fecha), robust=True)
+            # Las liberadas ya avisan al borrar su asignación.
+            programar_eventos('asignada', asignadas, personal_anterior)
+
+    for dia in dias.values():
+        resultado.distancia_km += sum(
+            haversine_km(a[1], a[2], b[1], b[2]) for a, b in zip(dia, dia[1:])
+        )
+    return resultado
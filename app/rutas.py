@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+
+from .disponibilidad import duracion_reserva
+from .geografia import haversine_km
+from .models import Asignacion
+
+VELOCIDAD_KMH = 30
+# Cada hora_reserva abre una ventana de llegada de este largo. El tiempo en cada
+# parada es el de duracion_reserva() para su tipo de ubicación.
+VENTANA_LLEGADA = timedelta(hours=2)
+# Cada minuto de llegada fuera de la ventana pesa como este número de km.
+PENALIZACION_KM_POR_MINUTO = 1.0
+MAX_PASADAS = 20
+
+MINUTOS_POR_KM = 60 / VELOCIDAD_KMH
+MINUTOS_VENTANA = VENTANA_LLEGADA.total_seconds() / 60
+
+
+class Ruta:
+    def __init__(self, paradas, orden, matriz):
+        self.paradas = [paradas[i] for i in orden]
+        self.distancia_km = sum(matriz[a][b] for a, b in zip(orden, orden[1:]))
+
+
+def _tardanza_minutos(orden, inicios, servicios, matriz):
+    # Simula el día en minutos: se espera si se llega antes de la ventana y
+    # se acumulan los minutos de atraso después de su cierre.
+    reloj = inicios[orden[0]]
+    tardanza = 0.0
+    anterior = orden[0]
+    for i in orden:
+        reloj += matriz[anterior][i] * MINUTOS_POR_KM
+        if reloj < inicios[i]:
+            reloj = inicios[i]
+        elif reloj > inicios[i] + MINUTOS_VENTANA:
+            tardanza += reloj - inicios[i] - MINUTOS_VENTANA
+        reloj += servicios[i]
+        anterior = i
+    return tardanza
+
+
+def _distancia(orden, matriz):
+    return sum(matriz[a][b] for a, b in zip(orden, orden[1:]))
+
+
+def _costo(orden, inicios, servicios, matriz):
+    return _distancia(orden, matriz) + PENALIZACION_KM_POR_MINUTO * _tardanza_minutos(orden, inicios, servicios, matriz)
+
+
+def _vecino_mas_cercano(inicios, matriz):
+    n = len(inicios)
+    actual = min(range(n), key=lambda i: inicios[i])
+    orden = [actual]
+    pendientes = set(range(n)) - {actual}
+    while pendientes:
+        actual = min(pendientes, key=lambda j: (matriz[actual][j], inicios[j]))
+        orden.append(actual)
+        pendientes.remove(actual)
+    return orden
+
+
+def _dos_opt(orden, inicios, servicios, matriz):
+    # 2-opt sobre un camino abierto. El cambio de distancia de cada inversión
+    # se calcula en O(1); la simulación completa de ventanas solo se hace para
+    # los movimientos que acortan el camino o cuando la ruta ya llega tarde.
+    n = len(orden)
+    costo = _costo(orden, inicios, servicios, matriz)
+    tarde = costo > _distancia(orden, matriz)
+    for _ in range(MAX_PASADAS):
+        mejoro = False
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                antes = orden[i - 1] if i > 0 else None
+                despues = orden[j + 1] if j + 1 < n else None
+                delta = 0.0
+                if antes is not None:
+                    delta += matriz[antes][orden[j]] - matriz[antes][orden[i]]
+                if despues is not None:
+                    delta += matriz[orden[i]][despues] - matriz[orden[j]][despues]
+                if delta >= -1e-9 and not tarde:
+                    continue
+                candidato = orden[:i] + orden[i:j + 1][::-1] + orden[j + 1:]
+                costo_candidato = _costo(candidato, inicios, servicios, matriz)
+                if costo_candidato < costo - 1e-9:
+                    orden, costo = candidato, costo_candidato
+                    tarde = costo > _distancia(orden, matriz) + 1e-9
+                    mejoro = True
+        if not mejoro:
+            break
+    return orden, costo
+
+
+def optimizar_ruta(paradas):
+    # `paradas` son reservas con latitud, longitud, fecha_reserva, hora_reserva
+    # y tipo_ubicacion. Devuelve el orden de visita que minimiza los km
+    # recorridos respetando, en lo posible, que cada visita empiece dentro de
+    # su ventana de llegada.
+    origen = min(datetime.combine(p.fecha_reserva, p.hora_reserva) for p in paradas) if paradas else None
+    inicios = [
+        (datetime.combine(p.fecha_reserva, p.hora_reserva) - origen).total_seconds() / 60
+        for p in paradas
+    ]
+    duraciones = {}
+    for p in paradas:
+        if p.tipo_ubicacion not in duraciones:
+            duraciones[p.tipo_ubicacion] = duracion_reserva(p.tipo_ubicacion).total_seconds() / 60
+    servicios = [duraciones[p.tipo_ubicacion] for p in paradas]
+    matriz = [
+        [haversine_km(a.latitud, a.longitud, b.latitud, b.longitud) for b in paradas]
+        for a in paradas
+    ]
+    cronologico = sorted(range(len(paradas)), key=lambda i: inicios[i])
+    if len(paradas) < 3:
+        return Ruta(paradas, cronologico, matriz)
+
+    mejor_orden, mejor_costo = None, None
+    for inicial in (cronologico, _vecino_mas_cercano(inicios, matriz)):
+        orden, costo = _dos_opt(inicial, inicios, servicios, matriz)
+        if mejor_costo is None or costo < mejor_costo:
+            mejor_orden, mejor_costo = orden, costo
+    return Ruta(paradas, mejor_orden, matriz)
+
+
+def ruta_del_dia(usuario_id, fecha):
+    asignaciones = list(
+        Asignacion.objects.filter(usuario_id=usuario_id, reserva__fecha_reserva=fecha)
+        .exclude(reserva__estado='completada')
+        .select_related('reserva', 'reserva__usuario')
+        .order_by('reserva__hora_reserva', 'id')
+    )
+    ubicadas = [a for a in asignaciones if a.reserva.latitud is not None and a.reserva.longitud is not None]
+    sin_ubicacion = [a for a in asignaciones if a not in ubicadas]
+
+    ruta = optimizar_ruta([a.reserva for a in ubicadas])
+    por_reserva = {a.reserva_id: a for a in ubicadas}
+    ruta.asignaciones = [por_reserva[r.id] for r in ruta.paradas]
+    ruta.sin_ubicacion = sin_ubicacion
+    return ruta
@@ -0,0 +1,302 @@
+import random
+from bisect import bisect
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .disponibilidad import HORA_APERTURA, HORA_CIERRE, duracion_reserva, margen_traslado
+from .models import Asignacion, HistorialTarea, Reserva, Usuario
+
+NOMBRES = (
+    'Ana', 'Benjamín', 'Camila', 'Diego', 'Elena', 'Felipe', 'Gabriela', 'Héctor', 'Isidora', 'Javier',
+    'Karen', 'Luis', 'María', 'Nicolás', 'Olivia', 'Pablo', 'Rosa', 'Sebastián', 'Tomás', 'Valentina',
+)
+APELLIDOS = (
+    'González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez', 'Sepúlveda',
+    'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández', 'Torres', 'Araya', 'Flores', 'Espinoza', 'Valenzuela',
+)
+CALLES = (
+    'Av. Providencia', 'Av. Apoquindo', 'Los Leones', 'Irarrázaval', 'Gran Avenida', 'Av. Matta',
+    'Av. Vicuña Mackenna', 'Pedro de Valdivia', 'Av. Grecia', 'Av. Independencia', 'Av. Pajaritos', 'Manuel Montt',
+)
+# Comuna, latitud y longitud del centro; las direcciones se reparten alrededor.
+COMUNAS = (
+    ('Santiago', -33.4489, -70.6693),
+    ('Providencia', -33.4314, -70.6093),
+    ('Las Condes', -33.4089, -70.5671),
+    ('Ñuñoa', -33.4569, -70.5979),
+    ('Maipú', -33.5106, -70.7572),
+    ('La Florida', -33.5227, -70.5983),
+    ('Puente Alto', -33.6117, -70.5758),
+    ('Independencia', -33.4163, -70.6654),
+)
+DISPERSION_GRADOS = 0.015
+
+# Peso de cada día de la semana (lunes primero) y de cada hora de inicio.
+PESO_DIA = (1.0, 1.0, 1.0, 1.0, 0.9, 0.45, 0.15)
+PESO_HORA = {8: 0.6, 9: 1.0, 10: 1.0, 11: 0.9, 12: 0.5, 13: 0.4, 14: 0.7, 15: 0.9, 16: 0.9, 17: 0.7, 18: 0.4, 19: 0.2}
+PROPORCION_OFICINA = 0.3
+CLIENTES_POR_OFICINA = 25
+PROPORCION_INACTIVOS = 0.03
+
+# Probabilidad de que una reserva tenga personal: casi todas las pasadas y
+# menos cuanto más lejos está en el futuro.
+ATENDIDAS_PASADO = 0.97
+ASIGNADAS_PROXIMAS = 0.85
+ASIGNADAS_LEJANAS = 0.5
+DIAS_PROXIMOS = 14
+# Personal que se prueba por reserva antes de dejarla pendiente.
+INTENTOS_PERSONAL = 6
+INTENTOS_CLIENTE = 5
+
+
+class ResultadoSemilla:
+    def __init__(self):
+        self.clientes = 0
+        self.personal = 0
+        self.reservas = 0
+        self.asignaciones = 0
+        self.tareas = 0
+
+
+def _repartir(total, pesos):
+    # Reparte `total` proporcionalmente a `pesos` en enteros que suman
+    # exactamente `total` (mayor resto).
+    suma = sum(pesos)
+    exactos = [total * p / suma for p in pesos]
+    partes = [int(x) for x in exactos]
+    restos = sorted(range(len(pesos)), key=lambda i: partes[i] - exactos[i])
+    for i in restos[:total - sum(partes)]:
+        partes[i] += 1
+    return partes
+
+
+def _lugar(rng):
+    comuna, latitud, longitud = rng.choice(COMUNAS)
+    direccion = f'{rng.choice(CALLES)} {rng.randint(100, 9999)}, {comuna}'
+    return (
+        direccion,
+        round(rng.gauss(latitud, DISPERSION_GRADOS), 6),
+        round(rng.gauss(longitud, DISPERSION_GRADOS), 6),
+    )
+
+
+def _usuarios(rng, cantidad, rol, dominio, contraseña):
+    return [
+        Usuario(
+            nombre=f'{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}',
+            correo=f'{rol}{i}@{dominio}',
+            contraseña=contraseña,
+            rol=rol,
+            estado='inactivo' if rng.random() < PROPORCION_INACTIVOS else 'activo',
+        )
+        for i in range(cantidad)
+    ]
+
+
+class _Tabla:
+    # Filas listas para un INSERT con executemany. Con un millón de reservas,
+    # bulk_create pasa la mayor parte del tiempo preparando cada valor de cada
+    # campo; aquí los valores ya van en el formato de la base y los ids se
+    # asignan de antemano, así las asignaciones y tareas no esperan a que
+    # vuelvan los de sus reservas.
+
+    def __init__(self, modelo, campos):
+        ops = connection.ops
+        columnas = ', '.join(ops.quote_name(modelo._meta.get_field(campo).column) for campo in ('id', *campos))
+        marcas = ', '.join(['%s'] * (len(campos) + 1))
+        self.sql = f'INSERT INTO {ops.quote_name(modelo._meta.db_table)} ({columnas}) VALUES ({marcas})'
+        self.filas = []
+        self.siguiente_id = (modelo.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0) + 1
+
+    def agregar(self, *valores):
+        nuevo_id = self.siguiente_id
+        self.siguiente_id += 1
+        self.filas.append((nuevo_id, *valores))
+        return nuevo_id
+
+    def guardar(self, cursor):
+        cursor.executemany(self.sql, self.filas)
+        total = len(self.filas)
+        self.filas = []
+        return total
+
+
+@contextmanager
+def _sin_indices(modelos):
+    # En SQLite, mantener los índices fila a fila cuesta más que insertar las
+    # filas; crearlos al final, de una vez, cuesta menos de la mitad. Se
+    # vuelven a crear aunque la carga falle.
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    tablas = [modelo._meta.db_table for modelo in modelos]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+            f"AND tbl_name IN ({', '.join(['%s'] * len(tablas))})",
+            tablas,
+        )
+        indices = cursor.fetchall()
+        for nombre, _ in indices:
+            cursor.execute(f'DROP INDEX {connection.ops.quote_name(nombre)}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for _, sql in indices:
+                cursor.execute(sql)
+
+
+def generar(clientes, personal, reservas, desde, dias, hoy=None, semilla=0, lote=20000,
+            contraseña='semilla', dominio='semilla.local', progreso=None):
+    # Datos de prueba deterministas: con los mismos argumentos y la misma base
+    # de partida se generan las mismas filas. Las reservas se crean día por
+    # día y se insertan en lotes, así que la memoria no depende del total. El
+    # personal nunca queda con dos trabajos que choquen (la regla de
+    # disponibilidad.choca). Debe correr sin otros escritores: los ids de
+    # reservas, asignaciones y tareas se calculan desde los máximos actuales.
+    rng = random.Random(semilla)
+    hoy = hoy or date.today()
+    zona = timezone.get_current_timezone()
+    ops = connection.ops
+    resultado = ResultadoSemilla()
+
+    # Un solo hash para todos: make_password por fila tardaría horas.
+    contraseña = make_password(contraseña)
+    with transaction.atomic():
+        nuevos_clientes = Usuario.objects.bulk_create(_usuarios(rng, clientes, 'cliente', dominio, contraseña), batch_size=lote)
+        nuevo_personal = Usuario.objects.bulk_create(_usuarios(rng, personal, 'personal', dominio, contraseña), batch_size=lote)
+    resultado.clientes = len(nuevos_clientes)
+    resultado.personal = len(nuevo_personal)
+
+    activos = [u.id for u in nuevos_clientes if u.estado == 'activo']
+    domicilios = {cliente_id: _lugar(rng) for cliente_id in activos}
+    oficinas = [_lugar(rng) for _ in range(max(1, len(activos) // CLIENTES_POR_OFICINA))]
+    personal_activo = [u.id for u in nuevo_personal if u.estado == 'activo']
+    if not activos:
+        return resultado
+
+    minutos = {
+        tipo: int(duracion_reserva(tipo).total_seconds() // 60) for tipo, _ in Reserva.TIPO_UBICACION_CHOICES
+    }
+    margen = int(margen_traslado().total_seconds() // 60)
+
+    horas = [
+        time(hora, minuto)
+        for hora in range(HORA_APERTURA.hour, HORA_CIERRE.hour)
+        for minuto in (0, 30)
+    ]
+    horas_db = [ops.adapt_timefield_value(hora) for hora in horas]
+    pesos_hora = list(accumulate(PESO_HORA.get(hora.hour, 0.1) * (0.5 if hora.minute else 1) for hora in horas))
+    fechas = [desde + timedelta(days=i) for i in range(dias)]
+    por_dia = _repartir(reservas, [PESO_DIA[fecha.weekday()] for fecha in fechas])
+
+    tabla_reservas = _Tabla(Reserva, (
+        'fecha_reserva', 'hora_reserva', 'direccion', 'tipo_ubicacion', 'latitud', 'longitud', 'estado', 'usuario',
+        'version',
+    ))
+    tabla_asignaciones = _Tabla(Asignacion, ('fecha_asignacion', 'reserva', 'usuario'))
+    tabla_tareas = _Tabla(HistorialTarea, ('hora_inicio', 'hora_fin', 'ubicacion', 'asignacion'))
+
+    def guardar():
+        with transaction.atomic(), connection.cursor() as cursor:
+            resultado.reservas += tabla_reservas.guardar(cursor)
+            resultado.asignaciones += tabla_asignaciones.guardar(cursor)
+            resultado.tareas += tabla_tareas.guardar(cursor)
+        if progreso:
+            progreso(resultado)
+
+    with _sin_indices([Reserva, Asignacion, HistorialTarea]):
+        # random() y un índice en vez de choice() y randint(): con un millón de
+        # reservas la diferencia es de varios segundos.
+        aleatorio = rng.random
+        for fecha, cantidad in zip(fechas, por_dia):
+            fecha_db = ops.adapt_datefield_value(fecha)
+            asignadas_el = [ops.adapt_datefield_value(fecha - timedelta(days=dias_antes)) for dias_antes in range(8)]
+            inicios = sorted(bisect(pesos_hora, aleatorio() * pesos_hora[-1]) for _ in range(cantidad))
+            pasado = fecha < hoy
+            if pasado:
+                # Inicio de cada hora en UTC sin zona, como lo guarda el ORM con USE_TZ.
+                inicios_utc = [
+                    datetime.combine(fecha, hora, tzinfo=zona).astimezone(dt_timezone.utc).replace(tzinfo=None)
+                    for hora in horas
+                ]
+            if pasado:
+                probabilidad = ATENDIDAS_PASADO
+            elif (fecha - hoy).days < DIAS_PROXIMOS:
+                probabilidad = ASIGNADAS_PROXIMAS
+            else:
+                probabilidad = ASIGNADAS_LEJANAS
+            # Por personal: (inicio, fin con margen) en minutos del día.
+            agenda = defaultdict(list)
+            ocupados = set()
+
+            for indice_hora in inicios:
+                # Un cliente no reserva dos veces la misma hora del mismo día.
+                for _ in range(INTENTOS_CLIENTE):
+                    cliente_id = activos[int(aleatorio() * len(activos))]
+                    if (cliente_id, indice_hora) not in ocupados:
+                        break
+                else:
+                    continue
+                ocupados.add((cliente_id, indice_hora))
+
+                if aleatorio() < PROPORCION_OFICINA:
+                    tipo_ubicacion = 'oficina'
+                    direccion, latitud, longitud = oficinas[int(aleatorio() * len(oficinas))]
+                else:
+                    tipo_ubicacion = 'residencia'
+                    direccion, latitud, longitud = domicilios[cliente_id]
+
+                personal_id = None
+                hora = horas[indice_hora]
+                if personal_activo and aleatorio() < probabilidad:
+                    inicio = hora.hour * 60 + hora.minute
+                    fin = inicio + minutos[tipo_ubicacion]
+                    for _ in range(INTENTOS_PERSONAL):
+                        candidato = personal_activo[int(aleatorio() * len(personal_activo))]
+                        trabajos = agenda[candidato]
+                        if all(not (otro_inicio < fin and inicio < otro_fin) for otro_inicio, otro_fin in trabajos):
+                            trabajos.append((inicio, fin + margen))
+                            personal_id = candidato
+                            break
+
+                if personal_id is None:
+                    estado = 'pendiente'
+                else:
+                    estado = 'completada' if pasado else 'asignada'
+                reserva_id = tabla_reservas.agregar(
+                    fecha_db, horas_db[indice_hora], direccion, tipo_ubicacion, latitud, longitud, estado, cliente_id, 1
+                )
+
+                if personal_id is not None:
+                    fecha_asignacion = asignadas_el[int(aleatorio() * len(asignadas_el))]
+                    asignacion_id = tabla_asignaciones.agregar(fecha_asignacion, reserva_id, personal_id)
+                    if pasado:
+                        comienzo = inicios_utc[indice_hora] + timedelta(minutes=int(aleatorio() * 26) - 10)
+                        duracion = max(20, rng.gauss(minutos[tipo_ubicacion], minutos[tipo_ubicacion] * 0.2))
+                        tabla_tareas.agregar(
+                            str(comienzo),
+                            str(comienzo + timedelta(minutes=duracion)),
+                            direccion,
+                            asignacion_id,
+                        )
+
+                if len(tabla_reservas.filas) >= lote:
+                    guardar()
+    guardar()
+
+    # En bases con secuencias (PostgreSQL) hay que avisarles de los ids usados;
+    # en SQLite la lista viene vacía.
+    with connection.cursor() as cursor:
+        for sql in ops.sequence_reset_sql(no_style(), [Reserva, Asignacion, HistorialTarea]):
+            cursor.execute(sql)
+    return resultado
@@ -0,0 +1,126 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.shortcuts import redirect
+
+from .models import Usuario
+
+CACHE_MAXIMO = 1024
+CACHE_TTL = 60
+
+
+class CacheUsuarios:
+    # LRU con expiración, local al proceso. Otros procesos ven los cambios de
+    # un usuario como mucho CACHE_TTL segundos después.
+
+    def __init__(self, maximo=CACHE_MAXIMO, ttl=CACHE_TTL):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, usuario_id):
+        with self._lock:
+            entrada = self._datos.get(usuario_id)
+            if entrada is None:
+                return None
+            usuario, expira = entrada
+            if expira < time.monotonic():
+                del self._datos[usuario_id]
+                return None
+            self._datos.move_to_end(usuario_id)
+            return usuario
+
+    def guardar(self, usuario):
+        with self._lock:
+            self._datos[usuario.id] = (usuario, time.monotonic() + self.ttl)
+            self._datos.move_to_end(usuario.id)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, usuario_id):
+        with self._lock:
+            self._datos.pop(usuario_id, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+usuarios = CacheUsuarios()
+
+
+def obtener_usuario(usuario_id):
+    if not usuario_id:
+        return None
+    usuario = usuarios.obtener(usuario_id)
+    if usuario is None:
+        usuario = Usuario.objects.filter(id=usuario_id).first()
+        if usuario is None:
+            return None
+        usuarios.guardar(usuario)
+    # Cada petición recibe su propia copia para que los cambios de una vista
+    # no se filtren a otras peticiones a través de la caché.
+    return copy.copy(usuario)
+
+
+async def aobtener_usuario(usuario_id):
+    if not usuario_id:
+        return None
+    usuario = usuarios.obtener(usuario_id)
+    if usuario is None:
+        usuario = await Usuario.objects.filter(id=usuario_id).afirst()
+        if usuario is None:
+            return None
+        usuarios.guardar(usuario)
+    return copy.copy(usuario)
+
+
+class UsuarioSesionMiddleware:
+    # Funciona en WSGI y en ASGI; en ASGI la sesión y el usuario se leen sin
+    # ocupar un hilo.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.usuario = obtener_usuario(request.session.get('usuario_id'))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.usuario = await aobtener_usuario(await request.session.aget('usuario_id'))
+        return await self.get_response(request)
+
+
+def requiere_rol(*roles, redireccion='../dashboard'):
+    # Sin roles basta con haber iniciado sesión.
+    def permitido(request):
+        usuario = request.usuario
+        return usuario is not None and (not roles or usuario.rol in roles)
+
+    def decorador(vista):
+        if iscoroutinefunction(vista):
+            @wraps(vista)
+            async def envoltura_async(request, *args, **kwargs):
+                if not permitido(request):
+                    return redirect(redireccion)
+                return await vista(request, *args, **kwargs)
+            return envoltura_async
+
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if not permitido(request):
+                return redirect(redireccion)
+            return vista(request, *args, **kwargs)
+        return envoltura
+    return decorador
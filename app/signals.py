@@ -1,7 +1,16 @@
-from django.db.models.signals import post_migrate
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate, pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.hashers import make_password
-from app.models import Usuario
+from app.models import Usuario, Reserva, Asignacion, HistorialTarea, Turno, Feriado
+from app.basedatos import configurar_sqlite
+from app.metricas import medir_consulta
+from app.calendario import invalidar_calendario
+from app.eventos import programar_eventos, tipo_por_estado
+from app import analitica
+from app.horario import invalidar_semana
+from app.sesion import usuarios
 
 @receiver(post_migrate)
 def crear_usuarios_iniciales(sender, **kwargs):
@@ -38,4 +47,107 @@ def crear_usuarios_iniciales(sender, **kwargs):
                 rol='administrador',
                 estado='activo'
             )
-            
+
+
+@receiver(pre_save, sender=Reserva)
+def recordar_valores_anteriores_reserva(sender, instance, update_fields=None, **kwargs):
+    # Se guardan para post_save: fuera de una transacción, on_commit corre de
+    # inmediato y aquí la fila todavía tiene la fecha anterior.
+    instance._fecha_anterior = None
+    instance._estado_anterior = instance.estado
+    if not instance.pk or (update_fields is not None and not {'fecha_reserva', 'estado'} & set(update_fields)):
+        return
+    anterior = Reserva.objects.filter(pk=instance.pk).values_list('fecha_reserva', 'estado').first()
+    if anterior:
+        fecha, instance._estado_anterior = anterior
+        if fecha != instance.fecha_reserva:
+            instance._fecha_anterior = fecha
+
+@receiver(post_save, sender=Reserva)
+@receiver(post_delete, sender=Reserva)
+def invalidar_semana_reserva(sender, instance, **kwargs):
+    fechas = {instance.fecha_reserva}
+    anterior = getattr(instance, '_fecha_anterior', None)
+    if anterior:
+        fechas.add(anterior)
+    for fecha in fechas:
+        transaction.on_commit(lambda fecha=fecha: invalidar_semana(fecha), robust=True)
+
+@receiver(post_save, sender=Asignacion)
+@receiver(post_delete, sender=Asignacion)
+def invalidar_semana_asignacion(sender, instance, **kwargs):
+    try:
+        fecha = instance.reserva.fecha_reserva
+    except Reserva.DoesNotExist:
+        return
+    transaction.on_commit(lambda: invalidar_semana(fecha), robust=True)
+
+# Los eventos se registran después de invalidar la semana (ver app.eventos).
+@receiver(post_save, sender=Reserva)
+def publicar_evento_reserva(sender, instance, created, **kwargs):
+    if created:
+        tipo = 'creada'
+    else:
+        tipo = tipo_por_estado(getattr(instance, '_estado_anterior', instance.estado), instance.estado)
+    programar_eventos(tipo, [instance.id])
+
+@receiver(post_delete, sender=Reserva)
+def publicar_eliminacion_reserva(sender, instance, **kwargs):
+    programar_eventos('eliminada', [instance.id], {instance.id: [instance.usuario_id]})
+
+@receiver(post_delete, sender=Asignacion)
+def publicar_liberacion_asignacion(sender, instance, **kwargs):
+    programar_eventos('liberada', [instance.reserva_id], {instance.reserva_id: [instance.usuario_id]})
+
+# Resúmenes diarios del panel (ver app.analitica): cada cambio suma su
+# diferencia dentro de la misma transacción.
+def _reserva_de(instance):
+    if isinstance(instance, Reserva):
+        return instance.pk
+    if isinstance(instance, Asignacion):
+        return instance.reserva_id
+    return Asignacion.objects.filter(id=instance.asignacion_id).values_list('reserva_id', flat=True).first()
+
+@receiver(pre_save, sender=Reserva)
+@receiver(pre_save, sender=Asignacion)
+@receiver(pre_save, sender=HistorialTarea)
+def recordar_resumen(sender, instance, **kwargs):
+    instance._resumen_antes = analitica.antes_de_guardar(_reserva_de(instance))
+
+@receiver(post_save, sender=Reserva)
+@receiver(post_save, sender=Asignacion)
+@receiver(post_save, sender=HistorialTarea)
+def actualizar_resumen(sender, instance, **kwargs):
+    analitica.despues_de_guardar(_reserva_de(instance), getattr(instance, '_resumen_antes', {}))
+
+@receiver(post_delete, sender=HistorialTarea)
+def restar_tarea_del_resumen(sender, instance, **kwargs):
+    analitica.tarea_borrada(instance)
+
+@receiver(post_delete, sender=Asignacion)
+def restar_asignacion_del_resumen(sender, instance, **kwargs):
+    analitica.asignacion_borrada(instance)
+
+@receiver(post_delete, sender=Reserva)
+def restar_reserva_del_resumen(sender, instance, **kwargs):
+    analitica.reserva_borrada(instance)
+
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+def invalidar_usuario_en_cache(sender, instance, **kwargs):
+    usuarios.invalidar(instance.id)
+
+@receiver(post_save, sender=Turno)
+@receiver(post_delete, sender=Turno)
+@receiver(post_save, sender=Feriado)
+@receiver(post_delete, sender=Feriado)
+def invalidar_calendario_en_cache(sender, **kwargs):
+    transaction.on_commit(invalidar_calendario, robust=True)
+
+@receiver(connection_created)
+def configurar_conexion(sender, connection, **kwargs):
+    configurar_sqlite(connection)
+    # El mismo objeto de conexión se reconecta (CONN_MAX_AGE), así que la
+    # señal puede llegar varias veces para él.
+    if medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(medir_consulta)
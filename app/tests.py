@@ -1,3 +1,1370 @@
-from django.test import TestCase
+import asyncio
+import io
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import date, datetime, time as hora, timedelta, timezone as tz
+from unittest import mock
 
-# Create your tests here.
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Count
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache, caches
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as CorreoEnMemoria
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .basedatos import atomico_con_reintentos
+from .calendario import CLAVE_CALENDARIO, DIA_COMPLETO, Calendario, mascara_turno
+from .disponibilidad import DURACION_RESERVA, choca, duracion_reserva
+from .duraciones import CLAVE_DURACION, estadisticas
+from . import analitica, eventos, mapa, metricas, notificaciones, views
+from .exportacion import CHUNK_SIZE
+from .horario import _clave_version, aclave_horario, invalidar_semana, lunes_de
+from .limites import ip_cliente
+from .replanificacion import replanificar_dia
+from .rutas import ruta_del_dia
+from .paginacion import _codificar, paginar_por_cursor
+from .models import (
+    Asignacion, EventoHorario, Feriado, HistorialTarea, Notificacion, Reserva, ResumenDiario, Turno, Usuario,
+)
+from .semilla import generar
+from .sesion import usuarios
+
+
+def crear_usuario(rol, nombre=None, **campos):
+    nombre = nombre or rol
+    campos.setdefault('correo', f'{nombre}@example.com')
+    campos.setdefault('contraseña', 'x')
+    return Usuario.objects.create(nombre=nombre, rol=rol, estado='activo', **campos)
+
+
+def crear_historial(cantidad, personal=None, cliente=None, desde=None):
+    personal = personal or crear_usuario('personal')
+    cliente = cliente or crear_usuario('cliente')
+    desde = desde or datetime(2024, 1, 1, 8, tzinfo=tz.utc)
+    reserva = Reserva.objects.create(
+        fecha_reserva=desde.date(), direccion='Calle 1', estado='completada', usuario=cliente,
+    )
+    asignacion = Asignacion.objects.create(fecha_asignacion=desde.date(), reserva=reserva, usuario=personal)
+    HistorialTarea.objects.bulk_create(
+        HistorialTarea(
+            hora_inicio=desde + timedelta(hours=i),
+            hora_fin=desde + timedelta(hours=i, minutes=90),
+            ubicacion='Calle 1',
+            asignacion=asignacion,
+        )
+        for i in range(cantidad)
+    )
+    return asignacion
+
+
+def limpiar_caches():
+    # Las cachés en memoria sobreviven entre tests y los ids se repiten.
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def iniciar_sesion(client, usuario):
+    # Los ids se repiten entre tests (cada uno se deshace); la caché de
+    # usuarios del proceso podría devolver el de otro test.
+    usuarios.invalidar(usuario.id)
+    sesion = client.session
+    sesion['usuario_id'] = usuario.id
+    sesion.save()
+
+
+@override_settings(SQLITE_REINTENTOS=2)
+class AtomicoConReintentosTests(TransactionTestCase):
+
+    def test_repite_solo_la_transaccion_bloqueada(self):
+        llamadas = []
+
+        def crear():
+            llamadas.append(1)
+            crear_usuario('cliente', f'cliente{len(llamadas)}')
+            if len(llamadas) == 1:
+                raise OperationalError('database is locked')
+
+        with mock.patch('app.basedatos.time.sleep'):
+            atomico_con_reintentos(crear)
+        self.assertEqual(len(llamadas), 2)
+        # El primer intento se deshizo entero.
+        self.assertEqual(list(Usuario.objects.filter(rol='cliente', nombre__startswith='cliente').values_list('nombre', flat=True)), ['cliente2'])
+
+    def test_no_reintenta_otros_errores_ni_dentro_de_un_atomic(self):
+        llamadas = []
+
+        def falla():
+            llamadas.append(1)
+            raise OperationalError('database is locked')
+
+        with mock.patch('app.basedatos.time.sleep'):
+            with self.assertRaises(OperationalError):
+                atomico_con_reintentos(falla)
+            self.assertEqual(len(llamadas), 3)
+
+            llamadas.clear()
+            with self.assertRaises(OperationalError), transaction.atomic():
+                atomico_con_reintentos(falla)
+            self.assertEqual(len(llamadas), 1)
+
+    def test_fallo_despues_del_commit_no_repite_la_reserva(self):
+        cliente = crear_usuario('cliente')
+        crear_usuario('personal')
+        iniciar_sesion(self.client, cliente)
+        fecha = date.today() + timedelta(days=7)
+
+        with mock.patch('app.eventos.publicar', side_effect=OperationalError('database is locked')):
+            respuesta = self.client.post('/crear_reserva/', {
+                'direccion': 'Calle 1',
+                'tipo_ubicacion': 'residencia',
+                'fecha': fecha.isoformat(),
+                'hora_reserva': '10:00',
+            })
+
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(Reserva.objects.count(), 1)
+        self.assertEqual(Asignacion.objects.count(), 1)
+        self.assertEqual(Notificacion.objects.count(), 1)
+
+
+class ExportarHistorialTests(TestCase):
+    # Varios bloques de exportacion.CHUNK_SIZE.
+    FILAS_MEMORIA = 2 * CHUNK_SIZE
+
+    def setUp(self):
+        asignacion = crear_historial(5)
+        self.personal, self.cliente = asignacion.usuario, asignacion.reserva.usuario
+        administrador = crear_usuario('administrador')
+        iniciar_sesion(self.client, administrador)
+        iniciar_sesion(self.async_client, administrador)
+
+    def test_wsgi_usa_un_iterador_sincrono(self):
+        respuesta = self.client.get('/exportar_historial/', {'formato': 'ndjson'})
+        self.assertFalse(respuesta.is_async)
+        self.assertEqual(len(b''.join(respuesta.streaming_content).splitlines()), 5)
+
+    async def test_asgi_usa_un_iterador_asincrono(self):
+        respuesta = await self.async_client.get('/exportar_historial/')
+        self.assertTrue(respuesta.is_async)
+        lineas = b''.join([parte async for parte in respuesta.streaming_content]).decode().splitlines()
+        self.assertEqual(lineas[0], 'id,fecha,hora_inicio,hora_fin,horas,ubicacion,personal,cliente')
+        self.assertEqual(len(lineas), 6)
+        self.assertTrue(lineas[1].endswith(',1.5,Calle 1,personal,cliente'))
+
+    async def medir(self, asgi):
+        # Bytes enviados y pico de memoria mientras se consume la exportación,
+        # por WSGI o por ASGI según el cliente.
+        if asgi:
+            respuesta = await self.async_client.get('/exportar_historial/')
+        else:
+            respuesta = await sync_to_async(self.client.get)('/exportar_historial/')
+        total = 0
+        tracemalloc.start()
+        try:
+            if asgi:
+                async for parte in respuesta.streaming_content:
+                    total += len(parte)
+            else:
+                def consumir():
+                    return sum(len(parte) for parte in respuesta.streaming_content)
+                total = await sync_to_async(consumir)()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return total, pico
+
+    async def comparar_memoria(self, asgi):
+        # El pico lo marca un bloque de CHUNK_SIZE filas, no el total: con
+        # cuatro veces más filas tiene que quedar casi igual.
+        await sync_to_async(crear_historial)(self.FILAS_MEMORIA, self.personal, self.cliente)
+        total, pico = await self.medir(asgi)
+        await sync_to_async(crear_historial)(3 * self.FILAS_MEMORIA, self.personal, self.cliente)
+        total_grande, pico_grande = await self.medir(asgi)
+        self.assertGreater(total_grande, 3.5 * total)
+        self.assertLess(pico_grande, 1.5 * pico, f'pico de {pico} bytes con {total} enviados y de {pico_grande} con {total_grande}')
+
+    async def test_memoria_acotada(self):
+        await self.comparar_memoria(asgi=False)
+
+    async def test_memoria_acotada_asgi(self):
+        await self.comparar_memoria(asgi=True)
+
+
+class TareasTests(TestCase):
+
+    def setUp(self):
+        self.personal = crear_usuario('personal')
+        reserva = Reserva.objects.create(
+            fecha_reserva=date.today(), direccion='Calle 1', estado='asignada', usuario=crear_usuario('cliente'),
+        )
+        self.asignacion = Asignacion.objects.create(fecha_asignacion=date.today(), reserva=reserva, usuario=self.personal)
+        iniciar_sesion(self.client, self.personal)
+
+    def iniciar(self):
+        return self.client.get(f'/iniciar_tarea/{self.asignacion.id}/')
+
+    def finalizar(self):
+        return self.client.get(f'/finalizar_tarea/{self.asignacion.id}/')
+
+    def test_iniciar_deja_la_tarea_abierta(self):
+        self.iniciar()
+        self.iniciar()
+        tarea = HistorialTarea.objects.get(asignacion=self.asignacion)
+        self.assertIsNone(tarea.hora_fin)
+        self.assertEqual(tarea.ubicacion, 'Calle 1')
+        self.assertEqual(Reserva.objects.get().estado, 'asignada')
+
+    def test_finalizar_cierra_la_tarea_abierta(self):
+        self.iniciar()
+        self.finalizar()
+        tarea = HistorialTarea.objects.get(asignacion=self.asignacion)
+        self.assertIsNotNone(tarea.hora_fin)
+        self.assertGreaterEqual(tarea.hora_fin, tarea.hora_inicio)
+        self.assertEqual(Reserva.objects.get().estado, 'completada')
+
+    def test_finalizar_dos_veces_no_cambia_la_hora_de_fin(self):
+        self.iniciar()
+        self.finalizar()
+        hora_fin = HistorialTarea.objects.get().hora_fin
+        self.finalizar()
+        self.iniciar()
+        self.assertEqual(HistorialTarea.objects.count(), 1)
+        self.assertEqual(HistorialTarea.objects.get().hora_fin, hora_fin)
+
+    def test_finalizar_sin_iniciar_queda_con_duracion_cero(self):
+        self.finalizar()
+        tarea = HistorialTarea.objects.get()
+        self.assertEqual(tarea.hora_inicio, tarea.hora_fin)
+        self.assertEqual(Reserva.objects.get().estado, 'completada')
+
+    def test_tareas_abiertas_y_de_duracion_cero_no_cuentan(self):
+        ahora = timezone.now()
+        HistorialTarea.objects.bulk_create([
+            HistorialTarea(hora_inicio=ahora, ubicacion='a', asignacion=self.asignacion),
+            HistorialTarea(hora_inicio=ahora, hora_fin=ahora, ubicacion='b', asignacion=self.asignacion),
+            HistorialTarea(hora_inicio=ahora, hora_fin=ahora + timedelta(minutes=45), ubicacion='c', asignacion=self.asignacion),
+        ])
+        fila, = estadisticas()['personal']
+        self.assertEqual((fila['muestras'], fila['media']), (1, 45))
+
+
+@override_settings(DURACION_APRENDIDA={'activa': True, 'percentil': 80, 'dias': 90, 'minimo_muestras': 3})
+class DuracionAprendidaTests(TestCase):
+
+    def setUp(self):
+        cache.delete(CLAVE_DURACION)
+        self.addCleanup(cache.delete, CLAVE_DURACION)
+
+    def test_sin_historial_usa_la_duracion_fija(self):
+        self.assertEqual(duracion_reserva(), DURACION_RESERVA)
+
+    def test_con_muestras_suficientes_usa_la_aprendida(self):
+        crear_historial(3, desde=timezone.now() - timedelta(days=1))
+        # 90 minutos medidos, redondeados a bloques de 15.
+        self.assertEqual(duracion_reserva(), timedelta(minutes=90))
+
+    def test_con_pocas_muestras_sigue_la_fija(self):
+        crear_historial(2, desde=timezone.now() - timedelta(days=1))
+        self.assertEqual(duracion_reserva(), DURACION_RESERVA)
+
+    @override_settings(DURACION_POR_TIPO={'oficina': timedelta(minutes=45)})
+    def test_la_duracion_por_tipo_tiene_prioridad(self):
+        crear_historial(3, desde=timezone.now() - timedelta(days=1))
+        self.assertEqual(duracion_reserva('oficina'), timedelta(minutes=45))
+        self.assertEqual(duracion_reserva('residencia'), timedelta(minutes=90))
+
+
+class IndicesTests(TestCase):
+    # Las consultas de las vistas más usadas sobre 100.000 reservas generadas
+    # por app.semilla: ninguna debe recorrer una tabla completa, y cada índice
+    # de Reserva y HistorialTarea tiene que aparecer en algún plan.
+    TABLAS = ('app_reserva', 'app_asignacion', 'app_historialtarea')
+
+    @classmethod
+    def setUpTestData(cls):
+        hoy = date.today()
+        generar(2000, 50, 100000, hoy - timedelta(days=270), 365, hoy=hoy)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        semilla = Usuario.objects.filter(correo__endswith='@semilla.local')
+        cls.cliente = semilla.filter(rol='cliente', reserva__isnull=False).first()
+        cls.personal = semilla.filter(rol='personal', asignacion__isnull=False).first()
+        cls.administrador = crear_usuario('administrador')
+
+    def setUp(self):
+        limpiar_caches()
+
+    def explicar(self, sql, params):
+        # Con los mismos parámetros que la consulta real: un plan sobre el SQL
+        # con los valores escritos puede usar índices que la real no usa.
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(fila[3] for fila in cursor.fetchall())
+
+    def planes(self, usuario, url, datos=None):
+        consultas = []
+
+        def capturar(execute, sql, params, many, context):
+            if not many and any(tabla in sql for tabla in self.TABLAS):
+                consultas.append((sql, params))
+            return execute(sql, params, many, context)
+
+        iniciar_sesion(self.client, usuario)
+        with connection.execute_wrapper(capturar):
+            respuesta = self.client.get(url, datos)
+        self.assertEqual(respuesta.status_code, 200, url)
+        return [f'{url}\n' + self.explicar(sql, params) for sql, params in consultas]
+
+    def test_sin_recorridos_completos(self):
+        casos = [
+            (self.cliente, '/horario_reservas/', None),
+            (self.personal, '/horario_reservas/', None),
+            (self.administrador, '/horario_reservas/', None),
+            (self.cliente, '/reservas/', None),
+            (self.personal, '/asignaciones_pendientes/', None),
+            (self.personal, '/asignaciones_completadas/', None),
+            (self.administrador, '/mapa_asignaciones/', None),
+            (self.administrador, '/mapa_asignaciones/geojson/', {'bbox': '-180,-90,180,90', 'zoom': 10}),
+            (self.administrador, '/ver_historial/', {'fecha_desde': (date.today() - timedelta(days=7)).isoformat()}),
+        ]
+        # reasignar_pendientes y asignar_manual.
+        planes = [self.explicar(*Reserva.objects.filter(estado='pendiente').query.sql_with_params())]
+        for usuario, url, datos in casos:
+            planes += self.planes(usuario, url, datos)
+
+        for plan in planes:
+            for linea in plan.splitlines():
+                for tabla in self.TABLAS:
+                    self.assertNotEqual(linea, f'SCAN {tabla}', plan)
+
+        usados = '\n'.join(planes)
+        for modelo in (Reserva, HistorialTarea):
+            for indice in modelo._meta.indexes:
+                self.assertIn(indice.name, usados)
+
+
+def en_paralelo(funcion, argumentos):
+    # Un hilo por argumento; todos esperan en una barrera para empezar juntos.
+    # Devuelve los resultados y los segundos desde que se abre la barrera.
+    barrera = threading.Barrier(len(argumentos) + 1)
+    resultados = [None] * len(argumentos)
+
+    def correr(i, argumento):
+        try:
+            barrera.wait()
+            resultados[i] = funcion(argumento)
+        except Exception as error:
+            resultados[i] = error
+        finally:
+            connections.close_all()
+
+    hilos = [threading.Thread(target=correr, args=(i, a)) for i, a in enumerate(argumentos)]
+    for hilo in hilos:
+        hilo.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.join()
+    return resultados, time.perf_counter() - inicio
+
+
+# Esperar el candado de escritura cuenta como consulta lenta en app.metricas.
+@override_settings(METRICAS_CONSULTA_LENTA=60)
+class CrearReservaConcurrenteTests(TransactionTestCase):
+    CLIENTES = 16
+
+    def test_sin_dobles_asignaciones_bajo_carga(self):
+        for i in range(3):
+            crear_usuario('personal', f'personal{i}')
+        activos = Usuario.objects.filter(rol='personal', estado='activo').count()
+        fecha = date.today() + timedelta(days=7)
+
+        navegadores = []
+        for i in range(self.CLIENTES):
+            navegador = Client()
+            iniciar_sesion(navegador, crear_usuario('cliente', f'cliente{i}'))
+            navegadores.append(navegador)
+
+        def reservar(navegador):
+            return navegador.post('/crear_reserva/', {
+                'direccion': 'Calle 1',
+                'tipo_ubicacion': 'residencia',
+                'fecha': fecha.isoformat(),
+                'hora_reserva': '10:00',
+            }).status_code
+
+        resultados, segundos = en_paralelo(reservar, navegadores)
+
+        self.assertEqual(resultados, [302] * self.CLIENTES)
+        self.assertEqual(Reserva.objects.count(), self.CLIENTES)
+        # Todos piden la misma hora: cada persona puede tomar solo una.
+        self.assertEqual(Reserva.objects.filter(estado='asignada').count(), min(activos, self.CLIENTES))
+        self.assertFalse(Asignacion.objects.values('usuario').annotate(n=Count('id')).filter(n__gt=1).exists())
+        self.assertLess(segundos, 15, f'{self.CLIENTES} reservas en {segundos:.1f} s')
+
+
+class VersionReservaTests(TestCase):
+
+    def setUp(self):
+        self.cliente = crear_usuario('cliente')
+        self.reserva = Reserva.objects.create(
+            fecha_reserva=date.today() + timedelta(days=3), direccion='Calle 1', estado='pendiente', usuario=self.cliente,
+        )
+        self.version = Reserva.objects.get().version
+
+    def editar(self, version):
+        iniciar_sesion(self.client, self.cliente)
+        return self.client.post(f'/editar_reserva/{self.reserva.id}/', {
+            'direccion': 'Calle 2',
+            'tipo_ubicacion': 'residencia',
+            'fecha': self.reserva.fecha_reserva.isoformat(),
+            'hora_reserva': '11:00',
+            'version': version,
+        })
+
+    def test_version_alterada_es_conflicto(self):
+        for version in ('', 'abc', '1.5'):
+            self.assertEqual(self.editar(version).status_code, 409)
+        self.assertEqual(Reserva.objects.get().version, self.version)
+
+    def test_version_vieja_es_conflicto(self):
+        self.assertEqual(self.editar(self.version).status_code, 302)
+        self.assertEqual(self.editar(self.version).status_code, 409)
+        reserva = Reserva.objects.get()
+        self.assertEqual((reserva.direccion, reserva.version), ('Calle 2', self.version + 1))
+
+    def test_asignar_con_version_alterada_es_conflicto(self):
+        personal = crear_usuario('personal')
+        iniciar_sesion(self.client, personal)
+        respuesta = self.client.post(f'/asignar_reserva/{self.reserva.id}/', {'version': 'x'})
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertFalse(Asignacion.objects.exists())
+
+    def test_asignar_manual_con_datos_alterados(self):
+        iniciar_sesion(self.client, crear_usuario('administrador'))
+        personal = crear_usuario('personal')
+        for datos in ({}, {'reserva_id': 'x', 'personal_id': personal.id}):
+            self.assertEqual(self.client.post('/asignar_manual/', datos).status_code, 302)
+        self.client.post('/asignar_manual/', {
+            'reserva_id': self.reserva.id, 'personal_id': personal.id, f'version_{self.reserva.id}': '',
+        })
+        self.assertFalse(Asignacion.objects.exists())
+
+
+@override_settings(METRICAS_CONSULTA_LENTA=60)
+class EdicionConcurrenteTests(TransactionTestCase):
+    # Varias ventanas del cliente editan y varias personas toman la misma
+    # reserva, todas con la versión leída antes: exactamente una gana.
+    VENTANAS = 6
+    PERSONAL = 6
+
+    def test_una_sola_escritura_gana(self):
+        cliente = crear_usuario('cliente')
+        reserva = Reserva.objects.create(
+            fecha_reserva=date.today() + timedelta(days=3), direccion='Calle 1', estado='pendiente', usuario=cliente,
+        )
+        version = Reserva.objects.get().version
+
+        peticiones = []
+        for i in range(self.VENTANAS):
+            navegador = Client()
+            iniciar_sesion(navegador, cliente)
+            peticiones.append((navegador, f'/editar_reserva/{reserva.id}/', {
+                'direccion': f'Ventana {i}',
+                'tipo_ubicacion': 'residencia',
+                'fecha': reserva.fecha_reserva.isoformat(),
+                'hora_reserva': '11:00',
+                'version': version,
+            }))
+        for i in range(self.PERSONAL):
+            navegador = Client()
+            iniciar_sesion(navegador, crear_usuario('personal', f'personal{i}'))
+            peticiones.append((navegador, f'/asignar_reserva/{reserva.id}/', {'version': version}))
+
+        resultados, _ = en_paralelo(lambda p: p[0].post(p[1], p[2]).status_code, peticiones)
+
+        self.assertEqual(sorted(resultados), [302] + [409] * (len(peticiones) - 1))
+        ganadora = resultados.index(302)
+        reserva = Reserva.objects.get()
+        self.assertEqual(reserva.version, version + 1)
+        if ganadora < self.VENTANAS:
+            self.assertEqual((reserva.direccion, reserva.estado), (f'Ventana {ganadora}', 'pendiente'))
+            self.assertFalse(Asignacion.objects.exists())
+        else:
+            self.assertEqual((reserva.direccion, reserva.estado), ('Calle 1', 'asignada'))
+            self.assertEqual(Asignacion.objects.get().usuario.nombre, f'personal{ganadora - self.VENTANAS}')
+
+
+async def esperar(condicion, segundos=5):
+    async def sondear():
+        while not condicion():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(sondear(), segundos)
+
+
+@mock.patch.object(eventos, 'INTERVALO_SONDEO', 0.01)
+class EventosTests(TestCase):
+    SUSCRIPTORES = 1000
+
+    def setUp(self):
+        self.difusor = eventos.Difusor()
+        parche = mock.patch.object(eventos, 'difusor', self.difusor)
+        parche.start()
+        self.addCleanup(parche.stop)
+        self.cliente = crear_usuario('cliente')
+        self.otro = crear_usuario('cliente', 'otro')
+        self.reserva = Reserva.objects.create(
+            fecha_reserva=date.today(), direccion='Calle 1', estado='pendiente', usuario=self.cliente,
+        )
+
+    async def terminar(self, flujos):
+        await asyncio.gather(*(flujo.aclose() for flujo in flujos))
+        # Sin suscriptores la tarea de sondeo termina sola.
+        await asyncio.wait_for(self.difusor._tarea, 5)
+
+    async def test_difusion_a_mil_suscriptores(self):
+        mitad = self.SUSCRIPTORES // 2
+        flujos = [eventos.flujo_eventos(self.cliente) for _ in range(mitad)]
+        ajenos = [eventos.flujo_eventos(self.otro) for _ in range(self.SUSCRIPTORES - mitad)]
+        primeros = await asyncio.gather(*(anext(flujo) for flujo in flujos + ajenos))
+        self.assertTrue(all(p.startswith('retry:') for p in primeros))
+        self.assertEqual(len(self.difusor.suscriptores), self.SUSCRIPTORES)
+
+        await sync_to_async(eventos.publicar)('modificada', [self.reserva.id])
+        mensajes = await asyncio.wait_for(asyncio.gather(*(anext(flujo) for flujo in flujos)), 10)
+
+        self.assertEqual(len(set(mensajes)), 1)
+        self.assertIn(f'"reserva": {self.reserva.id}', mensajes[0])
+        # El evento no es para los demás clientes.
+        self.assertTrue(all(
+            s.cola.empty() for s in self.difusor.suscriptores if s.usuario_id == self.otro.id
+        ))
+        await self.terminar(flujos + ajenos)
+        self.assertFalse(self.difusor.suscriptores)
+
+    async def test_cola_desbordada_pide_recargar(self):
+        flujo = eventos.flujo_eventos(self.cliente)
+        await anext(flujo)
+        suscriptor, = self.difusor.suscriptores
+        suscriptor.cola = asyncio.Queue(2)
+        for _ in range(3):
+            await sync_to_async(eventos.publicar)('modificada', [self.reserva.id])
+        await esperar(lambda: suscriptor.desbordada)
+        self.assertEqual(await anext(flujo), eventos.RECARGAR)
+        await self.terminar([flujo])
+
+    async def test_aplicacion_asgi(self):
+        enviados = []
+        desconectar = asyncio.Event()
+
+        async def recibir():
+            await desconectar.wait()
+            return {'type': 'http.disconnect'}
+
+        async def enviar(mensaje):
+            enviados.append(mensaje)
+
+        alcance = {'type': 'http', 'path': '/eventos_horario/', 'headers': [], 'query_string': b''}
+        await eventos.aplicacion_eventos(alcance, recibir, enviar)
+        self.assertEqual(enviados[0]['status'], 403)
+
+        enviados.clear()
+        await sync_to_async(iniciar_sesion)(self.client, self.cliente)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        alcance['headers'] = [(b'cookie', cookie.encode())]
+        tarea = asyncio.create_task(eventos.aplicacion_eventos(alcance, recibir, enviar))
+        await esperar(lambda: len(enviados) == 2)
+        await sync_to_async(eventos.publicar)('modificada', [self.reserva.id])
+        await esperar(lambda: len(enviados) == 3)
+        desconectar.set()
+        await asyncio.wait_for(tarea, 5)
+        await asyncio.wait_for(self.difusor._tarea, 5)
+
+        self.assertEqual(enviados[0]['status'], 200)
+        self.assertIn(b'text/event-stream', dict(enviados[0]['headers'])[b'content-type'])
+        self.assertIn(f'"reserva": {self.reserva.id}'.encode(), enviados[2]['body'])
+        self.assertFalse(self.difusor.suscriptores)
+
+
+class CalendarioTests(TestCase):
+    # Otra instancia del backend hace de otro worker: la invalidación que hace
+    # este proceso tiene que verse desde allá.
+
+    def setUp(self):
+        caches['compartida'].delete(CLAVE_CALENDARIO)
+        self.addCleanup(caches['compartida'].delete, CLAVE_CALENDARIO)
+        self.otro_worker = caches.create_connection('compartida')
+        self.personal = crear_usuario('personal')
+        self.lunes = date(2024, 1, 1)
+
+    def laborable(self):
+        with mock.patch('app.calendario.cache', self.otro_worker):
+            return Calendario.cargar().laborable(self.personal.id, self.lunes)
+
+    def test_otro_worker_ve_los_cambios_de_turnos(self):
+        self.assertEqual(self.laborable(), DIA_COMPLETO)
+        with self.captureOnCommitCallbacks(execute=True):
+            Turno.objects.create(usuario=self.personal, dia_semana=0, hora_inicio=hora(9), hora_fin=hora(17))
+        self.assertEqual(self.laborable(), mascara_turno(hora(9), hora(17)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Feriado.objects.create(fecha=self.lunes)
+        self.assertEqual(self.laborable(), 0)
+
+    def test_la_cache_expira(self):
+        with mock.patch('app.calendario.cache.set') as guardar:
+            Calendario.cargar()
+        self.assertIsNotNone(guardar.call_args.args[2])
+
+
+class VersionSemanaTests(TestCase):
+
+    def setUp(self):
+        self.lunes = lunes_de(date.today())
+        caches['compartida'].delete(_clave_version(self.lunes))
+        self.otro_worker = caches.create_connection('compartida')
+
+    async def clave(self):
+        return await aclave_horario(self.lunes, 'cliente', 1, '', '', '')
+
+    async def test_la_invalidacion_de_otro_worker_cambia_la_clave(self):
+        clave = await self.clave()
+        self.assertEqual(await self.clave(), clave)
+        with mock.patch('app.horario.cache', self.otro_worker):
+            await sync_to_async(invalidar_semana)(self.lunes + timedelta(days=3))
+        self.assertNotEqual(await self.clave(), clave)
+
+    async def test_una_version_perdida_no_revive_paginas_viejas(self):
+        clave = await self.clave()
+        await caches['compartida'].adelete(_clave_version(self.lunes))
+        self.assertNotEqual(await self.clave(), clave)
+
+    def test_la_pagina_se_actualiza_al_crear_una_reserva(self):
+        cliente = crear_usuario('cliente')
+        iniciar_sesion(self.client, cliente)
+        self.assertNotContains(self.client.get('/horario_reservas/'), 'Calle Nueva 123')
+        with self.captureOnCommitCallbacks(execute=True):
+            Reserva.objects.create(fecha_reserva=self.lunes, direccion='Calle Nueva 123', estado='pendiente', usuario=cliente)
+        self.assertContains(self.client.get('/horario_reservas/'), 'Calle Nueva 123')
+
+
+class ImportarReservasTests(TestCase):
+    ENCABEZADO = 'correo,fecha,hora,direccion,tipo_ubicacion,latitud,longitud\n'
+
+    def setUp(self):
+        iniciar_sesion(self.client, crear_usuario('administrador'))
+        self.cliente = crear_usuario('cliente', correo='Ana.Perez@Example.com')
+
+    def subir(self, contenido):
+        archivo = SimpleUploadedFile('reservas.csv', contenido, content_type='text/csv')
+        return self.client.post('/importar_reservas/', {'archivo': archivo}, follow=True)
+
+    def test_el_correo_no_distingue_mayusculas(self):
+        fila = f'ANA.perez@example.COM,{date.today() + timedelta(days=5)},10:00,Calle 1,residencia,,\n'
+        self.subir((self.ENCABEZADO + fila).encode())
+        self.assertEqual(Reserva.objects.get().usuario, self.cliente)
+
+    def test_archivo_que_no_es_utf8(self):
+        fila = f'ana.perez@example.com,{date.today() + timedelta(days=5)},10:00,Ñuñoa 123,residencia,,\n'
+        respuesta = self.subir((self.ENCABEZADO + fila).encode('latin-1'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, 'Debe ser un CSV guardado en UTF-8.')
+        self.assertFalse(Reserva.objects.exists())
+
+
+class RutaDelDiaTests(TestCase):
+    DIA = date(2024, 1, 1)
+
+    def setUp(self):
+        self.personal = crear_usuario('personal')
+        cliente = crear_usuario('cliente')
+        # Dos trabajos en el mismo lugar a las 8 y a las 9, y otro a 10 km a
+        # las 8.
+        self.reservas = []
+        for hora_reserva, latitud in ((hora(8), -33.45), (hora(9), -33.45), (hora(8), -33.36)):
+            reserva = Reserva.objects.create(
+                fecha_reserva=self.DIA, hora_reserva=hora_reserva, direccion='Calle 1', estado='asignada',
+                usuario=cliente, latitud=latitud, longitud=-70.65, tipo_ubicacion='oficina',
+            )
+            Asignacion.objects.create(fecha_asignacion=self.DIA, reserva=reserva, usuario=self.personal)
+            self.reservas.append(reserva)
+
+    def orden(self):
+        return [self.reservas.index(r) for r in ruta_del_dia(self.personal.id, self.DIA).paradas]
+
+    @override_settings(DURACION_POR_TIPO={'oficina': timedelta(minutes=30)})
+    def test_visitas_cortas_recorren_menos(self):
+        self.assertEqual(self.orden(), [2, 0, 1])
+
+    @override_settings(DURACION_POR_TIPO={'oficina': timedelta(hours=3)})
+    def test_visitas_largas_respetan_las_ventanas(self):
+        # Con tres horas por visita, empezar lejos deja fuera de ventana a
+        # los otros dos.
+        self.assertEqual(self.orden(), [0, 1, 2])
+
+
+class MapaGeojsonTests(TestCase):
+    URL = '/mapa_asignaciones/geojson/'
+    BBOX = '-71,-34,-70,-33'
+
+    def setUp(self):
+        iniciar_sesion(self.client, crear_usuario('administrador'))
+        personal = crear_usuario('personal')
+        cliente = crear_usuario('cliente')
+        for i in range(5):
+            reserva = Reserva.objects.create(
+                fecha_reserva=date.today() + timedelta(days=i), direccion='Calle 1', estado='asignada',
+                usuario=cliente, latitud=-33.45 + i * 0.01, longitud=-70.65 + i * 0.01,
+            )
+            Asignacion.objects.create(fecha_asignacion=date.today(), reserva=reserva, usuario=personal)
+
+    def pedir(self, **parametros):
+        return self.client.get(self.URL, {'bbox': self.BBOX, **parametros})
+
+    def test_zoom_fuera_de_rango(self):
+        with mock.patch.object(mapa, 'LIMITE_PUNTOS', 2):
+            for zoom in ('-2000', '2000'):
+                respuesta = self.pedir(zoom=zoom)
+                self.assertEqual(respuesta.status_code, 200)
+                self.assertTrue(respuesta.json()['features'])
+
+    def test_bbox_no_finito(self):
+        respuesta = self.client.get(self.URL, {'bbox': 'nan,-34,-70,-33'})
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_marca_los_puntos_truncados(self):
+        with mock.patch.object(mapa, 'LIMITE_PUNTOS', 3):
+            datos = self.pedir(zoom=mapa.ZOOM_DETALLE).json()
+        self.assertEqual(len(datos['features']), 3)
+        self.assertTrue(datos['truncado'])
+        datos = self.pedir(zoom=mapa.ZOOM_DETALLE).json()
+        self.assertEqual(len(datos['features']), 5)
+        self.assertFalse(datos['truncado'])
+
+
+@override_settings(METRICAS_TOKEN='secreto')
+class MetricasTests(TestCase):
+    URL = '/metrics/'
+
+    def test_sin_token_desde_localhost(self):
+        # Detrás de un proxy inverso todo llega desde 127.0.0.1.
+        respuesta = self.client.get(self.URL, REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(respuesta.status_code, 403)
+
+    def test_con_token(self):
+        respuesta = self.client.get(self.URL, headers={'Authorization': 'Bearer secreto'})
+        self.assertEqual(respuesta.status_code, 200)
+        respuesta = self.client.get(self.URL, headers={'Authorization': 'Bearer otro'})
+        self.assertEqual(respuesta.status_code, 403)
+
+    @override_settings(METRICAS_TOKEN='')
+    def test_token_vacio_no_autoriza(self):
+        respuesta = self.client.get(self.URL, headers={'Authorization': 'Bearer '})
+        self.assertEqual(respuesta.status_code, 403)
+
+    def test_administrador(self):
+        iniciar_sesion(self.client, crear_usuario('administrador'))
+        self.assertEqual(self.client.get(self.URL).status_code, 200)
+
+    def test_limpiar_mientras_otros_hilos_registran(self):
+        registro = metricas.Registro()
+        medicion = metricas.Medicion(None)
+        vueltas = 20000
+        listos = threading.Barrier(3)
+
+        def registrar():
+            listos.wait()
+            colector = registro.colector()
+            for _ in range(vueltas):
+                colector.registrar('vista', 0.001, medicion)
+
+        hilos = [threading.Thread(target=registrar) for _ in range(2)]
+        for hilo in hilos:
+            hilo.start()
+        listos.wait()
+        for _ in range(200):
+            registro.limpiar()
+            for fila in registro.totales().values():
+                # Cada fila se copia entera: el histograma suma lo mismo que
+                # el contador de peticiones.
+                self.assertEqual(sum(fila[metricas.HISTOGRAMA:]), fila[metricas.PETICIONES])
+        for hilo in hilos:
+            hilo.join()
+        registro.limpiar()
+        self.assertEqual(registro.totales(), {})
+
+    def test_exportar_mientras_otros_hilos_registran_no_pierde_peticiones(self):
+        registro = metricas.Registro()
+        medicion = metricas.Medicion(None)
+        vueltas = 20000
+        listos = threading.Barrier(3)
+
+        def registrar():
+            listos.wait()
+            colector = registro.colector()
+            for _ in range(vueltas):
+                colector.registrar('vista', 0.001, medicion)
+
+        hilos = [threading.Thread(target=registrar) for _ in range(2)]
+        for hilo in hilos:
+            hilo.start()
+        listos.wait()
+        for _ in range(200):
+            for fila in registro.totales().values():
+                self.assertEqual(sum(fila[metricas.HISTOGRAMA:]), fila[metricas.PETICIONES])
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(registro.totales()['vista'][metricas.PETICIONES], 2 * vueltas)
+
+
+class AnaliticaTests(TestCase):
+    DIA = date(2024, 1, 1)
+
+    def setUp(self):
+        limpiar_caches()
+        self.personal = crear_usuario('personal', 'tecnico')
+        self.cliente = crear_usuario('cliente')
+
+    def resumenes(self):
+        return sorted(ResumenDiario.objects.values_list(
+            'fecha', 'usuario_id', 'tipo_ubicacion', 'estado', 'reservas', 'minutos_trabajados',
+        ), key=repr)
+
+    def assertIgualAReconstruir(self):
+        incremental = self.resumenes()
+        analitica.reconstruir()
+        self.assertEqual(incremental, self.resumenes())
+        return incremental
+
+    def reserva(self, **campos):
+        return Reserva.objects.create(fecha_reserva=self.DIA, direccion='Calle 1', usuario=self.cliente, **campos)
+
+    def test_los_deltas_coinciden_con_reconstruir(self):
+        reserva = self.reserva(estado='pendiente')
+        otra = self.reserva(estado='pendiente', tipo_ubicacion='oficina')
+        asignacion = Asignacion.objects.create(fecha_asignacion=self.DIA, reserva=reserva, usuario=self.personal)
+        reserva.estado = 'asignada'
+        reserva.save()
+        inicio = datetime(2024, 1, 1, 9, tzinfo=tz.utc)
+        tarea = HistorialTarea.objects.create(hora_inicio=inicio, ubicacion='Calle 1', asignacion=asignacion)
+        tarea.hora_fin = inicio + timedelta(minutes=47, seconds=30)
+        tarea.save()
+        HistorialTarea.objects.create(
+            hora_inicio=inicio, hora_fin=inicio + timedelta(minutes=10, seconds=59), ubicacion='b', asignacion=asignacion,
+        )
+        self.assertIn((self.DIA, self.personal.id, 'residencia', 'asignada', 1, 57), self.assertIgualAReconstruir())
+
+        otra.fecha_reserva = self.DIA + timedelta(days=1)
+        otra.save()
+        tarea.delete()
+        self.assertIgualAReconstruir()
+
+        # En cascada: tareas, asignación y reserva.
+        reserva.delete()
+        self.assertIgualAReconstruir()
+        otra.delete()
+        self.assertEqual(self.resumenes(), [])
+
+    def test_escrituras_en_lote(self):
+        reservas = [self.reserva(estado='pendiente', hora_reserva=hora(9 + 3 * i)) for i in range(3)]
+        with analitica.cambios_de_reservas(r.id for r in reservas):
+            Asignacion.objects.bulk_create([
+                Asignacion(fecha_asignacion=self.DIA, reserva=r, usuario=self.personal) for r in reservas[:2]
+            ])
+            Reserva.objects.filter(id__in=[r.id for r in reservas[:2]]).update(estado='asignada')
+            # Las señales de las reservas medidas no se suman dos veces.
+            Asignacion.objects.filter(reserva=reservas[1]).delete()
+        self.assertIgualAReconstruir()
+
+    def test_una_transaccion_deshecha_no_cambia_los_resumenes(self):
+        reserva = self.reserva(estado='pendiente')
+        antes = self.resumenes()
+        try:
+            with transaction.atomic():
+                Asignacion.objects.create(fecha_asignacion=self.DIA, reserva=reserva, usuario=self.personal)
+                reserva.estado = 'asignada'
+                reserva.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.resumenes(), antes)
+
+    def test_ocupacion_usa_minutos_trabajados(self):
+        # Dos tareas de 90 minutos en un día: 3 h de una jornada de 8 h.
+        crear_historial(2, personal=self.personal, cliente=self.cliente)
+        analitica.reconstruir()
+        ocupacion = analitica.panel(self.DIA, self.DIA)['ocupacion']
+        self.assertEqual(ocupacion, [{
+            'nombre': 'tecnico', 'reservas': 1, 'horas_trabajadas': 3.0,
+            'porcentaje': round(100 * 3 / 8),
+        }])
+
+    def test_ocupacion_segun_turnos_y_feriados(self):
+        # Lunes 2024-01-01 de 9 a 13 y martes libre por feriado.
+        for dia in (0, 1):
+            Turno.objects.create(usuario=self.personal, dia_semana=dia, hora_inicio=hora(9), hora_fin=hora(13))
+        Feriado.objects.create(fecha=self.DIA + timedelta(days=1), usuario=self.personal)
+        crear_historial(2, personal=self.personal, cliente=self.cliente)
+        analitica.reconstruir()
+        fila, = analitica.panel(self.DIA, self.DIA + timedelta(days=1))['ocupacion']
+        self.assertEqual(fila['porcentaje'], round(100 * 3 / 4))
+
+
+class EnviarPendientesTests(TestCase):
+    def setUp(self):
+        notificaciones.encolar_correo('Aviso', 'Hola', [f'c{i}@example.com' for i in range(3)])
+
+    def test_ejecuciones_superpuestas_no_duplican(self):
+        # La segunda ejecución empieza mientras la primera está enviando.
+        enviar = CorreoEnMemoria.send_messages
+        segunda = []
+
+        def enviar_y_superponer(backend, mensajes):
+            if not segunda:
+                segunda.append(notificaciones.enviar_pendientes())
+            return enviar(backend, mensajes)
+
+        with mock.patch.object(CorreoEnMemoria, 'send_messages', enviar_y_superponer):
+            self.assertEqual(notificaciones.enviar_pendientes(), (3, 0))
+        self.assertEqual(segunda, [(0, 0)])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(Notificacion.objects.filter(estado='enviada').count(), 3)
+
+    def test_plazo_vencido_se_vuelve_a_reclamar(self):
+        # Un lote reclamado por un proceso que murió vuelve a enviarse.
+        ahora = timezone.now()
+        notificaciones._reclamar(100, ahora)
+        self.assertEqual(notificaciones.enviar_pendientes(), (0, 0))
+        despues = ahora + notificaciones.PLAZO_ENVIO + timedelta(seconds=1)
+        with mock.patch.object(timezone, 'now', return_value=despues):
+            self.assertEqual(notificaciones.enviar_pendientes(), (3, 0))
+
+
+class PaginacionTests(TestCase):
+    ORDEN = ['-fecha_reserva', '-id']
+
+    def setUp(self):
+        cliente = crear_usuario('cliente')
+        for i in range(3):
+            Reserva.objects.create(
+                fecha_reserva=date(2024, 1, 1) + timedelta(days=i), direccion='Calle 1', usuario=cliente,
+            )
+
+    def test_cursor_valido(self):
+        primera = paginar_por_cursor(Reserva.objects.all(), self.ORDEN, tamano=2)
+        segunda = paginar_por_cursor(Reserva.objects.all(), self.ORDEN, primera.siguiente, tamano=2)
+        self.assertFalse(segunda.es_primera)
+        self.assertEqual([r.fecha_reserva for r in segunda], [date(2024, 1, 1)])
+
+    def test_cursor_con_forma_o_tipos_invalidos(self):
+        invalidos = [
+            _codificar({'fecha': '2024-01-02'}),
+            _codificar(['2024-01-02']),
+            _codificar(['no-es-fecha', 1]),
+            _codificar(['2024-01-02', 'uno']),
+            _codificar(['2024-01-02', [1]]),
+            _codificar([None, 1]),
+            _codificar(['2024-01-02', True]),
+            '__4=',
+        ]
+        for cursor in invalidos:
+            with self.subTest(cursor=cursor):
+                pagina = paginar_por_cursor(Reserva.objects.all(), self.ORDEN, cursor, tamano=2)
+                self.assertTrue(pagina.es_primera)
+                self.assertEqual([r.fecha_reserva for r in pagina], [date(2024, 1, 3), date(2024, 1, 2)])
+
+    def test_vista_con_cursor_invalido(self):
+        iniciar_sesion(self.client, crear_usuario('personal', 'otro_personal'))
+        respuesta = self.client.get('/asignaciones_pendientes/', {'cursor': _codificar(['x', 'y', 'z'])})
+        self.assertEqual(respuesta.status_code, 200)
+
+
+@override_settings(METRICAS_CONSULTA_LENTA=60)
+class TareasConcurrentesTests(TransactionTestCase):
+    CLICS = 8
+
+    def setUp(self):
+        personal = crear_usuario('personal', 'tecnico')
+        reserva = Reserva.objects.create(
+            fecha_reserva=date.today(), direccion='Calle 1', estado='asignada', usuario=crear_usuario('cliente'),
+        )
+        self.asignacion = Asignacion.objects.create(fecha_asignacion=date.today(), reserva=reserva, usuario=personal)
+        self.navegadores = []
+        for _ in range(self.CLICS):
+            navegador = Client()
+            iniciar_sesion(navegador, personal)
+            self.navegadores.append(navegador)
+
+    def clics(self, accion):
+        resultados, _ = en_paralelo(
+            lambda navegador: navegador.get(f'/{accion}/{self.asignacion.id}/').status_code, self.navegadores,
+        )
+        self.assertEqual(resultados, [302] * self.CLICS)
+
+    def test_iniciar_varias_veces_a_la_vez(self):
+        self.clics('iniciar_tarea')
+        self.assertEqual(HistorialTarea.objects.filter(asignacion=self.asignacion).count(), 1)
+
+    def test_finalizar_varias_veces_a_la_vez(self):
+        self.clics('finalizar_tarea')
+        tarea = HistorialTarea.objects.get(asignacion=self.asignacion)
+        self.assertEqual(tarea.hora_inicio, tarea.hora_fin)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LimiteLoginTests(TestCase):
+
+    def setUp(self):
+        views.limite_login_ip.limpiar()
+        views.limite_login_correo.limpiar()
+        self.addCleanup(views.limite_login_ip.limpiar)
+        self.addCleanup(views.limite_login_correo.limpiar)
+        crear_usuario('cliente', 'ana', contraseña=make_password('clave'))
+
+    def entrar(self, contraseña, correo='ana@example.com', **extra):
+        return self.client.post('/login/', {'correo': correo, 'contraseña': contraseña}, **extra).status_code
+
+    def test_solo_los_fallos_cuentan_para_el_correo(self):
+        capacidad = settings.LOGIN_LIMITE_CORREO[0]
+        for _ in range(capacidad + 2):
+            self.assertEqual(self.entrar('clave'), 302)
+        for _ in range(capacidad):
+            self.entrar('otra')
+        self.assertEqual(self.entrar('clave'), 429)
+
+    @override_settings(PROXIES_CONFIABLES=['127.0.0.1'], IP_CLIENTE_CABECERA='HTTP_X_FORWARDED_FOR')
+    def test_detras_del_proxy_cada_cliente_tiene_su_cubo(self):
+        capacidad = settings.LOGIN_LIMITE_IP[0]
+        for i in range(capacidad):
+            self.entrar('clave', correo=f'c{i}@example.com', REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='10.0.0.1')
+        self.assertEqual(self.entrar('clave', REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='10.0.0.1'), 429)
+        self.assertEqual(self.entrar('clave', REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='10.0.0.2'), 302)
+
+    @override_settings(PROXIES_CONFIABLES=['127.0.0.1'], IP_CLIENTE_CABECERA='HTTP_X_FORWARDED_FOR')
+    def test_ip_cliente(self):
+        def ip(remote, reenviada=None):
+            request = mock.Mock(META={'REMOTE_ADDR': remote})
+            if reenviada is not None:
+                request.META['HTTP_X_FORWARDED_FOR'] = reenviada
+            return ip_cliente(request)
+
+        self.assertEqual(ip('127.0.0.1', '10.0.0.1'), '10.0.0.1')
+        # El cliente puede inventar las primeras direcciones, no la última.
+        self.assertEqual(ip('127.0.0.1', '1.2.3.4, 10.0.0.1'), '10.0.0.1')
+        self.assertEqual(ip('127.0.0.1'), '127.0.0.1')
+        # Sin pasar por el proxy la cabecera no se cree.
+        self.assertEqual(ip('10.0.0.9', '1.2.3.4'), '10.0.0.9')
+
+
+class EventosMantenimientoTests(TestCase):
+
+    def setUp(self):
+        self.difusor = eventos.Difusor()
+        parche = mock.patch.object(eventos, 'difusor', self.difusor)
+        parche.start()
+        self.addCleanup(parche.stop)
+        self.cliente = crear_usuario('cliente')
+
+    def crear_reserva(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Reserva.objects.create(
+                fecha_reserva=date.today(), direccion='Calle 1', estado='pendiente', usuario=self.cliente,
+            )
+
+    def test_publicar_purga_los_vencidos(self):
+        viejo = EventoHorario.objects.create(tipo='creada', reserva_id=0)
+        EventoHorario.objects.filter(id=viejo.id).update(creado=timezone.now() - eventos.RETENCION - timedelta(hours=1))
+        with mock.patch.object(eventos, '_proxima_purga', 0):
+            self.crear_reserva()
+        self.assertFalse(EventoHorario.objects.filter(id=viejo.id).exists())
+        self.assertTrue(EventoHorario.objects.exists())
+
+    @override_settings(EVENTOS_EN_VIVO=False)
+    def test_sin_flujo_no_se_escriben_eventos(self):
+        self.crear_reserva()
+        self.assertFalse(EventoHorario.objects.exists())
+
+    async def test_el_sondeo_sobrevive_a_un_error_de_la_base(self):
+        flujo = eventos.flujo_eventos(self.cliente)
+        await anext(flujo)
+        reserva = await sync_to_async(Reserva.objects.create)(
+            fecha_reserva=date.today(), direccion='Calle 2', estado='pendiente', usuario=self.cliente,
+        )
+        original = EventoHorario.objects.filter
+        fallos = []
+
+        def filtrar(*args, **kwargs):
+            if not fallos:
+                fallos.append(1)
+                raise OperationalError('database is locked')
+            return original(*args, **kwargs)
+
+        with mock.patch.object(EventoHorario.objects, 'filter', filtrar), self.assertLogs('app.eventos', 'ERROR'):
+            await esperar(lambda: fallos)
+        await sync_to_async(eventos.publicar)('modificada', [reserva.id])
+        mensaje = await asyncio.wait_for(anext(flujo), 10)
+        self.assertIn(f'"reserva": {reserva.id}', mensaje)
+        self.assertFalse(self.difusor._tarea.done())
+        await flujo.aclose()
+        await asyncio.wait_for(self.difusor._tarea, 5)
+
+
+class HorarioPlantillaTests(TestCase):
+
+    def setUp(self):
+        limpiar_caches()
+
+    def test_filtros_escapados_en_el_script(self):
+        iniciar_sesion(self.client, crear_usuario('administrador'))
+        respuesta = self.client.get('/horario_reservas/', {'estado': 'x";alert(1)//\\', 'personal': '1\\'})
+        contenido = respuesta.content.decode()
+        self.assertIn('const filtroEstado = "x\\u0022\\u003Balert(1)//\\u005C";', contenido)
+        # Un personal que no es un id se ignora.
+        self.assertIn('const filtroPersonal = "";', contenido)
+
+
+class PersonalDisponibleTests(TestCase):
+    DIA = date(2024, 1, 1)
+
+    def setUp(self):
+        limpiar_caches()
+        self.cliente = crear_usuario('cliente')
+        self.personal = [crear_usuario('personal', f'personal{i}') for i in range(3)]
+        self.asignar(self.personal[1], hora(10))
+        self.asignar(self.personal[2], hora(10), estado='completada')
+
+    def asignar(self, personal, hora_reserva, estado='asignada', fecha=None):
+        reserva = Reserva.objects.create(
+            fecha_reserva=fecha or self.DIA, hora_reserva=hora_reserva, direccion='Calle 1', estado=estado,
+            usuario=self.cliente,
+        )
+        Asignacion.objects.create(fecha_asignacion=self.DIA, reserva=reserva, usuario=personal)
+
+    def libres(self, fecha, hora_reserva):
+        ids = {p.id for p in self.personal}
+        return [p.id for p in views.personal_disponible(fecha, hora_reserva) if p.id in ids]
+
+    def test_un_trabajo_con_su_margen_ocupa_al_personal(self):
+        # 2 horas de trabajo y 2 de traslado: ocupado de 10 a 14. Las
+        # completadas no ocupan.
+        a, b, c = (p.id for p in self.personal)
+        self.assertEqual(self.libres(self.DIA, '11:00'), [a, c])
+        self.assertEqual(self.libres(self.DIA, '09:00'), [a, c])
+        self.assertEqual(self.libres(self.DIA, '08:00'), [a, b, c])
+        self.assertEqual(self.libres(self.DIA, '14:00'), [a, b, c])
+        self.assertEqual(self.libres(self.DIA + timedelta(days=1), '10:00'), [a, b, c])
+
+    def test_las_consultas_no_dependen_del_personal_ni_del_historial(self):
+        views.personal_disponible(self.DIA, '11:00')
+        with CaptureQueriesContext(connection) as pocos:
+            views.personal_disponible(self.DIA, '11:00')
+        for i in range(20):
+            personal = crear_usuario('personal', f'extra{i}')
+            for dias in range(1, 6):
+                self.asignar(personal, hora(10), estado='completada', fecha=self.DIA - timedelta(days=dias))
+            self.asignar(personal, hora(16))
+        with CaptureQueriesContext(connection) as muchos:
+            views.personal_disponible(self.DIA, '11:00')
+        self.assertEqual(len(muchos), len(pocos))
+
+
+
+class PersonalCercanoTests(TestCase):
+
+    def setUp(self):
+        limpiar_caches()
+        self.fecha = date.today() + timedelta(days=7)
+        self.cliente = crear_usuario('cliente')
+        # Los dos tienen un trabajo a las 8 y quedan libres a las 14; el
+        # personal de la base, sin trabajos ese día, va antes en la tabla.
+        self.lejos = crear_usuario('personal', 'lejos')
+        self.cerca = crear_usuario('personal', 'cerca')
+        for personal, latitud in ((self.lejos, -33.0), (self.cerca, -33.45)):
+            reserva = Reserva.objects.create(
+                fecha_reserva=self.fecha, hora_reserva=hora(8), direccion='Calle 1', estado='asignada',
+                usuario=self.cliente, latitud=latitud, longitud=-70.65,
+            )
+            Asignacion.objects.create(fecha_asignacion=date.today(), reserva=reserva, usuario=personal)
+        iniciar_sesion(self.client, self.cliente)
+
+    def reservar(self, **ubicacion):
+        self.client.post('/crear_reserva/', {
+            'direccion': 'Calle 2', 'tipo_ubicacion': 'residencia',
+            'fecha': self.fecha.isoformat(), 'hora_reserva': '14:00', **ubicacion,
+        })
+        return Asignacion.objects.get(reserva__direccion='Calle 2').usuario
+
+    def test_toma_al_personal_con_el_trabajo_mas_cercano(self):
+        self.assertEqual(self.reservar(latitud='-33.46', longitud='-70.64'), self.cerca)
+
+    def test_sin_coordenadas_sigue_el_orden_de_la_tabla(self):
+        self.assertNotIn(self.reservar(), (self.lejos, self.cerca))
+
+
+class ReplanificarDiaTests(TestCase):
+    DIA = date(2024, 1, 1)
+
+    def setUp(self):
+        limpiar_caches()
+        Usuario.objects.filter(rol='personal').update(estado='inactivo')
+        self.cliente = crear_usuario('cliente')
+
+    def reserva(self, tipo_ubicacion, personal=None, hora_reserva=hora(10), latitud=None):
+        reserva = Reserva.objects.create(
+            fecha_reserva=self.DIA, hora_reserva=hora_reserva, direccion='Calle 1', usuario=self.cliente,
+            tipo_ubicacion=tipo_ubicacion, estado='asignada' if personal else 'pendiente',
+            latitud=latitud, longitud=None if latitud is None else -70.65,
+        )
+        if personal:
+            Asignacion.objects.create(fecha_asignacion=self.DIA, reserva=reserva, usuario=personal)
+        return reserva
+
+    def test_la_oficina_desplaza_a_la_residencia(self):
+        personal = crear_usuario('personal')
+        residencia = self.reserva('residencia', personal)
+        oficina = self.reserva('oficina')
+
+        resultado = replanificar_dia(self.DIA)
+
+        self.assertEqual((resultado.nuevas, resultado.liberadas, resultado.sin_personal), (1, 1, 1))
+        self.assertEqual(Asignacion.objects.get().reserva, oficina)
+        residencia.refresh_from_db()
+        self.assertEqual(residencia.estado, 'pendiente')
+
+    def test_un_plan_que_ya_sirve_no_se_toca(self):
+        uno, dos = crear_usuario('personal', 'uno'), crear_usuario('personal', 'dos')
+        reservas = [self.reserva('residencia', uno), self.reserva('oficina', dos)]
+        asignaciones = list(Asignacion.objects.order_by('id').values_list('id', 'usuario_id'))
+
+        resultado = replanificar_dia(self.DIA)
+
+        self.assertEqual((resultado.mantenidas, resultado.reasignadas, resultado.nuevas), (2, 0, 0))
+        self.assertEqual(list(Asignacion.objects.order_by('id').values_list('id', 'usuario_id')), asignaciones)
+        for reserva in reservas:
+            self.assertEqual(Reserva.objects.get(id=reserva.id).version, reserva.version)
+
+    def test_junta_los_trabajos_cercanos(self):
+        # Cada uno tiene un trabajo a las 8; el de las 14 va con quien
+        # trabaja al lado.
+        norte, sur = crear_usuario('personal', 'norte'), crear_usuario('personal', 'sur')
+        self.reserva('residencia', norte, hora(8), latitud=-33.0)
+        self.reserva('residencia', sur, hora(8), latitud=-33.45)
+        tarde = self.reserva('residencia', hora_reserva=hora(14), latitud=-33.46)
+
+        replanificar_dia(self.DIA)
+
+        self.assertEqual(Asignacion.objects.get(reserva=tarde).usuario, sur)
+
+
+class UsuarioSesionTests(TestCase):
+
+    def setUp(self):
+        self.cliente = crear_usuario('cliente', 'Ana')
+        iniciar_sesion(self.client, self.cliente)
+
+    def consultas_de_usuario(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        return respuesta, [c for c in consultas if '"app_usuario"' in c['sql']]
+
+    def test_el_usuario_se_lee_una_vez(self):
+        _, primeras = self.consultas_de_usuario('/perfil/')
+        respuesta, segundas = self.consultas_de_usuario('/perfil/')
+        self.assertEqual(len(primeras), 1)
+        self.assertEqual(segundas, [])
+        self.assertContains(respuesta, 'Ana')
+
+    def test_guardar_el_usuario_invalida_la_cache(self):
+        self.client.get('/perfil/')
+        self.cliente.nombre = 'Beatriz'
+        self.cliente.save()
+        self.assertContains(self.client.get('/perfil/'), 'Beatriz')
+
+    def test_rol_equivocado_o_sin_sesion_redirige(self):
+        self.assertRedirects(self.client.get('/asignaciones_pendientes/'), '/dashboard', fetch_redirect_response=False)
+        self.client.logout()
+        self.assertRedirects(self.client.get('/dashboard/'), '/login/', fetch_redirect_response=False)
+
+
+class HorariosDisponiblesTests(TestCase):
+    URL = '/horarios_disponibles/'
+
+    def setUp(self):
+        limpiar_caches()
+        Usuario.objects.filter(rol='personal').update(estado='inactivo')
+        self.fecha = date.today() + timedelta(days=7)
+        cliente = crear_usuario('cliente')
+        # Único personal activo, ocupado de 8 a 12 (trabajo y traslado).
+        reserva = Reserva.objects.create(
+            fecha_reserva=self.fecha, hora_reserva=hora(8), direccion='Calle 1', estado='asignada', usuario=cliente,
+        )
+        Asignacion.objects.create(fecha_asignacion=date.today(), reserva=reserva, usuario=crear_usuario('personal'))
+        iniciar_sesion(self.client, cliente)
+
+    def horarios(self, fecha, cantidad=3):
+        respuesta = self.client.get(self.URL, {'fecha': fecha.isoformat(), 'cantidad': cantidad})
+        self.assertEqual(respuesta.status_code, 200)
+        return [(h['fecha'], h['hora']) for h in respuesta.json()['horarios']]
+
+    def test_primeros_horarios_libres(self):
+        dia = self.fecha.isoformat()
+        self.assertEqual(self.horarios(self.fecha), [(dia, '12:00'), (dia, '12:30'), (dia, '13:00')])
+
+    def test_un_feriado_pasa_al_dia_siguiente(self):
+        Feriado.objects.create(fecha=self.fecha)
+        siguiente = (self.fecha + timedelta(days=1)).isoformat()
+        self.assertEqual(self.horarios(self.fecha, 1), [(siguiente, '08:00')])
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.client.get(self.URL, {'fecha': 'mañana'}).status_code, 400)
+
+
+class SeedScaleTests(TestCase):
+    ARGUMENTOS = {'clientes': 40, 'personal': 6, 'reservas': 300, 'dias': 20, 'desde': date(2024, 1, 1), 'hoy': date(2024, 1, 15), 'semilla': 7, 'lote': 50}
+
+    def generar(self):
+        call_command('seed_scale', stdout=io.StringIO(), **self.ARGUMENTOS)
+        return list(
+            Reserva.objects.filter(usuario__correo__endswith='@semilla.local').order_by('id')
+            .values_list('fecha_reserva', 'hora_reserva', 'tipo_ubicacion', 'estado', 'latitud', 'longitud')
+        )
+
+    def test_genera_lo_pedido_sin_choques(self):
+        reservas = self.generar()
+        creados = Usuario.objects.filter(correo__endswith='@semilla.local')
+        self.assertEqual(len(reservas), 300)
+        self.assertEqual(creados.filter(rol='cliente').count(), 40)
+        self.assertEqual(creados.filter(rol='personal').count(), 6)
+        # Un solo hash para todos, y sirve.
+        self.assertEqual(creados.values('contraseña').distinct().count(), 1)
+        self.assertTrue(check_password('semilla', creados.first().contraseña))
+
+        trabajos = defaultdict(list)
+        for usuario_id, fecha, hora_reserva, tipo_ubicacion in Asignacion.objects.filter(usuario__in=creados).values_list(
+            'usuario_id', 'reserva__fecha_reserva', 'reserva__hora_reserva', 'reserva__tipo_ubicacion'
+        ):
+            trabajos[usuario_id].append((datetime.combine(fecha, hora_reserva), tipo_ubicacion))
+        self.assertTrue(trabajos)
+        for dia in trabajos.values():
+            for i, (inicio, tipo) in enumerate(dia):
+                for otro_inicio, otro_tipo in dia[i + 1:]:
+                    self.assertFalse(choca(inicio, tipo, otro_inicio, otro_tipo) or choca(otro_inicio, otro_tipo, inicio, tipo))
+
+    def test_misma_semilla_mismas_filas(self):
+        primera = self.generar()
+        Usuario.objects.filter(correo__endswith='@semilla.local').delete()
+        self.assertEqual(self.generar(), primera)
+
+    def test_no_repite_un_dominio(self):
+        self.generar()
+        with self.assertRaises(CommandError):
+            call_command('seed_scale', stdout=io.StringIO(), **self.ARGUMENTOS)
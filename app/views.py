@@ -1,12 +1,36 @@
 from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib import messages
 from django.contrib.auth.hashers import make_password, check_password
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.urls import reverse
-from .models import Usuario, Reserva, Asignacion, HistorialTarea
+from .models import Usuario, Reserva, Asignacion, HistorialTarea, Turno, Feriado
+from .notificaciones import encolar_correo
+from .exportacion import afilas_historial, agenerar_csv, agenerar_ndjson, filas_historial, generar_csv, generar_ndjson
+from .mapa import coleccion, filtrar_bbox, parsear_bbox
+from .rutas import ruta_del_dia
+from .replanificacion import replanificar_dia
+from .importacion import importar_reservas
+from .concurrencia import actualizar_reserva
+from .basedatos import atomico_con_reintentos
+from .duraciones import aestadisticas
+from .analitica import cambios_de_reservas, panel
+from .eventos import programar_eventos, ultimo_evento
+from .metricas import exportar as exportar_metricas
+from .sesion import requiere_rol
+from .limites import LimitadorTokens, ip_cliente
+from .paginacion import apaginar_por_cursor, paginar_por_cursor, tamano_pagina
+from .horario import CACHE_TIMEOUT, aclave_horario, construir_grilla, invalidar_semana, lunes_de
+from .disponibilidad import IndiceDisponibilidad, asignar_en_lote, choca, duracion_reserva, reclamar_personal, sugerir_horarios, ventana_reserva
 from datetime import date, timedelta, datetime
 from django.utils import timezone
-from django.core.mail import send_mail
+from django.conf import settings
+from django.db import transaction
+from django.core.cache import cache
+import csv
+import hmac
+import io
+import time
 
 def registro_cliente(request):
     if request.method == 'POST':
@@ -31,16 +55,9 @@ def registro_cliente(request):
 
     return render(request, 'registro.html')
 
+@requiere_rol('cliente')
 def perfil_cliente(request):
-    usuario_id = request.session.get('usuario_id')
-    rol = request.session.get('usuario_rol')
-
-    if not usuario_id or rol != 'cliente':
-        return redirect('../dashboard')
-
-    usuario = get_object_or_404(Usuario, id=usuario_id)
-
-    return render(request, 'perfil_cliente.html', {'usuario': usuario})
+    return render(request, 'perfil_cliente.html', {'usuario': request.usuario})
 
 def editar_perfil(request, usuario_id):
     usuario = get_object_or_404(Usuario, id=usuario_id)
@@ -61,15 +78,10 @@ def editar_perfil(request, usuario_id):
         'origen': origen
     })
 
+@requiere_rol('cliente')
 def desactivar_cuenta(request):
-    usuario_id = request.session.get('usuario_id')
-    rol = request.session.get('usuario_rol')
-
-    if not usuario_id or rol != 'cliente':
-        return redirect('../dashboard')
-
     if request.method == 'POST':
-        usuario = get_object_or_404(Usuario, id=usuario_id)
+        usuario = request.usuario
         usuario.estado = 'inactivo'
         usuario.save()
         request.session.flush()
@@ -78,10 +90,8 @@ def desactivar_cuenta(request):
 
     return render(request, 'desactivar_cuenta.html')
 
+@requiere_rol('administrador', redireccion='/dashboard/')
 def inhabilitar_usuario(request, usuario_id):
-    if request.session.get('usuario_rol') != 'administrador':
-        return redirect('/dashboard/')
-
     usuario = get_object_or_404(Usuario, id=usuario_id)
 
     if request.method == 'POST':
@@ -95,10 +105,8 @@ def inhabilitar_usuario(request, usuario_id):
         'accion': 'inhabilitar'
     })
 
+@requiere_rol('administrador', redireccion='/dashboard/')
 def habilitar_usuario(request, usuario_id):
-    if request.session.get('usuario_rol') != 'administrador':
-        return redirect('/dashboard/')
-
     usuario = get_object_or_404(Usuario, id=usuario_id)
 
     if request.method == 'POST':
@@ -112,14 +120,28 @@ def habilitar_usuario(request, usuario_id):
         'accion': 'habilitar'
     })
 
+limite_login_ip = LimitadorTokens(*settings.LOGIN_LIMITE_IP)
+limite_login_correo = LimitadorTokens(*settings.LOGIN_LIMITE_CORREO)
+
 def login(request):
     if request.method == 'POST':
         correo = request.POST['correo']
         contraseña = request.POST['contraseña']
 
+        clave_correo = correo.strip().lower()
+        if not limite_login_ip.permitir(ip_cliente(request)) or not limite_login_correo.disponible(clave_correo):
+            messages.error(request, 'Demasiados intentos. Espera unos minutos antes de volver a intentarlo.')
+            return render(request, 'login.html', status=429)
+
         try:
             usuario = Usuario.objects.get(correo=correo)
-            if not check_password(contraseña, usuario.contraseña):
+
+            def actualizar_hash(contraseña):
+                usuario.contraseña = make_password(contraseña)
+                usuario.save(update_fields=['contraseña'])
+
+            if not check_password(contraseña, usuario.contraseña, setter=actualizar_hash):
+                limite_login_correo.permitir(clave_correo)
                 messages.error(request, 'Contraseña incorrecta.')
                 return redirect('../login')
 
@@ -134,6 +156,7 @@ def login(request):
             return redirect('/dashboard/') 
 
         except Usuario.DoesNotExist:
+            limite_login_correo.permitir(clave_correo)
             messages.error(request, 'Usuario no encontrado.')
 
     return render(request, 'login.html')
@@ -142,42 +165,126 @@ def logout(request):
     request.session.flush()
     return redirect('../login')
 
+@requiere_rol(redireccion='/login/')
 def dashboard(request):
-    usuario_id = request.session.get('usuario_id')
-    rol = request.session.get('usuario_rol')
-    nombre = request.session.get('usuario_nombre')
-
-    if not usuario_id or not rol:
-        return HttpResponseRedirect('/login/')
-
     contexto = {
-        'rol': rol,
-        'nombre': nombre,
+        'rol': request.usuario.rol,
+        'nombre': request.usuario.nombre,
     }
+    if request.usuario.rol == 'administrador':
+        hoy = date.today()
+        try:
+            desde = datetime.strptime(request.GET.get('desde', ''), '%Y-%m-%d').date()
+            hasta = datetime.strptime(request.GET.get('hasta', ''), '%Y-%m-%d').date()
+        except ValueError:
+            desde, hasta = hoy - timedelta(days=14), hoy + timedelta(days=14)
+        if hasta < desde:
+            desde, hasta = hasta, desde
+        contexto['filtros'] = {'desde': desde.isoformat(), 'hasta': hasta.isoformat()}
+        contexto['estadisticas'] = panel(desde, hasta)
     return render(request, 'dashboard.html', contexto)
 
+@requiere_rol('cliente')
 def crear_reserva(request):
-    if request.session.get('usuario_rol') != 'cliente':
-        return redirect('../dashboard')
 
     if request.method == 'POST':
         direccion = request.POST['direccion']
         tipo_ubicacion = request.POST['tipo_ubicacion']
         fecha = request.POST['fecha']
         hora = request.POST['hora_reserva']
-        lat = request.POST.get('latitud')
-        lon = request.POST.get('longitud')
+        lat = request.POST.get('latitud') or None
+        lon = request.POST.get('longitud') or None
 
-        usuario = Usuario.objects.get(id=request.session['usuario_id'])
+        usuario = request.usuario
 
         fecha_reserva = datetime.strptime(fecha, '%Y-%m-%d').date()
         hora_reserva = datetime.strptime(hora, '%H:%M').time()
         inicio_nueva = datetime.combine(fecha_reserva, hora_reserva)
-        fin_nueva = inicio_nueva + timedelta(hours=2)
+        fin_nueva = inicio_nueva + duracion_reserva(tipo_ubicacion)
+
+        # Todo el camino de reserva es una sola transacción: la disponibilidad leída
+        # sigue siendo válida cuando se crea la asignación. Si la base sigue
+        # bloqueada se repite solo reservar(); los mensajes se agregan después.
+        def reservar():
+            inicio, fin = ventana_reserva(fecha_reserva, hora_reserva, tipo_ubicacion)
+            indice = IndiceDisponibilidad.cargar(inicio, fin)
+            candidatos = indice.libres(inicio, fin)
+            if lat and lon:
+                candidatos = indice.por_cercania(candidatos, inicio_nueva, float(lat), float(lon))
+            asignado = reclamar_personal(candidatos, fecha_reserva, hora_reserva, tipo_ubicacion)
+
+            if asignado:
+                reserva = Reserva.objects.create(
+                    fecha_reserva=fecha_reserva,
+                    hora_reserva=hora_reserva,
+                    direccion=direccion,
+                    tipo_ubicacion=tipo_ubicacion,
+                    estado='asignada',
+                    usuario=usuario,
+                    latitud=lat,
+                    longitud=lon
+                )
+
+                Asignacion.objects.create(
+                    fecha_asignacion=date.today(),
+                    reserva=reserva,
+                    usuario=asignado
+                )
+
+                encolar_correo(
+                    'Reserva creada y asignada',
+                    f'Hola {usuario.nombre}, tu reserva para el {fecha_reserva} a las {hora_reserva} ha sido creada y asignada a {asignado.nombre}.',
+                    [usuario.correo],
+                )
 
-        disponibles = personal_disponible(fecha_reserva, hora_reserva)
+                return messages.success, f'Reserva creada y asignada a {asignado.nombre}.'
+
+            if tipo_ubicacion == 'oficina':
+                asignaciones = Asignacion.objects.select_for_update().filter(reserva__fecha_reserva=fecha_reserva).select_related('reserva', 'usuario')
+
+                for asign in asignaciones:
+                    reserva_existente = asign.reserva
+
+                    if reserva_existente.tipo_ubicacion != 'residencia':
+                        continue
+                    if reserva_existente.estado == 'completada':
+                        continue
+
+                    inicio_existente = datetime.combine(reserva_existente.fecha_reserva, reserva_existente.hora_reserva)
+                    fin_existente = inicio_existente + duracion_reserva(reserva_existente.tipo_ubicacion)
+
+                    if inicio_nueva < fin_existente and inicio_existente < fin_nueva:
+                        # Si la residencia cambió desde que se leyó, se prueba con la siguiente.
+                        if not actualizar_reserva(reserva_existente, reserva_existente.version, excluir_estados=['completada'], estado='pendiente'):
+                            continue
+                        asign.delete()
+                        personal_a_reasignar = asign.usuario
+
+                        reserva = Reserva.objects.create(
+                            fecha_reserva=fecha_reserva,
+                            hora_reserva=hora_reserva,
+                            direccion=direccion,
+                            tipo_ubicacion=tipo_ubicacion,
+                            estado='asignada',
+                            usuario=usuario,
+                            latitud=lat,
+                            longitud=lon
+                        )
+
+                        Asignacion.objects.create(
+                            fecha_asignacion=date.today(),
+                            reserva=reserva,
+                            usuario=personal_a_reasignar
+                        )
+
+                        encolar_correo(
+                            'Reserva de oficina asignada',
+                            f'Hola {usuario.nombre}, tu reserva para el {fecha_reserva} a las {hora_reserva} fue asignada a {personal_a_reasignar.nombre}. La reserva anterior fue puesta en espera.',
+                            [usuario.correo],
+                        )
+
+                        return messages.success, f'Reserva de oficina asignada a {personal_a_reasignar.nombre}. La residencia fue puesta en espera.'
 
-        if disponibles:
             reserva = Reserva.objects.create(
                 fecha_reserva=fecha_reserva,
                 hora_reserva=hora_reserva,
@@ -188,109 +295,45 @@ def crear_reserva(request):
                 latitud=lat,
                 longitud=lon
             )
-
-            Asignacion.objects.create(
-                fecha_asignacion=date.today(),
-                reserva=reserva,
-                usuario=disponibles[0]
-            )
-
-            reserva.estado = 'asignada'
-            reserva.save()
-            send_mail(
-                'Reserva creada y asignada',
-                f'Hola {usuario.nombre}, tu reserva para el {fecha_reserva} a las {hora_reserva} ha sido creada y asignada a {disponibles[0].nombre}.',
-                'no-reply@tusitio.com',
+            sugerencias = ', '.join(h.strftime('%d/%m %H:%M') for h in sugerir_horarios(inicio_nueva, 3, tipo_ubicacion))
+            alternativa = f' Próximos horarios con personal disponible: {sugerencias}.' if sugerencias else ''
+            encolar_correo(
+                'Reserva creada - pendiente',
+                f'Hola {usuario.nombre}, tu reserva para el {fecha_reserva} a las {hora_reserva} ha sido creada pero actualmente no hay personal disponible, por lo que queda pendiente.{alternativa}',
                 [usuario.correo],
-                fail_silently=False,
             )
 
-            messages.success(request, f'Reserva creada y asignada a {disponibles[0].nombre}.')
-            return redirect('../reservas')
-
-        if tipo_ubicacion == 'oficina':
-            asignaciones = Asignacion.objects.filter(reserva__fecha_reserva=fecha_reserva).select_related('reserva', 'usuario')
-
-            for asign in asignaciones:
-                reserva_existente = asign.reserva
+            return messages.warning, f'Reserva creada, pero no hay personal disponible. Queda como pendiente.{alternativa}'
 
-                if reserva_existente.tipo_ubicacion != 'residencia':
-                    continue
-                if reserva_existente.estado == 'completada':
-                    continue
-
-                inicio_existente = datetime.combine(reserva_existente.fecha_reserva, reserva_existente.hora_reserva)
-                fin_existente = inicio_existente + timedelta(hours=2)
-
-                if inicio_nueva < fin_existente and inicio_existente < fin_nueva:
-                    personal_a_reasignar = asign.usuario
-
-                    reserva = Reserva.objects.create(
-                        fecha_reserva=fecha_reserva,
-                        hora_reserva=hora_reserva,
-                        direccion=direccion,
-                        tipo_ubicacion=tipo_ubicacion,
-                        estado='pendiente',
-                        usuario=usuario,
-                        latitud=lat,
-                        longitud=lon
-                    )
-
-                    asign.delete()
-                    reserva_existente.estado = 'pendiente'
-                    reserva_existente.save()
-
-
-                    Asignacion.objects.create(
-                        fecha_asignacion=date.today(),
-                        reserva=reserva,
-                        usuario=personal_a_reasignar
-                    )
-
-                    reserva.estado = 'asignada'
-                    reserva.save()
-                    send_mail(
-                        'Reserva de oficina asignada',
-                        f'Hola {usuario.nombre}, tu reserva para el {fecha_reserva} a las {hora_reserva} fue asignada a {personal_a_reasignar.nombre}. La reserva anterior fue puesta en espera.',
-                        'no-reply@tusitio.com',
-                        [usuario.correo],
-                        fail_silently=False,
-                    )
-
-                    messages.success(request, f'Reserva de oficina asignada a {personal_a_reasignar.nombre}. La residencia fue puesta en espera.')
-                    return redirect('../reservas')
-        
-        reserva = Reserva.objects.create(
-            fecha_reserva=fecha_reserva,
-            hora_reserva=hora_reserva,
-            direccion=direccion,
-            tipo_ubicacion=tipo_ubicacion,
-            estado='pendiente',
-            usuario=usuario,
-            latitud=lat,
-            longitud=lon
-        )
-        send_mail(
-            'Reserva creada - pendiente',
-            f'Hola {usuario.nombre}, tu reserva para el {fecha_reserva} a las {hora_reserva} ha sido creada pero actualmente no hay personal disponible, por lo que queda pendiente.',
-            'no-reply@tusitio.com',
-            [usuario.correo],
-            fail_silently=False,
-        )
-
-        messages.warning(request, 'Reserva creada, pero no hay personal disponible. Queda como pendiente.')
+        nivel, mensaje = atomico_con_reintentos(reservar)
+        nivel(request, mensaje)
         return redirect('../reservas')
 
     return render(request, 'crear_reserva.html')
 
+@requiere_rol('cliente')
+def horarios_disponibles(request):
+    try:
+        fecha = datetime.strptime(request.GET.get('fecha', ''), '%Y-%m-%d').date()
+        cantidad = min(max(int(request.GET.get('cantidad', 5)), 1), 20)
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos.'}, status=400)
+
+    desde = max(datetime.combine(fecha, datetime.min.time()), datetime.now())
+    tipo_ubicacion = request.GET.get('tipo_ubicacion') or None
+    horarios = sugerir_horarios(desde, cantidad, tipo_ubicacion)
+    return JsonResponse({
+        'horarios': [{'fecha': h.date().isoformat(), 'hora': h.strftime('%H:%M')} for h in horarios]
+    })
+
 def detalle_reserva(request, reserva_id):
-    usuario_id = request.session.get('usuario_id')
-    rol = request.session.get('usuario_rol')
+    usuario_id = request.usuario.id if request.usuario else None
+    rol = request.usuario.rol if request.usuario else None
 
     reserva = get_object_or_404(Reserva, id=reserva_id)
     origen = request.GET.get('origen')
 
-    if rol == 'cliente' and reserva.usuario.id != usuario_id:
+    if rol == 'cliente' and reserva.usuario_id != usuario_id:
         return redirect('dashboard')
 
     if rol == 'personal':
@@ -308,10 +351,22 @@ def detalle_reserva(request, reserva_id):
         'volver_url': volver_url
     })
 
+def _version_enviada(request, campo, actual):
+    # La versión que leyó el formulario; sin el campo no se comprueba. Un valor
+    # vacío o alterado no coincide con ninguna y se trata como conflicto.
+    valor = request.POST.get(campo)
+    if valor is None:
+        return actual
+    try:
+        return int(valor)
+    except ValueError:
+        return -1
+
+@requiere_rol('cliente')
 def editar_reserva(request, reserva_id):
     reserva = get_object_or_404(Reserva, id=reserva_id)
 
-    if request.session.get('usuario_rol') != 'cliente' or reserva.usuario.id != request.session['usuario_id']:
+    if reserva.usuario_id != request.usuario.id:
         return redirect('../dashboard')
 
     if request.method == 'POST':
@@ -319,40 +374,54 @@ def editar_reserva(request, reserva_id):
         tipo_ubicacion = request.POST['tipo_ubicacion']
         fecha = request.POST['fecha']
         hora = request.POST['hora_reserva']
+        version = _version_enviada(request, 'version', reserva.version)
+
+        def editar():
+            # Resetear estado a pendiente si editan (por si fue asignada) y
+            # soltar al personal, que ya no corresponde al nuevo horario.
+            actualizada = actualizar_reserva(
+                reserva, version, excluir_estados=['completada'],
+                direccion=direccion,
+                tipo_ubicacion=tipo_ubicacion,
+                fecha_reserva=datetime.strptime(fecha, '%Y-%m-%d').date(),
+                hora_reserva=datetime.strptime(hora, '%H:%M').time(),
+                estado='pendiente'
+            )
+            if actualizada:
+                Asignacion.objects.filter(reserva=reserva).delete()
+            return actualizada
 
-        reserva.direccion = direccion
-        reserva.tipo_ubicacion = tipo_ubicacion
-        reserva.fecha_reserva = datetime.strptime(fecha, '%Y-%m-%d').date()
-        reserva.hora_reserva = datetime.strptime(hora, '%H:%M').time()
-        reserva.estado = 'pendiente'  # Resetear estado a pendiente si editan (por si fue asignada)
+        actualizada = atomico_con_reintentos(editar)
 
-        reserva.save()
+        if not actualizada:
+            reserva.refresh_from_db()
+            messages.error(request, 'La reserva cambió mientras la editabas (fue asignada, completada o editada en otra ventana). Revisa los datos actuales y vuelve a guardar.')
+            return render(request, 'editar_reserva.html', {'reserva': reserva}, status=409)
 
         messages.success(request, 'Reserva actualizada correctamente.')
         return redirect('../../reservas')
 
     return render(request, 'editar_reserva.html', {'reserva': reserva})
 
+@requiere_rol('cliente')
 def eliminar_reserva(request, reserva_id):
     reserva = get_object_or_404(Reserva, id=reserva_id)
 
-    if request.session.get('usuario_rol') != 'cliente' or reserva.usuario.id != request.session['usuario_id']:
+    if reserva.usuario_id != request.usuario.id:
         return redirect('../dashboard')
 
     if request.method == 'POST':
-        reserva.delete()
+        atomico_con_reintentos(reserva.delete)
         messages.success(request, 'Reserva eliminada correctamente.')
         return redirect('../../reservas')
 
     return render(request, 'eliminar_reserva.html', {'reserva': reserva})
 
-from django.db.models import Q
-
-def ver_reservas(request):
-    if request.session.get('usuario_rol') != 'cliente':
-        return redirect('../dashboard')
+from django.db.models import F, OuterRef, Q, Subquery
 
-    usuario_id = request.session['usuario_id']
+@requiere_rol('cliente')
+async def ver_reservas(request):
+    usuario_id = request.usuario.id
     estado = request.GET.get('estado', '')  # filtro estado
     fecha_desde = request.GET.get('fecha_desde', '')
     fecha_hasta = request.GET.get('fecha_hasta', '')
@@ -368,10 +437,18 @@ def ver_reservas(request):
     if fecha_hasta:
         filtros &= Q(fecha_reserva__lte=fecha_hasta)
 
-    reservas = Reserva.objects.filter(filtros).order_by('-fecha_reserva')
+    reservas = Reserva.objects.filter(filtros)
+    orden = ['-fecha_reserva', '-id']
+    tamano = tamano_pagina(request)
 
-    pendientes = reservas.filter(estado__in=['pendiente', 'asignada'])
-    completadas = reservas.filter(estado='completada')
+    pendientes = await apaginar_por_cursor(
+        reservas.filter(estado__in=['pendiente', 'asignada']), orden,
+        request.GET.get('cursor_pendientes'), tamano
+    )
+    completadas = await apaginar_por_cursor(
+        reservas.filter(estado='completada'), orden,
+        request.GET.get('cursor_completadas'), tamano
+    )
 
     contexto = {
         'pendientes': pendientes,
@@ -385,71 +462,49 @@ def ver_reservas(request):
 
     return render(request, 'ver_reservas.html', contexto)
 
-def personal_disponible(fecha, hora):
-    from datetime import datetime, timedelta
-
+def personal_disponible(fecha, hora, tipo_ubicacion=None):
     if isinstance(fecha, str):
         fecha = datetime.strptime(fecha, '%Y-%m-%d').date()
     if isinstance(hora, str):
         hora = datetime.strptime(hora, '%H:%M').time()
 
-    fecha_hora_reserva = datetime.combine(fecha, hora)
-    inicio = fecha_hora_reserva - timedelta(hours=2)
-    fin = fecha_hora_reserva + timedelta(hours=2)
-
-    personal = Usuario.objects.filter(rol='personal', estado='activo')
-    disponibles = []
-
-    for p in personal:
-        asignaciones = Asignacion.objects.filter(usuario=p).select_related('reserva')
-
-        conflicto = False
-        for a in asignaciones:
-            r = a.reserva
-
-            if r.estado == 'completada':
-                continue
-
-            dt_r = datetime.combine(r.fecha_reserva, r.hora_reserva)
-            inicio_r = dt_r
-            fin_r = dt_r + timedelta(hours=2)
-
-            if inicio < fin_r and inicio_r < fin:
-                conflicto = True
-                break
-
-        if not conflicto:
-            disponibles.append(p)
-
-    return disponibles
+    inicio, fin = ventana_reserva(fecha, hora, tipo_ubicacion)
+    indice = IndiceDisponibilidad.cargar(inicio, fin)
+    return indice.libres(inicio, fin)
 
+@requiere_rol('personal')
 def asignar_reserva(request, reserva_id):
-    if request.session.get('usuario_rol') != 'personal':
-        return redirect('../dashboard')
-
-    usuario = Usuario.objects.get(id=request.session['usuario_id'])
+    usuario = request.usuario
     reserva = Reserva.objects.get(id=reserva_id)
 
     if request.method == 'POST':
-        Asignacion.objects.create(
-            fecha_asignacion=date.today(),
-            reserva=reserva,
-            usuario=usuario
-        )
-        reserva.estado = 'asignada'
-        reserva.save()
+        version = _version_enviada(request, 'version', reserva.version)
+        def tomar():
+            if not actualizar_reserva(reserva, version, excluir_estados=['asignada', 'completada'], estado='asignada'):
+                return False
+            Asignacion.objects.create(
+                fecha_asignacion=date.today(),
+                reserva=reserva,
+                usuario=usuario
+            )
+            return True
+
+        if not atomico_con_reintentos(tomar):
+            reserva.refresh_from_db()
+            messages.error(request, 'Otra persona tomó o modificó esta reserva antes que tú.')
+            return render(request, 'asignar_confirmar.html', {'reserva': reserva}, status=409)
         return redirect('../../reservas_pendientes')
 
     return render(request, 'asignar_confirmar.html', {'reserva': reserva})
 
+@requiere_rol('personal')
 def mis_asignaciones_pendientes(request):
-    if request.session.get('usuario_rol') != 'personal':
-        return redirect('../dashboard')
-
-    usuario_id = request.session['usuario_id']
+    usuario_id = request.usuario.id
     asignaciones = Asignacion.objects.filter(
         usuario_id=usuario_id
-    ).exclude(reserva__estado='completada').select_related('reserva')
+    ).exclude(reserva__estado='completada').select_related('reserva', 'reserva__usuario').annotate(
+        inicio_tarea=Subquery(HistorialTarea.objects.filter(asignacion=OuterRef('pk')).values('hora_inicio')[:1])
+    )
 
     fecha_desde = request.GET.get('fecha_desde')
     fecha_hasta = request.GET.get('fecha_hasta')
@@ -459,24 +514,37 @@ def mis_asignaciones_pendientes(request):
     if fecha_hasta:
         asignaciones = asignaciones.filter(reserva__fecha_reserva__lte=fecha_hasta)
 
+    asignaciones = paginar_por_cursor(
+        asignaciones, ['reserva__fecha_reserva', 'reserva__hora_reserva', 'id'],
+        request.GET.get('cursor'), tamano_pagina(request)
+    )
+
+    ruta = None
+    fecha_ruta = request.GET.get('ruta')
+    if fecha_ruta:
+        try:
+            ruta = ruta_del_dia(usuario_id, datetime.strptime(fecha_ruta, '%Y-%m-%d').date())
+        except ValueError:
+            ruta = None
+
     context = {
         'asignaciones': asignaciones,
+        'ruta': ruta,
         'filtros': {
             'fecha_desde': fecha_desde or '',
-            'fecha_hasta': fecha_hasta or ''
+            'fecha_hasta': fecha_hasta or '',
+            'ruta': fecha_ruta or ''
         }
     }
     return render(request, 'mis_asignaciones_pendientes.html', context)
 
+@requiere_rol('personal')
 def mis_asignaciones_completadas(request):
-    if request.session.get('usuario_rol') != 'personal':
-        return redirect('../dashboard')
-
-    usuario_id = request.session['usuario_id']
+    usuario_id = request.usuario.id
     asignaciones = Asignacion.objects.filter(
         usuario_id=usuario_id,
         reserva__estado='completada'
-    ).select_related('reserva')
+    ).select_related('reserva', 'reserva__usuario')
 
     fecha_desde = request.GET.get('fecha_desde')
     fecha_hasta = request.GET.get('fecha_hasta')
@@ -486,6 +554,11 @@ def mis_asignaciones_completadas(request):
     if fecha_hasta:
         asignaciones = asignaciones.filter(reserva__fecha_reserva__lte=fecha_hasta)
 
+    asignaciones = paginar_por_cursor(
+        asignaciones, ['-reserva__fecha_reserva', '-reserva__hora_reserva', '-id'],
+        request.GET.get('cursor'), tamano_pagina(request)
+    )
+
     context = {
         'asignaciones': asignaciones,
         'filtros': {
@@ -495,42 +568,86 @@ def mis_asignaciones_completadas(request):
     }
     return render(request, 'mis_asignaciones_completadas.html', context)
 
+@requiere_rol('personal')
+def iniciar_tarea(request, asignacion_id):
+
+    try:
+        asignacion = Asignacion.objects.select_related('reserva').get(
+            id=asignacion_id, usuario_id=request.usuario.id
+        )
+    except Asignacion.DoesNotExist:
+        messages.error(request, "Asignación inválida.")
+        return redirect('../../asignaciones_pendientes')
+
+    if asignacion.reserva.estado == 'completada':
+        messages.warning(request, "La tarea ya fue finalizada.")
+        return redirect('../../asignaciones_pendientes')
+
+    def iniciar():
+        # Revisar y crear en la misma transacción, con la asignación
+        # bloqueada: dos clics seguidos no dejan dos tareas abiertas.
+        Asignacion.objects.select_for_update().filter(id=asignacion.id).first()
+        if not HistorialTarea.objects.filter(asignacion=asignacion).exists():
+            HistorialTarea.objects.create(
+                hora_inicio=timezone.now(),
+                ubicacion=asignacion.reserva.direccion,
+                asignacion=asignacion
+            )
+
+    atomico_con_reintentos(iniciar)
+    return redirect('../../asignaciones_pendientes')
+
+@requiere_rol('personal')
 def finalizar_tarea(request, asignacion_id):
-    if request.session.get('usuario_rol') != 'personal':
-        return redirect('../dashboard')
 
     try:
         asignacion = Asignacion.objects.select_related('reserva', 'usuario').get(
-            id=asignacion_id, usuario_id=request.session['usuario_id']
+            id=asignacion_id, usuario_id=request.usuario.id
         )
     except Asignacion.DoesNotExist:
         messages.error(request, "Asignación inválida.")
         return redirect('../asignaciones_pendientes')
 
-    if not HistorialTarea.objects.filter(asignacion=asignacion).exists():
-        HistorialTarea.objects.create(
-            hora_inicio=timezone.now(),
-            hora_fin=timezone.now(),
-            ubicacion=asignacion.reserva.direccion,
-            asignacion=asignacion
-        )
+    def finalizar():
+        Asignacion.objects.select_for_update().filter(id=asignacion.id).first()
+        tarea = HistorialTarea.objects.filter(asignacion=asignacion).first()
+        if tarea is not None and tarea.hora_fin is not None:
+            return
+        ahora = timezone.now()
+        if tarea is None:
+            # Finalizada sin haberse iniciado: queda con duración cero y no
+            # cuenta para las estadísticas de duración.
+            HistorialTarea.objects.create(
+                hora_inicio=ahora,
+                hora_fin=ahora,
+                ubicacion=asignacion.reserva.direccion,
+                asignacion=asignacion
+            )
+        else:
+            tarea.hora_fin = ahora
+            tarea.save(update_fields=['hora_fin'])
         asignacion.reserva.estado = 'completada'
         asignacion.reserva.save()
 
+    atomico_con_reintentos(finalizar)
     return redirect('../../asignaciones_pendientes')
 
 from datetime import datetime
 
-def horario_reservas(request):
-    usuario_id = request.session.get('usuario_id')
-    rol = request.session.get('usuario_rol')
+# La página en caché lleva esta marca en lugar del id del último evento, que
+# se completa en cada respuesta.
+MARCA_ULTIMO_EVENTO = b'__ultimo_evento__'
 
-    if not usuario_id or not rol:
-        return redirect('../login')
+@requiere_rol(redireccion='../login')
+async def horario_reservas(request):
+    usuario_id = request.usuario.id
+    rol = request.usuario.rol
 
     filtro_estado = request.GET.get('estado', '')
     filtro_semana_str = request.GET.get('semana', '')
     filtro_personal = request.GET.get('personal', '')
+    if not filtro_personal.isdigit():
+        filtro_personal = ''
 
     if filtro_semana_str:
         try:
@@ -540,7 +657,7 @@ def horario_reservas(request):
     else:
         filtro_semana_date = date.today()
 
-    lunes = filtro_semana_date - timedelta(days=filtro_semana_date.weekday())
+    lunes = lunes_de(filtro_semana_date)
     domingo = lunes + timedelta(days=6)
 
     dias_semana = [
@@ -553,10 +670,18 @@ def horario_reservas(request):
         {'nombre_es': 'Domingo', 'fecha': lunes + timedelta(days=6)},
     ]
 
+    # Se lee antes que la versión de la semana: si la página sale de la caché,
+    # ningún evento posterior a este id pudo haber cambiado esta semana.
+    desde = str(await ultimo_evento()).encode()
+
+    clave = await aclave_horario(lunes, rol, usuario_id, filtro_semana_str, filtro_estado, filtro_personal)
+    contenido = await cache.aget(clave)
+    if contenido is not None:
+        return HttpResponse(contenido.replace(MARCA_ULTIMO_EVENTO, desde))
+
     lista_personal = []
     if rol == 'administrador':
-        from app.models import Usuario  # Ajusta el import si es necesario
-        lista_personal = Usuario.objects.filter(rol='personal')
+        lista_personal = [u async for u in Usuario.objects.filter(rol='personal')]
 
     filtro_reserva_kwargs = {'fecha_reserva__range': (lunes, domingo)}
 
@@ -565,7 +690,8 @@ def horario_reservas(request):
 
     if rol == 'cliente':
         filtro_reserva_kwargs['usuario_id'] = usuario_id
-        reservas = Reserva.objects.filter(**filtro_reserva_kwargs).select_related('usuario')
+        reservas = Reserva.objects.filter(**filtro_reserva_kwargs).prefetch_related('asignacion_set__usuario')
+        reservas = [r async for r in reservas]
     elif rol == 'personal':
         asignaciones = Asignacion.objects.filter(
             usuario_id=usuario_id,
@@ -575,30 +701,16 @@ def horario_reservas(request):
         if filtro_estado:
             asignaciones = asignaciones.filter(reserva__estado=filtro_estado)
 
-        reservas = [a.reserva for a in asignaciones if a.reserva.estado != 'completada']
+        reservas = [a.reserva async for a in asignaciones.aiterator() if a.reserva.estado != 'completada']
     elif rol == 'administrador':
-        reservas = Reserva.objects.filter(**filtro_reserva_kwargs).select_related('usuario')
+        reservas = Reserva.objects.filter(**filtro_reserva_kwargs).select_related('usuario').prefetch_related('asignacion_set__usuario')
         if filtro_personal:
             reservas = reservas.filter(asignacion__usuario_id=filtro_personal).distinct()
+        reservas = [r async for r in reservas]
     else:
         reservas = []
 
-    horas_set = set()
-    for r in reservas:
-        horas_set.add(r.hora_reserva.strftime("%H:%M"))
-    horas = sorted(list(horas_set))
-
-    horario_list = []
-    for h in horas:
-        fila = {'hora': h, 'reservas_por_dia': []}
-        for dia in dias_semana:
-            reservas_en_hora = [
-                r for r in reservas
-                if r.hora_reserva.strftime("%H:%M") == h and r.fecha_reserva == dia['fecha']
-                and (not filtro_estado or r.estado == filtro_estado)
-            ]
-            fila['reservas_por_dia'].append(reservas_en_hora)
-        horario_list.append(fila)
+    horario_list = construir_grilla(reservas, dias_semana, filtro_estado)
 
     contexto = {
         'dias_semana': dias_semana,
@@ -608,16 +720,21 @@ def horario_reservas(request):
         'filtro_semana': filtro_semana_str,
         'filtro_personal': filtro_personal,
         'lista_personal': lista_personal,
+        'usuario_id': usuario_id,
+        'ultimo_evento': MARCA_ULTIMO_EVENTO.decode(),
     }
-    return render(request, 'horario_reservas.html', contexto)
+    respuesta = render(request, 'horario_reservas.html', contexto)
+    await cache.aset(clave, respuesta.content, CACHE_TIMEOUT)
+    respuesta.content = respuesta.content.replace(MARCA_ULTIMO_EVENTO, desde)
+    return respuesta
 
 def asignar_con_prioridad(reserva_nueva):
     fecha = reserva_nueva.fecha_reserva
     hora = reserva_nueva.hora_reserva
     inicio_nueva = datetime.combine(fecha, hora)
-    fin_nueva = inicio_nueva + timedelta(hours=2)
+    fin_nueva = inicio_nueva + duracion_reserva(reserva_nueva.tipo_ubicacion)
 
-    disponibles = personal_disponible(fecha, hora)
+    disponibles = personal_disponible(fecha, hora, reserva_nueva.tipo_ubicacion)
     if disponibles:
         Asignacion.objects.create(
             fecha_asignacion=datetime.today(),
@@ -638,14 +755,13 @@ def asignar_con_prioridad(reserva_nueva):
                 continue
 
             inicio_existente = datetime.combine(reserva_existente.fecha_reserva, reserva_existente.hora_reserva)
-            fin_existente = inicio_existente + timedelta(hours=2)
+            fin_existente = inicio_existente + duracion_reserva(reserva_existente.tipo_ubicacion)
 
             if inicio_nueva < fin_existente and inicio_existente < fin_nueva:
+                if not actualizar_reserva(reserva_existente, reserva_existente.version, excluir_estados=['completada'], estado='pendiente'):
+                    continue
                 personal_a_reasignar = asign.usuario
-
                 asign.delete()
-                reserva_existente.estado = 'pendiente'
-                reserva_existente.save()
 
                 Asignacion.objects.create(
                     fecha_asignacion=datetime.today(),
@@ -661,58 +777,80 @@ def asignar_con_prioridad(reserva_nueva):
     reserva_nueva.save()
     return False
 
+@requiere_rol('administrador')
 def reasignar_pendientes(request):
-    pendientes = Reserva.objects.filter(estado='pendiente')
-    asignadas = 0
+    inicio_proceso = time.perf_counter()
 
-    for reserva in pendientes:
-        disponibles = personal_disponible(reserva.fecha_reserva, reserva.hora_reserva)
-        if disponibles:
-            Asignacion.objects.create(
-                fecha_asignacion=date.today(),
-                reserva=reserva,
-                usuario=disponibles[0]
-            )
-            reserva.estado = 'asignada'
-            reserva.save()
-            asignadas += 1
+    with transaction.atomic():
+        pendientes = list(Reserva.objects.select_for_update().filter(estado='pendiente'))
+        nuevas, sin_asignar = asignar_en_lote(pendientes, date.today())
 
-    return HttpResponse(f"{asignadas} reserva(s) pendientes fueron asignadas.")
+        with cambios_de_reservas(a.reserva.id for a in nuevas):
+            Asignacion.objects.bulk_create(nuevas)
+            for a in nuevas:
+                a.reserva.version = F('version') + 1
+            Reserva.objects.bulk_update([a.reserva for a in nuevas], ['estado', 'version'])
 
-def asignar_manual(request):
-    if request.session.get('usuario_rol') != 'administrador':
-        return redirect('../dashboard')
+        for lunes in {lunes_de(a.reserva.fecha_reserva) for a in nuevas}:
+            transaction.on_commit(lambda lunes=lunes: invalidar_semana(lunes), robust=True)
+        programar_eventos('asignada', (a.reserva.id for a in nuevas))
+
+    segundos = time.perf_counter() - inicio_proceso
+    return HttpResponse(
+        f"{len(nuevas)} reserva(s) pendientes fueron asignadas. "
+        f"{len(sin_asignar)} quedaron sin personal disponible ({segundos:.2f} s)."
+    )
 
+@requiere_rol('administrador')
+def asignar_manual(request):
     reservas_pendientes = Reserva.objects.filter(estado='pendiente')
     personal_disponible = Usuario.objects.filter(rol='personal', estado='activo')
 
     if request.method == 'POST':
-        reserva_id = int(request.POST.get('reserva_id'))
-        personal_id = int(request.POST.get('personal_id'))
+        try:
+            reserva_id = int(request.POST.get('reserva_id', ''))
+            personal_id = int(request.POST.get('personal_id', ''))
+        except ValueError:
+            messages.error(request, 'Selecciona una reserva y una persona.')
+            return redirect('../asignar_manual')
 
         reserva = get_object_or_404(Reserva, id=reserva_id)
         personal = get_object_or_404(Usuario, id=personal_id)
+        version = _version_enviada(request, f'version_{reserva_id}', reserva.version)
+
+        inicio = datetime.combine(reserva.fecha_reserva, reserva.hora_reserva)
+
+        def asignar():
+            conflicto = not actualizar_reserva(reserva, version, excluir_estados=['completada', 'asignada'], estado='asignada')
+
+            asignaciones = Asignacion.objects.filter(
+                usuario=personal,
+                reserva__fecha_reserva__range=(reserva.fecha_reserva - timedelta(days=1), reserva.fecha_reserva + timedelta(days=1))
+            ).exclude(reserva=reserva).exclude(reserva__estado='completada').select_related('reserva')
+            for asignacion in asignaciones:
+                if conflicto:
+                    break
+                otra = asignacion.reserva
+                dt_otra = datetime.combine(otra.fecha_reserva, otra.hora_reserva)
+                if choca(dt_otra, otra.tipo_ubicacion, inicio, reserva.tipo_ubicacion) or choca(inicio, reserva.tipo_ubicacion, dt_otra, otra.tipo_ubicacion):
+                    conflicto = not actualizar_reserva(otra, otra.version, excluir_estados=['completada'], estado='pendiente')
+                    asignacion.delete()
+
+            if conflicto:
+                # Otro usuario modificó alguna de las reservas mientras tanto.
+                transaction.set_rollback(True)
+            else:
+                Asignacion.objects.create(
+                    fecha_asignacion=date.today(),
+                    reserva=reserva,
+                    usuario=personal
+                )
+            return conflicto
 
-        fecha_hora_reserva = datetime.combine(reserva.fecha_reserva, reserva.hora_reserva)
-        inicio = fecha_hora_reserva - timedelta(hours=2)
-        fin = fecha_hora_reserva + timedelta(hours=2)
-
-        asignaciones = Asignacion.objects.filter(usuario=personal).select_related('reserva')
-        for asignacion in asignaciones:
-            otra = asignacion.reserva
-            dt_otra = datetime.combine(otra.fecha_reserva, otra.hora_reserva)
-            if inicio <= dt_otra <= fin:
-                otra.estado = 'pendiente'
-                otra.save()
-                asignacion.delete()
-
-        Asignacion.objects.create(
-            fecha_asignacion=date.today(),
-            reserva=reserva,
-            usuario=personal
-        )
-        reserva.estado = 'asignada'
-        reserva.save()
+        conflicto = atomico_con_reintentos(asignar)
+        if conflicto:
+            messages.error(request, f'La reserva {reserva.id} o una de las que debía reemplazar cambió mientras tanto. Revisa y vuelve a intentarlo.')
+            return redirect('../asignar_manual')
 
         messages.success(request, f'Reserva {reserva.id} asignada a {personal.nombre}. Se reemplazaron conflictos previos si existían.')
         return redirect('../asignar_manual')
@@ -722,21 +860,38 @@ def asignar_manual(request):
         'personal': personal_disponible
     })
 
-def gestionar_usuarios(request):
-    if request.session.get('usuario_rol') != 'administrador':
-        return redirect('../dashboard')
+@requiere_rol('administrador')
+def replanificar(request):
+    if request.method == 'POST':
+        try:
+            fecha = datetime.strptime(request.POST.get('fecha', ''), '%Y-%m-%d').date()
+        except ValueError:
+            messages.error(request, 'Fecha inválida.')
+            return redirect('../replanificar_dia')
+
+        r = replanificar_dia(fecha)
+        messages.success(
+            request,
+            f'Día {fecha} replanificado: {r.mantenidas} sin cambios, {r.reasignadas} reasignadas, '
+            f'{r.nuevas} nuevas, {r.liberadas} liberadas y {r.sin_personal} sin personal disponible. '
+            f'Recorrido estimado: {r.distancia_km:.1f} km.'
+        )
+        return redirect('../replanificar_dia')
 
+    return render(request, 'replanificar_dia.html')
+
+@requiere_rol('administrador')
+def gestionar_usuarios(request):
     usuarios = Usuario.objects.all().order_by('rol', 'estado', 'nombre')
     return render(request, 'gestionar_usuarios.html', {'usuarios': usuarios})
 
 def cambiar_contraseña(request, usuario_id=None):
     if usuario_id is None:
-        usuario_id = request.session.get('usuario_id')
-
-    if not usuario_id:
-        return redirect('login')
-
-    usuario = get_object_or_404(Usuario, id=usuario_id)
+        if request.usuario is None:
+            return redirect('login')
+        usuario = request.usuario
+    else:
+        usuario = get_object_or_404(Usuario, id=usuario_id)
 
     if request.method == 'POST':
         nueva = request.POST.get('nueva')
@@ -766,56 +921,134 @@ def cambiar_contraseña(request, usuario_id=None):
         origen = request.GET.get('origen', '')
         return render(request, 'cambiar_contraseña.html', {'origen': origen})
     
-def mapa_asignaciones(request):
-    rol = request.session.get('usuario_rol')
-    usuario_id = request.session.get('usuario_id')
-
-    if not rol or not usuario_id:
-        return redirect('../login')
-
+def _asignaciones_mapa(rol, usuario_id):
+    asignaciones = Asignacion.objects.filter(
+        reserva__estado__in=['pendiente', 'asignada'],
+        reserva__latitud__isnull=False,
+        reserva__longitud__isnull=False,
+    )
     if rol == 'personal':
-        asignaciones = Asignacion.objects.filter(
-            usuario_id=usuario_id,
-            reserva__estado__in=['pendiente', 'asignada']
-        ).select_related('reserva').order_by('reserva__fecha_reserva', 'reserva__hora_reserva')
-
-    elif rol == 'administrador':
-        asignaciones = Asignacion.objects.filter(
-            reserva__estado__in=['pendiente', 'asignada']
-        ).select_related('reserva', 'usuario', 'reserva__usuario').order_by('reserva__fecha_reserva', 'reserva__hora_reserva')
-    else:
+        return asignaciones.filter(usuario_id=usuario_id)
+    if rol == 'administrador':
+        return asignaciones
+    return None
+
+@requiere_rol(redireccion='../login')
+async def mapa_asignaciones(request):
+    rol = request.usuario.rol
+    asignaciones = _asignaciones_mapa(rol, request.usuario.id)
+    if asignaciones is None:
         return redirect('../dashboard')
+    desde = await ultimo_evento()
+
+    # Los marcadores se piden a mapa_geojson según el área visible; aquí solo
+    # se centra el mapa en la próxima asignación.
+    centro = await asignaciones.order_by('reserva__fecha_reserva', 'reserva__hora_reserva').values(
+        'reserva__latitud', 'reserva__longitud'
+    ).afirst()
 
     return render(request, 'mapa_asignaciones.html', {
-        'asignaciones': asignaciones,
-        'rol': rol
+        'centro': centro,
+        'rol': rol,
+        'ultimo_evento': desde,
     })
 
-def ver_historial(request):
-    if request.session.get('usuario_rol') != 'administrador':
-        return redirect('../dashboard')
+def eventos_horario(request):
+    # Bajo ASGI esta ruta la atiende app.eventos.aplicacion_eventos (ver
+    # horarios/asgi.py). Si llega aquí el sitio corre sobre WSGI, donde cada
+    # conexión ocuparía un hilo; con 204 el navegador deja de reintentar y la
+    # página sigue funcionando sin actualizaciones en vivo.
+    return HttpResponse(status=204)
+
+def mapa_geojson(request):
+    rol = request.usuario.rol if request.usuario else None
+    asignaciones = _asignaciones_mapa(rol, request.usuario.id) if rol else None
+    if asignaciones is None:
+        return JsonResponse({'error': 'No autorizado.'}, status=403)
+
+    try:
+        bbox = parsear_bbox(request.GET.get('bbox', ''))
+        zoom = int(request.GET.get('zoom', 13))
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros bbox o zoom inválidos.'}, status=400)
+
+    asignaciones = filtrar_bbox(asignaciones, bbox)
+    return JsonResponse(coleccion(asignaciones, zoom, rol == 'administrador'))
 
-    historial = HistorialTarea.objects.select_related('asignacion__usuario', 'asignacion__reserva')
+def mapa_ruta(request):
+    if request.usuario is None or request.usuario.rol != 'personal':
+        return JsonResponse({'error': 'No autorizado.'}, status=403)
 
+    try:
+        fecha = datetime.strptime(request.GET.get('fecha', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'error': 'Fecha inválida.'}, status=400)
+
+    ruta = ruta_del_dia(request.usuario.id, fecha)
+    return JsonResponse({
+        'type': 'Feature',
+        'geometry': {
+            'type': 'LineString',
+            'coordinates': [[a.reserva.longitud, a.reserva.latitud] for a in ruta.asignaciones],
+        },
+        'properties': {
+            'distancia_km': round(ruta.distancia_km, 2),
+            'paradas': [
+                {'direccion': a.reserva.direccion, 'hora': a.reserva.hora_reserva.strftime('%H:%M')}
+                for a in ruta.asignaciones
+            ],
+        },
+    })
+
+def _inicio_del_dia(fecha):
+    # None si falta la fecha o no es válida: ese filtro no se aplica.
+    try:
+        dia = datetime.strptime(fecha or '', '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    return timezone.make_aware(datetime.combine(dia, datetime.min.time()))
+
+def _filtrar_historial(request, historial):
+    historial = historial.filter(hora_fin__isnull=False)
     fecha_desde = request.GET.get('fecha_desde')
     fecha_hasta = request.GET.get('fecha_hasta')
     personal_id = request.GET.get('personal')
     cliente_id = request.GET.get('cliente')
 
-    if fecha_desde:
-        historial = historial.filter(hora_inicio__date__gte=fecha_desde)
-    if fecha_hasta:
-        historial = historial.filter(hora_fin__date__lte=fecha_hasta)
+    # Rangos de fecha y hora en vez de __date, que SQLite calcula fila por fila
+    # sin usar historial_inicio_idx. Una tarea que termina antes del fin de
+    # fecha_hasta también empezó antes, así que ese límite usa el índice.
+    desde = _inicio_del_dia(fecha_desde)
+    if desde:
+        historial = historial.filter(hora_inicio__gte=desde)
+    hasta = _inicio_del_dia(fecha_hasta)
+    if hasta:
+        fin = hasta + timedelta(days=1)
+        historial = historial.filter(hora_inicio__lt=fin, hora_fin__lt=fin)
     if personal_id:
         historial = historial.filter(asignacion__usuario__id=personal_id)
     if cliente_id:
         historial = historial.filter(asignacion__reserva__usuario__id=cliente_id)
 
-    personal = Usuario.objects.filter(rol='personal')
-    clientes = Usuario.objects.filter(rol='cliente')
+    return historial
+
+@requiere_rol('administrador')
+async def ver_historial(request):
+    historial = HistorialTarea.objects.select_related('asignacion__usuario', 'asignacion__reserva__usuario')
+    historial = _filtrar_historial(request, historial)
+
+    fecha_desde = request.GET.get('fecha_desde')
+    fecha_hasta = request.GET.get('fecha_hasta')
+    personal_id = request.GET.get('personal')
+    cliente_id = request.GET.get('cliente')
+
+    personal = [u async for u in Usuario.objects.filter(rol='personal')]
+    clientes = [u async for u in Usuario.objects.filter(rol='cliente')]
 
     contexto = {
-        'historial': historial.order_by('-hora_inicio'),
+        'historial': await apaginar_por_cursor(
+            historial, ['-hora_inicio', '-id'], request.GET.get('cursor'), tamano_pagina(request)
+        ),
         'filtros': {
             'fecha_desde': fecha_desde or '',
             'fecha_hasta': fecha_hasta or '',
@@ -823,9 +1056,103 @@ def ver_historial(request):
             'cliente_id': int(cliente_id) if cliente_id else ''
         },
         'personal': personal,
-        'clientes': clientes
+        'clientes': clientes,
+        'duraciones': await aestadisticas(_filtrar_historial(request, HistorialTarea.objects.all()))
     }
     return render(request, 'ver_historial.html', contexto)
 
+@requiere_rol('administrador')
+def exportar_historial(request):
+    historial = _filtrar_historial(request, HistorialTarea.objects.all())
+    # Cada servidor consume su tipo de iterador sin juntarlo en memoria: WSGI
+    # uno síncrono y ASGI uno asíncrono.
+    if isinstance(request, ASGIRequest):
+        filas, escribir_csv, escribir_ndjson = afilas_historial(historial), agenerar_csv, agenerar_ndjson
+    else:
+        filas, escribir_csv, escribir_ndjson = filas_historial(historial), generar_csv, generar_ndjson
+
+    if request.GET.get('formato') == 'ndjson':
+        respuesta = StreamingHttpResponse(escribir_ndjson(filas), content_type='application/x-ndjson')
+        respuesta['Content-Disposition'] = 'attachment; filename="historial.ndjson"'
+    else:
+        respuesta = StreamingHttpResponse(escribir_csv(filas), content_type='text/csv; charset=utf-8')
+        respuesta['Content-Disposition'] = 'attachment; filename="historial.csv"'
+    return respuesta
+
+def _token_metricas(request):
+    token = getattr(settings, 'METRICAS_TOKEN', '')
+    tipo, _, enviado = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and tipo.lower() == 'bearer' and hmac.compare_digest(enviado.encode(), token.encode())
+
+def metricas(request):
+    administrador = request.usuario is not None and request.usuario.rol == 'administrador'
+    if not administrador and not _token_metricas(request):
+        return HttpResponse(status=403)
+    return HttpResponse(exportar_metricas(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def terminos_condiciones(request):
-    return render(request, 'terminos_condiciones.html')
\ No newline at end of file
+    return render(request, 'terminos_condiciones.html')
+
+@requiere_rol('administrador')
+def importar(request):
+    if request.method == 'POST':
+        archivo = request.FILES.get('archivo')
+        if archivo is None:
+            messages.error(request, 'Selecciona un archivo CSV.')
+            return redirect('../importar_reservas')
+
+        inicio_proceso = time.perf_counter()
+        try:
+            # El archivo se lee completo antes de escribir nada en la base.
+            resultado = importar_reservas(io.TextIOWrapper(archivo.file, encoding='utf-8-sig', newline=''))
+        except (UnicodeDecodeError, csv.Error):
+            messages.error(request, 'No se pudo leer el archivo. Debe ser un CSV guardado en UTF-8.')
+            return redirect('../importar_reservas')
+        segundos = time.perf_counter() - inicio_proceso
+
+        messages.success(
+            request,
+            f'{resultado.creadas} reserva(s) importadas: {resultado.asignadas} asignadas y {resultado.pendientes} pendientes. '
+            f'{resultado.duplicadas} duplicadas omitidas ({segundos:.2f} s).'
+        )
+        return render(request, 'importar_reservas.html', {'errores': resultado.errores})
+
+    return render(request, 'importar_reservas.html')
+
+@requiere_rol('administrador')
+def calendario(request):
+    if request.method == 'POST':
+        accion = request.POST.get('accion')
+        try:
+            if accion == 'agregar_turno':
+                hora_inicio = datetime.strptime(request.POST['hora_inicio'], '%H:%M').time()
+                hora_fin = datetime.strptime(request.POST['hora_fin'], '%H:%M').time()
+                if hora_fin <= hora_inicio and hora_fin != datetime.min.time():
+                    messages.error(request, 'La hora de término debe ser posterior a la de inicio.')
+                    return redirect('../calendario')
+                personal = get_object_or_404(Usuario, id=request.POST['personal'], rol='personal')
+                for dia in request.POST.getlist('dias'):
+                    Turno.objects.create(usuario=personal, dia_semana=int(dia), hora_inicio=hora_inicio, hora_fin=hora_fin)
+                messages.success(request, f'Turno agregado para {personal.nombre}.')
+            elif accion == 'agregar_feriado':
+                personal_id = request.POST.get('personal') or None
+                Feriado.objects.create(
+                    fecha=datetime.strptime(request.POST['fecha'], '%Y-%m-%d').date(),
+                    usuario_id=personal_id,
+                    descripcion=request.POST.get('descripcion', '')
+                )
+                messages.success(request, 'Día libre agregado.')
+            elif accion == 'eliminar_turno':
+                Turno.objects.filter(id=request.POST['id']).delete()
+            elif accion == 'eliminar_feriado':
+                Feriado.objects.filter(id=request.POST['id']).delete()
+        except (KeyError, ValueError):
+            messages.error(request, 'Datos inválidos.')
+        return redirect('../calendario')
+
+    return render(request, 'calendario.html', {
+        'turnos': Turno.objects.select_related('usuario'),
+        'feriados': Feriado.objects.filter(fecha__gte=date.today()).select_related('usuario'),
+        'personal': Usuario.objects.filter(rol='personal').order_by('nombre'),
+        'dias': Turno.DIA_CHOICES,
+    })
@@ -10,7 +10,20 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from django.urls import reverse
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'horarios.settings')
 
-application = get_asgi_application()
+aplicacion_django = get_asgi_application()
+
+# Los modelos solo se pueden importar con Django ya configurado.
+from app.eventos import aplicacion_eventos
+
+# El flujo de eventos del horario no pasa por Django (ver app.eventos).
+RUTA_EVENTOS = reverse('eventos_horario')
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == RUTA_EVENTOS:
+        return await aplicacion_eventos(scope, receive, send)
+    return await aplicacion_django(scope, receive, send)
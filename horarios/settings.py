@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,8 +44,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.metricas.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'app.sesion.UsuarioSesionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -55,7 +59,9 @@ ROOT_URLCONF = 'horarios.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que además mide el tiempo de render (ver app.metricas).
+        'BACKEND': 'app.metricas.PlantillasMedidas',
+        'NAME': 'django',
         'DIRS': [os.path.join(BASE_DIR,'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,9 +85,78 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'database.db',
+        'OPTIONS': {
+            # Las transacciones toman el candado de escritura al empezar, así dos
+            # reservas simultáneas no pueden leer la misma disponibilidad.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Conexiones persistentes: los PRAGMA de SQLITE_PRAGMAS se aplican una
+        # vez por conexión y no en cada petición.
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        # En archivo y no en memoria: las pruebas con varios hilos necesitan el
+        # WAL y busy_timeout, y la base en memoria compartida bloquea por tabla.
+        'TEST': {'NAME': BASE_DIR / 'test_database.db'},
     }
 }
 
+# PRAGMA aplicados a cada conexión SQLite nueva (ver app.basedatos).
+SQLITE_PRAGMAS = {
+    # Con WAL los lectores no bloquean al que escribe ni al revés.
+    'journal_mode': 'wal',
+    # Milisegundos esperando el candado de escritura antes de fallar.
+    'busy_timeout': 20000,
+    # Seguro con WAL: se sincroniza en los checkpoints, no en cada commit.
+    'synchronous': 'normal',
+    'mmap_size': 128 * 1024 * 1024,
+    # Negativo: tamaño en KiB (unos 20 MB) en vez de páginas.
+    'cache_size': -20000,
+}
+
+# Veces que se repite una escritura de reservas si la base sigue bloqueada.
+SQLITE_REINTENTOS = 3
+
+# La caché por defecto (páginas del horario, duraciones aprendidas) es de cada
+# proceso. Lo que se invalida en un worker y tiene que verse en los demás (el
+# calendario de turnos y las versiones del horario) va en 'compartida'. Con
+# varios servidores, usar 'django.core.cache.backends.redis.RedisCache'
+# (requiere el paquete redis).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'compartida': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 300,
+        },
+    },
+}
+
+# Los tests no tocan el directorio cache/ del proyecto.
+if sys.argv[1:2] == ['test']:
+    CACHES['compartida'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'compartida',
+    }
+
+# Consultas que tardan al menos esto (segundos) se registran en el logger
+# app.metricas con la vista que las hizo.
+METRICAS_CONSULTA_LENTA = 0.1
+
+# Token que el recolector de Prometheus envía como "Authorization: Bearer
+# <token>" para leer /metrics sin sesión. No se filtra por IP: detrás de un
+# proxy inverso todas las peticiones llegan desde 127.0.0.1. Vacío, solo los
+# administradores pueden leer las métricas.
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN', '')
+
+# Actualizaciones en vivo del horario (app.eventos). Solo se sirven con ASGI;
+# si el sitio corre sobre WSGI, en False deja de escribir eventos que nadie
+# va a leer.
+EVENTOS_EN_VIVO = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -102,6 +177,56 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# El primero se usa para contraseñas nuevas; los demás solo verifican hashes
+# antiguos, que se recalculan con el primero en el siguiente login correcto.
+# Para usar Argon2 instala argon2-cffi y agrega primero
+# 'django.contrib.auth.hashers.Argon2PasswordHasher'.
+
+PASSWORD_HASHERS = [
+    'app.hashers.ScryptConfigurablePasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+# n=2**14, r=8 usa 16 MB por hash; con p=1 cuesta una fracción del PBKDF2
+# por defecto en CPU sin dejar de ser costoso de atacar por fuerza bruta.
+HASH_SCRYPT = {
+    'work_factor': 2 ** 14,
+    'block_size': 8,
+    'parallelism': 1,
+}
+
+# Duración de cada reserva al buscar personal libre. Con 'activa', se usa el
+# percentil indicado de las tareas reales (iniciadas y finalizadas) de los
+# últimos 'dias', siempre que haya al menos 'minimo_muestras'; si no, 2 horas.
+DURACION_APRENDIDA = {
+    'activa': False,
+    'percentil': 80,
+    'dias': 90,
+    'minimo_muestras': 30,
+}
+
+# Duración fija por tipo de ubicación; tiene prioridad sobre la aprendida.
+# Ejemplo: {'oficina': timedelta(hours=1, minutes=30)}
+DURACION_POR_TIPO = {}
+
+# Tiempo que el personal queda ocupado después de cada trabajo (traslado).
+MARGEN_TRASLADO = timedelta(hours=2)
+
+# Intentos de login permitidos: (capacidad, recarga por segundo). Por IP se
+# cuentan todos; por correo solo los fallidos, para que nadie pueda bloquear
+# una cuenta ajena solo con intentar entrar.
+LOGIN_LIMITE_IP = (20, 20 / 60)
+LOGIN_LIMITE_CORREO = (5, 5 / 300)
+
+# Detrás de un proxy inverso: las direcciones del proxy y la cabecera (en
+# request.META) donde deja la IP del cliente. Sin ellas se usa REMOTE_ADDR.
+# Ejemplo: PROXIES_CONFIABLES = ['127.0.0.1'], IP_CLIENTE_CABECERA = 'HTTP_X_FORWARDED_FOR'
+PROXIES_CONFIABLES = []
+IP_CLIENTE_CABECERA = ''
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
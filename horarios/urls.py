@@ -31,6 +31,7 @@ urlpatterns = [
     path('eliminar_reserva/<int:reserva_id>/', views.eliminar_reserva),
     path('registro/', views.registro_cliente),
     path('reservas/', views.ver_reservas, name='ver_reservas'),
+    path('horarios_disponibles/', views.horarios_disponibles),
     path('crear_reserva/', views.crear_reserva),
     path('perfil/', views.perfil_cliente, name='perfil'),
     path('editar_perfil/', views.editar_perfil),
@@ -39,6 +40,7 @@ urlpatterns = [
     path('asignar_reserva/<int:reserva_id>/', views.asignar_reserva),
     path('asignaciones_pendientes/', views.mis_asignaciones_pendientes),
     path('asignaciones_completadas/', views.mis_asignaciones_completadas),
+    path('iniciar_tarea/<int:asignacion_id>/', views.iniciar_tarea),
     path('finalizar_tarea/<int:asignacion_id>/', views.finalizar_tarea),
     ##OTRO##
     path('gestionar_usuarios/', views.gestionar_usuarios, name='gestionar_usuarios'),
@@ -46,9 +48,17 @@ urlpatterns = [
     path('horario_reservas/', views.horario_reservas, name='horario_reservas'),
     path('reasignar_pendientes/', views.reasignar_pendientes),
     path('asignar_manual/', views.asignar_manual),
+    path('replanificar_dia/', views.replanificar),
+    path('importar_reservas/', views.importar),
+    path('calendario/', views.calendario),
     path('cambiar_contraseña/', views.cambiar_contraseña),
     path('mapa_asignaciones/', views.mapa_asignaciones),
+    path('mapa_asignaciones/geojson/', views.mapa_geojson, name='mapa_geojson'),
+    path('mapa_asignaciones/ruta/', views.mapa_ruta, name='mapa_ruta'),
+    path('eventos_horario/', views.eventos_horario, name='eventos_horario'),
     path('ver_historial/', views.ver_historial, name='ver_historial'),
+    path('exportar_historial/', views.exportar_historial, name='exportar_historial'),
+    path('metrics/', views.metricas, name='metricas'),
 
     path('editar_perfil/<int:usuario_id>/', views.editar_perfil, name='editar_usuario'),
     path('inhabilitar_usuario/<int:usuario_id>/', views.inhabilitar_usuario, name='inhabilitar_usuario'),